@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 01:12:26 2026
+
+Streaming alerts on the incoming observations.
+
+Every row stored by store_data.append_file is evaluated against the rules
+of [Alert Rules] in config.ini as it is ingested (store listener, see
+install()). The rules keep a constant amount of state per station and rule
+and never read the history:
+
+    threshold <variable> <above|below> <limit>
+        The value crosses the limit. Fires once per crossing.
+    drop_rate <variable> <drop> <hours>
+        The variable falls faster than drop per hours (e.g. a pressure fall
+        of 3 hPa in 3 hours). The rate of change between consecutive samples
+        is smoothed exponentially with a time constant of hours.
+    zscore <variable> <z> <halflife hours> [<warm-up samples>]
+        The value deviates more than z standard deviations from its rolling
+        baseline, an exponentially weighted mean and variance with the given
+        half-life. Silent until the baseline has seen the warm-up samples.
+
+An alert is sent to the sinks (log, JSON lines file, webhook, see [Alerts])
+unless the same rule fired for the station less than cooldown ago
+(observation time) or more than max_per_hour alerts have been sent in the
+last hour. Suppressed alerts are counted in the metrics.
+
+    python3 cli.py alerts [--stations 41001,EFJY]   replays the station files
+"""
+
+import os
+import abc
+import json
+import math
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+
+import metrics
+import hot_cache
+import store_data
+
+# %% Attributes
+
+ENABLED = True;
+# Minimum time between two alerts of the same rule and station, in seconds
+COOLDOWN = 3600;
+# Maximum number of alerts sent per hour (all rules and stations), 0 = unlimited
+MAX_PER_HOUR = 30;
+# Pending webhook deliveries, further alerts are dropped
+WEBHOOK_QUEUE_SIZE = 100;
+WEBHOOK_TIMEOUT = 10;
+DEFAULT_WARMUP = 24;
+
+_LOCK = threading.Lock();
+_RULES = [];
+_SINKS = [];
+# (station id, rule name) -> rule state list
+_STATES = {};
+# (station id, rule name) -> observation time of the last sent alert
+_LAST_SENT = {};
+_LIMITER = None;
+_INSTALLED = False;
+
+# %% Classes
+
+class Rule(abc.ABC):
+    """
+    Base class of the rules. The state of a station is a list starting with
+    the time of the last evaluated observation and whether the rule is
+    firing, see update().
+    """
+    __slots__ = ('name', 'variable')
+
+    def __init__(self, name, variable):
+        self.name = name
+        self.variable = variable
+
+    def new_state(self):
+        return [None, False]
+
+    @abc.abstractmethod
+    def update(self, state, time, value):
+        """
+        Adds a sample to the state of a station.
+
+        :return: Alert message while the rule fires, otherwise None
+        """
+
+class ThresholdRule(Rule):
+    __slots__ = ('above', 'limit')
+
+    def __init__(self, name, variable, direction, limit):
+        super().__init__(name, variable)
+        if direction not in ('above', 'below'):
+            raise ValueError("Rule %s: direction must be above or below" % (name))
+        self.above = direction == 'above'
+        self.limit = float(limit)
+
+    def update(self, state, time, value):
+        if (value > self.limit) if self.above else (value < self.limit):
+            return "%s %g %s %g" % (self.variable, value, 'above' if self.above else 'below', self.limit)
+        return None
+
+class DropRateRule(Rule):
+    __slots__ = ('drop', 'window')
+
+    def __init__(self, name, variable, drop, hours):
+        super().__init__(name, variable)
+        self.drop = float(drop)
+        self.window = float(hours) * 3600
+
+    def new_state(self):
+        # last time, firing, last value, smoothed change per window
+        return [None, False, None, None]
+
+    def update(self, state, time, value):
+        last_time, last_value, rate = state[0], state[2], state[3]
+        state[2] = value
+        if last_time is None:
+            return None
+        change = (value - last_value) / (time - last_time) * self.window
+        alpha = 1.0 - math.exp(-(time - last_time) / self.window)
+        state[3] = rate = change if rate is None else rate + alpha * (change - rate)
+        if rate <= -self.drop:
+            return "%s falling %.3g per %g h" % (self.variable, -rate, self.window / 3600)
+        return None
+
+class ZScoreRule(Rule):
+    __slots__ = ('z', 'halflife', 'warmup')
+
+    def __init__(self, name, variable, z, halflife_hours, warmup=DEFAULT_WARMUP):
+        super().__init__(name, variable)
+        self.z = float(z)
+        self.halflife = float(halflife_hours) * 3600
+        self.warmup = int(warmup)
+
+    def new_state(self):
+        # last time, firing, samples, mean, variance
+        return [None, False, 0, 0.0, 0.0]
+
+    def update(self, state, time, value):
+        last_time, n, mean, variance = state[0], state[2], state[3], state[4]
+        message = None
+        if n >= self.warmup and variance > 0:
+            z = (value - mean) / math.sqrt(variance)
+            if abs(z) >= self.z:
+                message = "%s %g is %.1f sd from the baseline %.3g" % (self.variable, value, z, mean)
+        # Exponentially weighted mean and variance, weights halve every
+        # halflife. Equal weights while the EWMA would still be biased
+        # towards the first samples.
+        if n == 0:
+            state[3] = value
+        else:
+            alpha = max(1.0 - 0.5 ** ((time - last_time) / self.halflife), 1.0 / (n + 1))
+            diff = value - mean
+            increment = alpha * diff
+            state[3] = mean + increment
+            state[4] = (1.0 - alpha) * (variance + diff * increment)
+        state[2] = n + 1
+        return message
+
+RULE_TYPES = {'threshold': ThresholdRule, 'drop_rate': DropRateRule, 'zscore': ZScoreRule};
+
+class RateLimiter:
+    """
+    Token bucket allowing max_per_hour alerts per hour, in bursts of up to
+    max_per_hour.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, max_per_hour):
+        self.rate = max_per_hour / 3600.0
+        self.capacity = float(max_per_hour)
+        self.tokens = float(max_per_hour)
+        self.updated = time.monotonic()
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class FileSink:
+    """
+    Appends the alerts to a file, one JSON object per line.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    @property
+    def target(self):
+        return self.filename
+
+    def stop(self):
+        pass
+
+    def __call__(self, alert):
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self.lock, open(self.filename, 'a') as f:
+            f.write(json.dumps(alert) + '\n')
+
+class WebhookSink:
+    """
+    Posts the alerts as JSON to a URL from a background thread, so the
+    storing thread never waits for the network. Alerts are dropped when
+    WEBHOOK_QUEUE_SIZE deliveries are pending. stop() ends the thread
+    after the pending deliveries.
+    """
+    def __init__(self, url, timeout=WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def target(self):
+        return self.url
+
+    def stop(self):
+        """
+        Delivers the pending alerts and ends the thread, waiting at most
+        about twice the request timeout.
+        """
+        try:
+            # None marks the end of the deliveries
+            self.queue.put(None, timeout=self.timeout)
+        except queue.Full:
+            print("%s ERROR in alert webhook: %s" % (datetime.now(), 'queue full, thread not stopped'))
+            return
+        self.thread.join(self.timeout)
+
+    def __call__(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            metrics.inc('alerts_dropped_total', 1, 'Alerts dropped by a full webhook queue')
+
+    def run(self):
+        import requests
+        import fetch_data
+        while True:
+            alert = self.queue.get()
+            if alert is None:
+                break
+            try:
+                response = fetch_data.get_session().post(self.url, json=alert, timeout=self.timeout)
+                response.raise_for_status()
+            except requests.RequestException as error:
+                metrics.inc('alert_webhook_errors_total', 1, 'Failed webhook deliveries',
+                            error=type(error).__name__)
+                print("%s ERROR in alert webhook: %s" % (datetime.now(), error))
+
+# %% Methods
+
+def parse_rule(name, text):
+    """
+    :param text: Rule as in config.ini, e.g. 'threshold WSPD above 17.2'
+    :raises ValueError: On an unknown rule type or invalid parameters
+    """
+    fields = text.split()
+    if len(fields) < 2 or fields[0] not in RULE_TYPES:
+        raise ValueError("Rule %s: unknown rule '%s'" % (name, text))
+    try:
+        return RULE_TYPES[fields[0]](name, *fields[1:])
+    except TypeError:
+        raise ValueError("Rule %s: invalid parameters '%s'" % (name, text))
+
+def log_sink(alert):
+    print("%s ALERT %s %s: %s (observed %s)" % (datetime.now(), alert['station'], alert['rule'],
+                                                 alert['message'], alert['observed']))
+
+def add_sink(sink):
+    if sink not in _SINKS:
+        _SINKS.append(sink)
+
+def remove_sink(sink):
+    """
+    :return: True when the sink was registered
+    """
+    if sink in _SINKS:
+        _SINKS.remove(sink)
+        return True
+    return False
+
+def configure(enabled=None, rules=None, cooldown=None, max_per_hour=None, log=None,
+              filename=None, webhook=None):
+    """
+    Overrides the settings (see [Alerts] and [Alert Rules] in config.ini).
+
+    :param rules: Dictionary of rule name -> rule text, replaces the rules
+    :param log: Print the alerts
+    :param filename: File of the alerts (JSON lines), '' disables the file
+    :param webhook: URL receiving the alerts, '' disables the webhook
+    """
+    global ENABLED, COOLDOWN, MAX_PER_HOUR, _LIMITER;
+    with _LOCK:
+        if enabled is not None:
+            ENABLED = enabled
+        if rules is not None:
+            _RULES[:] = [parse_rule(name, text) for name, text in rules.items()]
+            _STATES.clear()
+        if cooldown is not None:
+            COOLDOWN = cooldown
+        if max_per_hour is not None:
+            MAX_PER_HOUR = max_per_hour
+            _LIMITER = RateLimiter(max_per_hour) if max_per_hour > 0 else None
+        if log is not None:
+            if log:
+                add_sink(log_sink)
+            else:
+                remove_sink(log_sink)
+        for kind, target in [(FileSink, filename), (WebhookSink, webhook)]:
+            if target is None:
+                continue
+            old = [sink for sink in _SINKS if isinstance(sink, kind)]
+            # An unchanged sink is kept, the webhook thread is not restarted
+            if target and [sink.target for sink in old] == [target]:
+                continue
+            for sink in old:
+                remove_sink(sink)
+                sink.stop()
+            if target:
+                _SINKS.append(kind(target))
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def evaluate(station_id, timestamp, values):
+    """
+    Evaluates the rules on an observation and updates their state.
+    Observations not newer than the last evaluated one of a rule (e.g. an
+    upserted correction) are skipped.
+
+    :param timestamp: Observation time, epoch seconds (UTC)
+    :param values: Dictionary of variable -> number
+    :return: List of the alerts of rules starting to fire
+    """
+    station_id = str(station_id)
+    alerts = []
+    with _LOCK:
+        for rule in _RULES:
+            value = values.get(rule.variable)
+            if value is None or math.isnan(value):
+                continue
+            key = (station_id, rule.name)
+            state = _STATES.get(key)
+            if state is None:
+                state = _STATES[key] = rule.new_state()
+            if state[0] is not None and timestamp <= state[0]:
+                continue
+            message = rule.update(state, timestamp, value)
+            state[0] = timestamp
+            # Alerts on entering the firing state, not on every sample
+            if message is not None and not state[1]:
+                alerts.append({'station': station_id, 'rule': rule.name, 'variable': rule.variable,
+                               'value': value, 'message': message, 'observed': format_time(timestamp),
+                               'time': datetime.now().isoformat(timespec='seconds')})
+            state[1] = message is not None
+    return alerts
+
+def is_allowed(alert, timestamp):
+    """
+    Rate limiting: the cooldown of the rule and station, then the hourly limit.
+    """
+    key = (alert['station'], alert['rule'])
+    with _LOCK:
+        last_sent = _LAST_SENT.get(key)
+        if last_sent is not None and timestamp - last_sent < COOLDOWN:
+            reason = 'cooldown'
+        elif _LIMITER is not None and not _LIMITER.allow():
+            reason = 'rate_limit'
+        else:
+            _LAST_SENT[key] = timestamp
+            return True
+    metrics.inc('alerts_suppressed_total', 1, 'Alerts suppressed by the rate limiting',
+                rule=alert['rule'], reason=reason)
+    return False
+
+def dispatch(alert, timestamp):
+    """
+    Sends an alert to every sink unless it is rate limited.
+
+    :return: True when the alert was sent
+    """
+    if not is_allowed(alert, timestamp):
+        return False
+    metrics.inc('alerts_total', 1, 'Alerts sent', rule=alert['rule'], station=alert['station'])
+    for sink in list(_SINKS):
+        try:
+            sink(alert)
+        except Exception as error:
+            print("%s ERROR in alert sink: %s" % (datetime.now(), error))
+    return True
+
+def on_stored(station_id, row):
+    """
+    Store listener evaluating every stored row.
+    """
+    if not ENABLED or not _RULES:
+        return
+    timestamp = hot_cache.get_observation_time(row)
+    if timestamp is None:
+        return
+    for alert in evaluate(station_id, timestamp, hot_cache.get_values(row)):
+        dispatch(alert, timestamp)
+
+def install():
+    """
+    Registers the alerts as a store listener, once per process.
+    """
+    global _INSTALLED;
+    with _LOCK:
+        if _INSTALLED:
+            return
+        _INSTALLED = True
+    store_data.add_listener(on_stored)
+
+def reset():
+    """
+    Forgets the rule states and the sent alerts.
+    """
+    with _LOCK:
+        _STATES.clear()
+        _LAST_SENT.clear()
+
+def replay(station_ids, folder=store_data.DATA_FOLDER):
+    """
+    Evaluates the rules over the station files, oldest row first, as if the
+    rows were being collected (e.g. to tune the rules). The hourly limit
+    does not apply.
+
+    :return: List of the alerts passing the cooldown
+    """
+    global _LIMITER;
+    reset()
+    limiter, _LIMITER = _LIMITER, None
+    sent = []
+    try:
+        for station_id in station_ids:
+            df = store_data.read_file(station_id, folder=folder)
+            for row in df.to_dict('records'):
+                timestamp = hot_cache.get_observation_time(row)
+                if timestamp is None:
+                    continue
+                for alert in evaluate(station_id, timestamp, hot_cache.get_values(row)):
+                    if is_allowed(alert, timestamp):
+                        sent.append(alert)
+    finally:
+        _LIMITER = limiter
+        reset()
+    return sent
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:02:15 2026
+
+Columnar binary archive for station time series.
+
+The archive is a typed copy of the station files below the data folder,
+partitioned by station and month of the observation time (see
+process_data.get_observation_time), one NumPy .npy file per column:
+
+    data/archive/<station>/schema.json
+    data/archive/<station>/<YYYY-MM>/columns.json
+    data/archive/<station>/<YYYY-MM>/observed.npy
+    data/archive/<station>/<YYYY-MM>/<n>.npy
+
+The type of every column is fixed per station in schema.json: datetime64[s]
+for the time stamps, float64 for the numbers and fixed width unicode for
+the text columns (e.g. the airport location), so the partitions of a
+station always agree. The rows of a partition are sorted by observation
+time, rows without a valid observation time are not archived. Columns are
+opened with memory-mapping, so reading a partition does not parse text and
+only touches the pages that are actually used.
+
+The readers (process_data.load_long_frame, retention.read_frame) bring the
+archive of a station up to date before reading it, see sync_station(): the
+rows appended to the station file since the last sync are added to their
+partitions, a rewritten file (compaction, backfill, deduplication) is
+converted again. The archive is written by the process reading it.
+
+    python3 archive_data.py convert [--data data/]
+    python3 archive_data.py export <station> <file> [--start S] [--end E]
+"""
+
+import io
+import os
+import csv
+import json
+import shutil
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+import store_data
+import process_data
+
+# %% Attributes
+
+# Folder of the archive below the data folder
+ARCHIVE_FOLDER = 'archive/';
+SCHEMA_FILE = 'schema.json';
+COLUMNS_FILE = 'columns.json';
+OBSERVED_FILE = 'observed.npy';
+# Files of the partitions holding all columns of a type, one row per column
+BLOCK_FILES = {'float': 'float.npy', 'time': 'time.npy'};
+# Text values treated as missing when typing the CSV columns
+MISSING_VALUES = ['', 'N/A', 'nan', 'NaN', 'None', 'MM'];
+# Text columns holding a time stamp (airport observation time)
+TIME_COLS = ['Time', 'timestamp'];
+TIME_FORMATS = {'Time': '%Y-%m-%d %H:%M:%S', 'timestamp': '%Y-%m-%dT%H:%M:%S'};
+
+_LOCK = threading.Lock();
+
+# %% Methods
+
+def get_archive_folder(data_folder=store_data.DATA_FOLDER):
+    return os.path.join(data_folder, ARCHIVE_FOLDER)
+
+def get_missing(series):
+    return (series.isna() | series.astype(str).isin(MISSING_VALUES)).to_numpy()
+
+def get_column_type(series):
+    """
+    :return: 'time' for the time stamps, 'float' for columns holding only
+             numbers and missing values, otherwise 'text'
+    """
+    if series.name in TIME_COLS:
+        return 'time'
+    missing = get_missing(series)
+    numbers = pd.to_numeric(series.where(~missing), errors='coerce')
+    return 'text' if (numbers.isna().to_numpy() & ~missing).any() else 'float'
+
+def get_schema(df, schema=None):
+    """
+    Types the columns of a frame of CSV values. The types of an existing
+    schema are kept, except that a float column holding text becomes text.
+
+    :return: List of [column, type] in the order of the columns
+    """
+    types = dict(schema or [])
+    new_schema = []
+    for col in df.columns:
+        kind = get_column_type(df[col])
+        if types.get(col) in ('time', 'text') or (types.get(col) == 'float' and kind != 'text'):
+            kind = types[col]
+        new_schema.append([col, kind])
+    return new_schema
+
+def to_typed_array(series, kind):
+    """
+    Converts a CSV column into the NumPy array of its schema type.
+    """
+    missing = get_missing(series)
+    if kind == 'time':
+        values = pd.to_datetime(series.where(~missing), errors='coerce', utc=True)
+        return values.dt.tz_localize(None).to_numpy(dtype='datetime64[s]')
+    if kind == 'float':
+        return pd.to_numeric(series.where(~missing), errors='coerce').to_numpy(dtype=np.float64)
+    return series.where(~missing, '').astype(str).to_numpy(dtype=str)
+
+def to_typed_arrays(df, schema):
+    """
+    :return: Tuple (column -> typed array, observation times as
+             datetime64[s]) of a frame of CSV values
+    """
+    arrays = {col: to_typed_array(df[col], kind) for col, kind in schema}
+    if 'Time' not in df.columns:
+        return arrays, np.full(len(df), np.datetime64('NaT'), dtype='datetime64[s]')
+    observed = process_data.get_observation_time(df).to_numpy(dtype='datetime64[s]')
+    return arrays, observed
+
+def get_months(observed):
+    return np.datetime_as_string(observed.astype('datetime64[M]'), unit='M')
+
+def get_station_folder(station_id, archive_folder):
+    return os.path.join(archive_folder, str(station_id))
+
+def write_partition(path, schema, arrays, observed):
+    """
+    Writes one partition, sorted by observation time, into a temporary
+    folder and swaps it into place. The float and the time columns are the
+    rows of one matrix each (every column stays contiguous), the text
+    columns have a file each.
+    """
+    order = np.argsort(observed, kind='stable')
+    tmp_path = '%s.%i.tmp' % (path.rstrip('/'), os.getpid())
+    old_path = '%s.%i.old' % (path.rstrip('/'), os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for kind, file_name in BLOCK_FILES.items():
+        cols = [col for col, col_kind in schema if col_kind == kind]
+        if cols:
+            np.save(os.path.join(tmp_path, file_name), np.stack([arrays[col][order] for col in cols]))
+            columns += [[col, file_name, i] for i, col in enumerate(cols)]
+    for i, (col, kind) in enumerate(schema):
+        if kind not in BLOCK_FILES:
+            file_name = '%i.npy' % (i)
+            np.save(os.path.join(tmp_path, file_name), arrays[col][order])
+            columns.append([col, file_name, None])
+    np.save(os.path.join(tmp_path, OBSERVED_FILE), observed[order])
+    with open(os.path.join(tmp_path, COLUMNS_FILE), 'w') as f:
+        json.dump(columns, f)
+
+    if os.path.isdir(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def load_schema(station_id, archive_folder):
+    filename = os.path.join(get_station_folder(station_id, archive_folder), SCHEMA_FILE)
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_schema(station_id, archive_folder, schema):
+    filename = os.path.join(get_station_folder(station_id, archive_folder), SCHEMA_FILE)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(schema, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+def remove_schema(station_id, archive_folder):
+    # Until the new schema is saved the next sync converts the whole file
+    filename = os.path.join(get_station_folder(station_id, archive_folder), SCHEMA_FILE)
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+def get_sync_state(data, stat, df, observed):
+    """
+    :param data: Complete lines of the station file that were converted
+    :return: Position of the station file up to which the archive is in
+             sync: the offset of the last row (which may still be replaced
+             by an upsert, see store_data.replace_last_row), the line before
+             it and the month and observation time of the last row
+    """
+    end = len(data)
+    if data.count(b'\n') <= 1 or df.empty:
+        # Only the header, the next rows start at the end
+        return {'inode': stat.st_ino, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'offset': end, 'previous': data.decode(), 'last': None}
+    offset = data.rfind(b'\n', 0, end - 1) + 1
+    start = data.rfind(b'\n', 0, offset - 1) + 1
+    last = None
+    if not np.isnat(observed[-1]):
+        last = [str(get_months(observed[-1:])[0]), str(observed[-1])]
+    return {'inode': stat.st_ino, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'offset': offset, 'previous': data[start:offset].decode(), 'last': last}
+
+def read_complete_lines(f):
+    data = f.read()
+    return data[:data.rfind(b'\n') + 1]
+
+def convert_station(station_id, data_folder=store_data.DATA_FOLDER, archive_folder=None):
+    """
+    Converts the whole CSV file of a station into monthly archive
+    partitions, partitions of months no longer in the file are removed.
+
+    :return: Number of partitions written
+    """
+    archive_folder = archive_folder or get_archive_folder(data_folder)
+    filename = store_data.get_filename(station_id, data_folder)
+    with open(filename, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        data = read_complete_lines(f)
+    df = pd.read_csv(io.BytesIO(data), delimiter=',', header=0) if data else pd.DataFrame()
+
+    schema = get_schema(df)
+    arrays, observed = to_typed_arrays(df, schema)
+    valid = ~np.isnat(observed)
+    months = get_months(observed)
+
+    station_folder = get_station_folder(station_id, archive_folder)
+    remove_schema(station_id, archive_folder)
+    os.makedirs(station_folder, exist_ok=True)
+    written = set()
+    for month in np.unique(months[valid]):
+        rows = valid & (months == month)
+        write_partition(os.path.join(station_folder, str(month)), schema,
+                        {col: values[rows] for col, values in arrays.items()}, observed[rows])
+        written.add(str(month))
+    for month in list_partitions(station_id, archive_folder):
+        if month not in written:
+            shutil.rmtree(os.path.join(station_folder, month), ignore_errors=True)
+
+    save_schema(station_id, archive_folder, {'columns': schema,
+                                             **get_sync_state(data, stat, df, observed)})
+    return len(written)
+
+def append_rows(station_id, schema, stat, chunk, archive_folder):
+    """
+    Adds the rows written since the last sync (the last row of the last
+    sync, possibly replaced, and the appended ones) to their partitions.
+
+    :param schema: Schema and sync state of the station
+    :param stat: os.stat of the station file
+    :param chunk: Complete lines of the station file from the sync offset
+    :return: False when the rows do not fit the schema and the station has
+             to be converted again
+    """
+    header = [col for col, kind in schema['columns']]
+    rows = list(csv.reader(chunk.decode().splitlines()))
+    if any(len(row) != len(header) for row in rows):
+        return False
+    df = pd.DataFrame(rows, columns=header)
+    if get_schema(df, schema['columns']) != schema['columns']:
+        return False
+    arrays, observed = to_typed_arrays(df, schema['columns'])
+    valid = ~np.isnat(observed)
+    months = get_months(observed)
+
+    station_folder = get_station_folder(station_id, archive_folder)
+    last = schema['last']
+    changed = set(months[valid].tolist()) | ({last[0]} if last is not None else set())
+    remove_schema(station_id, archive_folder)
+    for month in sorted(changed):
+        path = os.path.join(station_folder, month)
+        if os.path.isdir(path):
+            old_arrays, old_observed = read_partition_arrays(path)
+        else:
+            old_arrays = {col: values[:0] for col, values in arrays.items()}
+            old_observed = observed[:0]
+        keep = np.ones(len(old_observed), dtype=bool)
+        if last is not None and month == last[0]:
+            # The previous last row is in the chunk again, the last stored
+            # copy of its observation time (rows are sorted stably)
+            matches = np.flatnonzero(old_observed == np.datetime64(last[1]))
+            if len(matches):
+                keep[matches[-1]] = False
+        rows = valid & (months == month)
+        write_partition(path, schema['columns'],
+                        {col: np.concatenate([old_arrays[col][keep], arrays[col][rows]]) for col in arrays},
+                        np.concatenate([old_observed[keep], observed[rows]]))
+
+    # Offsets of the chunk are relative to the line before it
+    previous = schema['previous'].encode()
+    state = get_sync_state(previous + chunk, stat, df, observed)
+    state['offset'] += schema['offset'] - len(previous)
+    save_schema(station_id, archive_folder, {'columns': schema['columns'], **state})
+    return True
+
+def sync_station(station_id, data_folder=store_data.DATA_FOLDER, archive_folder=None):
+    """
+    Brings the archive of a station up to date with its CSV file. Rows
+    appended (or the newest row replaced) since the last sync are added to
+    their partitions, otherwise the file is converted again.
+
+    :return: 'unchanged', 'appended' or 'converted'
+    :raises FileNotFoundError: When the station has no CSV file
+    """
+    archive_folder = archive_folder or get_archive_folder(data_folder)
+    filename = store_data.get_filename(station_id, data_folder)
+    with _LOCK:
+        schema = load_schema(station_id, archive_folder)
+        with open(filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if (schema is not None and stat.st_ino == schema['inode']
+                    and (stat.st_size, stat.st_mtime_ns) == (schema['size'], schema['mtime_ns'])):
+                return 'unchanged'
+            previous = schema['previous'].encode() if schema is not None else b''
+            start = schema['offset'] - len(previous) if schema is not None else 0
+            if (schema is not None and stat.st_ino == schema['inode'] and schema['offset'] > 0
+                    and stat.st_size >= schema['offset'] and start >= 0):
+                f.seek(start)
+                if f.read(len(previous)) == previous:
+                    chunk = read_complete_lines(f)
+                    if not chunk:
+                        return 'unchanged'
+                    if append_rows(station_id, schema, stat, chunk, archive_folder):
+                        return 'appended'
+        convert_station(station_id, data_folder, archive_folder)
+        return 'converted'
+
+def convert_folder(data_folder=store_data.DATA_FOLDER, archive_folder=None):
+    """
+    Converts every station file of the data folder into the archive.
+
+    :return: Dictionary of station id -> number of partitions written
+    """
+    converted = {}
+    for file_name in sorted(os.listdir(data_folder)):
+        if not file_name.endswith('.txt') or file_name == store_data.STATION_INFO_FILE:
+            continue
+        station_id = file_name[:-len('.txt')]
+        with _LOCK:
+            converted[station_id] = convert_station(station_id, data_folder, archive_folder)
+    return converted
+
+def list_stations(archive_folder):
+    if not os.path.isdir(archive_folder):
+        return []
+    return sorted(name for name in os.listdir(archive_folder)
+                  if os.path.isdir(os.path.join(archive_folder, name)))
+
+def list_partitions(station_id, archive_folder, start=None, end=None):
+    """
+    Lists the months (YYYY-MM) archived for a station, optionally limited to
+    the months overlapping [start, end].
+    """
+    path = get_station_folder(station_id, archive_folder)
+    if not os.path.isdir(path):
+        return []
+    # Partitions being swapped have a .tmp / .old suffix
+    months = sorted(name for name in os.listdir(path)
+                    if len(name) == 7 and os.path.isdir(os.path.join(path, name)))
+    if start is not None:
+        months = [m for m in months if m >= pd.Timestamp(start).strftime('%Y-%m')]
+    if end is not None:
+        months = [m for m in months if m <= pd.Timestamp(end).strftime('%Y-%m')]
+    return months
+
+def read_layout(path):
+    with open(os.path.join(path, COLUMNS_FILE)) as f:
+        return [tuple(entry) for entry in json.load(f)]
+
+def read_partition_arrays(path, columns=None):
+    """
+    Opens the columns of one partition as read-only memory maps (no copy).
+
+    :return: Tuple (column -> numpy.memmap, observation times)
+    """
+    layout = read_layout(path)
+    files = {}
+    arrays = {}
+    for col, file_name, row in layout:
+        if columns is None or col in columns:
+            if file_name not in files:
+                files[file_name] = np.load(os.path.join(path, file_name), mmap_mode='r')
+            arrays[col] = files[file_name] if row is None else files[file_name][row]
+    return arrays, np.load(os.path.join(path, OBSERVED_FILE), mmap_mode='r')
+
+def read_partition(station_id, month, archive_folder, columns=None):
+    """
+    :return: Dictionary of column name -> numpy.memmap
+    """
+    path = os.path.join(get_station_folder(station_id, archive_folder), month)
+    return read_partition_arrays(path, columns)[0]
+
+def read_station(station_id, archive_folder, columns=None, start=None, end=None, observed=False):
+    """
+    Reads the archived time series of a station into a DataFrame, oldest
+    observation first. Only the partitions and files of the columns needed
+    are touched, the column matrices of the partitions are joined once per
+    file.
+
+    :param columns: Columns to read, default all
+    :param start: First observation time to include
+    :param end: Last observation time to include
+    :param observed: Return the observation times as well
+    :return: DataFrame, or tuple (DataFrame, observation times as
+             datetime64[s]) when observed is set
+    """
+    schema = load_schema(station_id, archive_folder)
+    names = [col for col, kind in schema['columns']] if schema is not None else []
+    if columns is not None:
+        names = [col for col in names if col in columns]
+
+    layout = None
+    blocks = {}
+    times = []
+    for month in list_partitions(station_id, archive_folder, start, end):
+        path = os.path.join(get_station_folder(station_id, archive_folder), month)
+        if layout is None:
+            layout = [entry for entry in read_layout(path) if entry[0] in names]
+        for file_name in dict.fromkeys(file_name for col, file_name, row in layout):
+            blocks.setdefault(file_name, []).append(np.load(os.path.join(path, file_name), mmap_mode='r'))
+        times.append(np.load(os.path.join(path, OBSERVED_FILE), mmap_mode='r'))
+    if not times:
+        df = pd.DataFrame({col: np.empty(0, dtype=get_dtype(kind))
+                           for col, kind in schema['columns'] if col in names}
+                          if schema is not None else {}, columns=names)
+        return (df, np.empty(0, dtype='datetime64[s]')) if observed else df
+
+    times = np.concatenate(times) if len(times) > 1 else times[0]
+    keep = np.ones(len(times), dtype=bool)
+    if start is not None:
+        keep &= times >= np.datetime64(pd.Timestamp(start), 's')
+    if end is not None:
+        keep &= times <= np.datetime64(pd.Timestamp(end), 's')
+    if not keep.all():
+        times = times[keep]
+
+    frames = []
+    for file_name, parts in blocks.items():
+        block = np.concatenate(parts, axis=-1) if len(parts) > 1 else parts[0]
+        block = block if keep.all() else block[..., keep]
+        entries = [(col, row) for col, name, row in layout if name == file_name]
+        if entries[0][1] is None:
+            frames.append(pd.DataFrame({entries[0][0]: block}))
+            continue
+        rows = [row for col, row in entries]
+        if rows != list(range(len(block))):
+            block = block[rows]
+        # The transposed matrix is the block of the DataFrame, no copy
+        frames.append(pd.DataFrame(block.T, columns=[col for col, row in entries], copy=False))
+    if not frames:
+        df = pd.DataFrame(index=pd.RangeIndex(len(times)))
+    else:
+        df = pd.concat(frames, axis=1) if len(frames) > 1 else frames[0]
+        df = df if list(df.columns) == names else df[names]
+    return (df, times) if observed else df
+
+def get_dtype(kind):
+    return {'time': 'datetime64[s]', 'float': np.float64}.get(kind, str)
+
+def load_station(station_id, data_folder=store_data.DATA_FOLDER, columns=None, start=None, end=None,
+                 observed=False):
+    """
+    Reads a station from the archive after bringing it up to date with the
+    station file (see sync_station), replaces parsing the CSV file.
+
+    :raises FileNotFoundError: When the station has no CSV file
+    """
+    archive_folder = get_archive_folder(data_folder)
+    sync_station(station_id, data_folder, archive_folder)
+    return read_station(station_id, archive_folder, columns, start, end, observed)
+
+def to_text(values, kind, col):
+    """
+    :return: Column as written by store_data, whole numbers without decimals
+    """
+    if kind == 'time':
+        return pd.Series(values).dt.strftime(TIME_FORMATS.get(col, TIME_FORMATS['Time'])).fillna('')
+    if kind == 'float':
+        values = np.asarray(values, dtype=np.float64)
+        text = values.astype(str).astype(object)
+        whole = np.isfinite(values) & (values == np.round(values))
+        text[whole] = values[whole].astype(np.int64).astype(str)
+        return text
+    return values
+
+def export_csv(station_id, filename, archive_folder, start=None, end=None):
+    """
+    Exports the archived time series of a station back into the CSV layout
+    used by store_data (oldest observation first).
+    """
+    schema = load_schema(station_id, archive_folder)
+    df = read_station(station_id, archive_folder, start=start, end=end)
+    df = pd.DataFrame({col: to_text(df[col].to_numpy(), kind, col)
+                       for col, kind in (schema['columns'] if schema is not None else [])},
+                      columns=df.columns)
+    df.to_csv(filename, sep=',', index=False)
+    return len(df)
+
+# %% Command line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Columnar station archive')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert = subparsers.add_parser('convert', help='Convert data/*.txt into the archive')
+    convert.add_argument('--data', default=store_data.DATA_FOLDER)
+    convert.add_argument('--archive', default=None, help='Default: archive/ below the data folder')
+    export = subparsers.add_parser('export', help='Export a station back to CSV')
+    export.add_argument('station_id')
+    export.add_argument('filename')
+    export.add_argument('--data', default=store_data.DATA_FOLDER)
+    export.add_argument('--archive', default=None, help='Default: archive/ below the data folder')
+    export.add_argument('--start', default=None)
+    export.add_argument('--end', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for station_id, n in convert_folder(args.data, args.archive).items():
+            print("%s: %i partitions" % (station_id, n))
+    if args.command == 'export':
+        archive_folder = args.archive or get_archive_folder(args.data)
+        n = export_csv(args.station_id, args.filename, archive_folder, args.start, args.end)
+        print("Wrote %i rows to %s" % (n, args.filename))
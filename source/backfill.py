@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:02:41 2026
+
+Historical backfill of the buoy station files.
+
+The monitoring stores only the newest row of every realtime2 file. The
+backfill ingests the complete realtime2 file (about 45 days) and the yearly
+historical standard meteorological archives of NDBC:
+
+    https://www.ndbc.noaa.gov/data/historical/stdmet/<station>h<year>.txt.gz
+
+The files are downloaded in threads and parsed in parallel processes. Each
+station file is then merged with all of its new rows and rewritten
+atomically in one pass, oldest first. Observations already in the file are
+kept as they are, observations already rolled up into the hourly or daily
+tier (see retention.py) are skipped. The running statistics of the station are recomputed
+afterwards.
+
+Progress is kept in data/.backfill.json: ingested (or missing) archive
+years are skipped and only realtime2 rows newer than the last ingested
+observation are added, so an interrupted backfill continues where it
+stopped. The station files are rewritten, so the backfill takes the
+collector PID file (see cli.py) and does not run next to a collector.
+
+    python3 cli.py backfill [--stations 41001,41002] [--years 2019-2023]
+                            [--no-archive] [--no-realtime] [--workers N] [--force]
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import requests
+
+import get_marine
+import fetch_data
+import store_data
+import retention
+import running_stats
+
+# %% Attributes
+
+URL_BUOY_HISTORICAL_ROOT = "https://www.ndbc.noaa.gov/data/historical/stdmet/";
+STATE_FILE = '.backfill.json';
+# Number of complete years ingested by default
+DEFAULT_YEARS = 5;
+# Columns of the station files of the buoys (realtime2 order)
+BUOY_COLS = ['#YY', 'MM', 'DD', 'hh', 'mm', 'WDIR', 'WSPD', 'GST', 'WVHT', 'DPD', 'APD',
+             'MWD', 'PRES', 'ATMP', 'WTMP', 'DEWP', 'VIS', 'PTDY', 'TIDE'];
+# Missing value markers of the historical archives, per column
+SENTINELS = {'WDIR': 999, 'WSPD': 99, 'GST': 99, 'WVHT': 99, 'DPD': 99, 'APD': 99,
+             'MWD': 999, 'PRES': 9999, 'ATMP': 999, 'WTMP': 999, 'DEWP': 999,
+             'VIS': 99, 'PTDY': 99, 'TIDE': 99};
+# Column names of the older archive files
+RENAMED_COLS = {'YYYY': '#YY', 'YY': '#YY', 'WD': 'WDIR', 'BAR': 'PRES'};
+
+# %% Parsing (runs in the worker processes)
+
+def parse_file(kind, text):
+    """
+    Parses a realtime2 or historical stdmet file.
+
+    :param kind: 'realtime2' or 'stdmet'
+    :return: DataFrame with the BUOY_COLS, oldest first, without rows of
+             an invalid observation time
+    """
+    lines = text.split('\n', 1)
+    if not lines[0].strip():
+        return pd.DataFrame(columns=BUOY_COLS)
+    header = [RENAMED_COLS.get(col, col) for col in lines[0].split()]
+    # Headers and units lines start with #, the header of archives before
+    # 2007 does not
+    df = pd.read_csv(io.StringIO(text), sep=r'\s+', header=None, names=header,
+                     comment='#' if lines[0].startswith('#') else None,
+                     skiprows=0 if lines[0].startswith('#') else 1,
+                     na_values=[get_marine.MISSING_VALUE], dtype=np.float64)
+
+    for col, sentinel in SENTINELS.items():
+        if kind == 'stdmet' and col in df.columns:
+            df.loc[df[col] >= sentinel, col] = np.nan
+    if 'mm' not in df.columns:
+        df['mm'] = 0.0
+    # Two digit years of the oldest archives
+    df.loc[df['#YY'] < 100, '#YY'] += 1900
+
+    df = df.reindex(columns=BUOY_COLS)
+    df = df.dropna(subset=get_marine.TIME_COLS)
+    df[get_marine.TIME_COLS] = df[get_marine.TIME_COLS].astype(np.int64)
+    return sort_by_observation(df)
+
+def get_observation_keys(df):
+    """
+    :return: Observation time of every row as an int64 YYYYMMDDhhmm
+    """
+    fields = df[get_marine.TIME_COLS].apply(pd.to_numeric, errors='coerce').fillna(0)
+    fields = fields.to_numpy(dtype=np.int64)
+    return (fields[:, 0] * 100000000 + fields[:, 1] * 1000000 + fields[:, 2] * 10000
+            + fields[:, 3] * 100 + fields[:, 4])
+
+def sort_by_observation(df):
+    keys = get_observation_keys(df)
+    return df.iloc[np.argsort(keys, kind='stable')].reset_index(drop=True)
+
+# %% State
+
+def get_state_filename(folder):
+    return os.path.join(folder, STATE_FILE)
+
+def load_state(folder):
+    """
+    :return: Dictionary of station id -> {'stdmet': {year: 'done' or
+             'missing'}, 'realtime2': last ingested observation key}
+    """
+    filename = get_state_filename(folder)
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def save_state(folder, state):
+    filename = get_state_filename(folder)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+# %% Methods
+
+def get_default_years(n_years=DEFAULT_YEARS):
+    year = datetime.now().year
+    return list(range(year - n_years, year))
+
+def parse_years(text):
+    """
+    :param text: Years as '2019-2023' or '2019,2021'
+    """
+    years = []
+    for part in str(text).split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            years += range(int(first), int(last) + 1)
+        elif part.strip():
+            years.append(int(part))
+    return sorted(set(years))
+
+def get_units(station_id, years, station_state, archive=True, realtime=True):
+    """
+    :return: List of (kind, station_id, year) still to be ingested
+    """
+    units = []
+    if archive:
+        done = station_state.get('stdmet', {})
+        units += [('stdmet', station_id, year) for year in years if str(year) not in done]
+    if realtime:
+        units.append(('realtime2', station_id, None))
+    return units
+
+def download(kind, station_id, year, timeout=60):
+    """
+    :return: Text of the file, None when the archive does not exist
+    """
+    if kind == 'realtime2':
+        text, modified = fetch_data.fetch(get_marine.URL_BUOY_REALTIME_ROOT + str(station_id) + '.txt',
+                                          timeout=timeout)
+        return text
+    url = '%s%sh%i.txt.gz' % (URL_BUOY_HISTORICAL_ROOT, str(station_id).lower(), year)
+    response = fetch_data.get_session().get(url, timeout=timeout)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    content = response.content
+    # Served as application/x-gzip, requests does not decode it
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+    return content.decode('utf-8', errors='replace')
+
+def concat_rows(frames, columns):
+    """
+    Concatenates frames of rows into the given columns. Empty frames and
+    all-NA columns are left out (pandas will count them for the result
+    dtypes), missing columns are NaN.
+    """
+    frames = [df.dropna(axis=1, how='all') for df in frames if df is not None and not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True).reindex(columns=columns)
+
+def merge_station(station_id, frames, folder):
+    """
+    Merges the parsed rows into the station file in one rewrite. Rows of an
+    observation time already in the file or in a rolled up bucket (see
+    retention.get_rolled_up) are dropped.
+
+    :return: Number of added rows
+    """
+    filename = store_data.get_filename(station_id, folder)
+    df_new = concat_rows(frames, BUOY_COLS)
+    if os.path.isfile(filename) and os.path.getsize(filename) > 0:
+        df_old = store_data.read_file(station_id, folder=folder)
+        header = list(df_old.columns)
+    else:
+        df_old = None
+        header = ['Time'] + BUOY_COLS
+
+    keys = get_observation_keys(df_new)
+    # Later files win, the realtime2 rows replace the archive rows
+    keep = ~pd.Series(keys).duplicated(keep='last').to_numpy()
+    if df_old is not None and all(col in df_old.columns for col in get_marine.TIME_COLS):
+        keep &= ~np.isin(keys, get_observation_keys(df_old))
+    times = pd.to_datetime(df_new[get_marine.TIME_COLS].set_axis(
+        ['year', 'month', 'day', 'hour', 'minute'], axis=1), errors='coerce')
+    keep &= ~retention.get_rolled_up(station_id, times, folder)
+    df_new = df_new[keep]
+    if df_new.empty:
+        return 0
+
+    # The storage time of the backfilled rows is their observation time
+    df_new = df_new.copy()
+    df_new.insert(0, 'Time', times[keep].dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+    df_merged = concat_rows([df_old, df_new], header)
+    df_merged = sort_by_observation(df_merged)
+    for col in get_marine.TIME_COLS:
+        if col in df_merged.columns:
+            df_merged[col] = pd.to_numeric(df_merged[col], errors='coerce').astype('Int64')
+    store_data.write_frame_atomic(filename, df_merged)
+    running_stats.rebuild_station(station_id, folder)
+    return len(df_new)
+
+def backfill(station_ids, years=None, folder=store_data.DATA_FOLDER, archive=True,
+             realtime=True, max_workers=None, max_downloads=4, force=False,
+             timeout=60, verbose=True):
+    """
+    Ingests the realtime2 files and the yearly archives of the stations.
+
+    :param years: Archive years, defaults to the last DEFAULT_YEARS complete years
+    :param max_workers: Number of parsing processes (default: CPU count)
+    :param max_downloads: Number of concurrent downloads
+    :param force: Ignore the progress of earlier runs for these stations
+    :return: Dictionary of station id -> number of added rows
+    """
+    years = years if years is not None else get_default_years()
+    state = load_state(folder)
+    if force:
+        # The progress of the other stations is kept
+        for station_id in station_ids:
+            state.pop(str(station_id), None)
+    pending = {}
+    for station_id in station_ids:
+        units = get_units(station_id, years, state.get(str(station_id), {}), archive, realtime)
+        if units:
+            pending[str(station_id)] = units
+
+    added = {}
+    results = {station_id: [] for station_id in pending}
+    remaining = {station_id: len(units) for station_id, units in pending.items()}
+
+    def finish(station_id):
+        station_state = state.setdefault(station_id, {})
+        frames = []
+        # Archives by year and the realtime2 file last, newer rows win
+        for kind, year, df in sorted(results.pop(station_id),
+                                     key=lambda result: (result[0] == 'realtime2', result[1] or 0)):
+            if kind == 'stdmet':
+                station_state.setdefault('stdmet', {})[str(year)] = 'missing' if df is None else 'done'
+            elif df is not None and not df.empty:
+                # Only the rows newer than the previous run are new
+                keys = get_observation_keys(df)
+                df = df[keys > station_state.get('realtime2', 0)]
+                if len(keys):
+                    station_state['realtime2'] = max(int(keys.max()), station_state.get('realtime2', 0))
+            if df is not None and not df.empty:
+                frames.append(df)
+        added[station_id] = merge_station(station_id, frames, folder)
+        save_state(folder, state)
+        if verbose:
+            print("%s: added %i rows" % (station_id, added[station_id]))
+
+    with ThreadPoolExecutor(max_workers=max_downloads) as downloads, \
+         ProcessPoolExecutor(max_workers=max_workers) as parsers:
+        download_futures = {downloads.submit(download, kind, station_id, year, timeout): (kind, station_id, year)
+                            for station_id, units in pending.items() for kind, station_id, year in units}
+        parse_futures = {}
+        for future in as_completed(download_futures):
+            kind, station_id, year = download_futures[future]
+            try:
+                text = future.result()
+            except requests.RequestException as error:
+                # The unit is retried by the next run
+                if verbose:
+                    print("%s %s %s: %s" % (station_id, kind, year or '', error))
+                remaining[station_id] -= 1
+                continue
+            if text is None:
+                results[station_id].append((kind, year, None))
+                remaining[station_id] -= 1
+                continue
+            parse_futures[parsers.submit(parse_file, kind, text)] = (kind, station_id, year)
+
+            # Stations whose files are all parsed are merged while the rest download
+            for parse_future in [f for f in parse_futures if f.done()]:
+                collect_parsed(parse_future, parse_futures, results, remaining, finish, verbose)
+            for station_id in [s for s in results if remaining[s] == 0]:
+                finish(station_id)
+
+        for parse_future in as_completed(list(parse_futures)):
+            collect_parsed(parse_future, parse_futures, results, remaining, finish, verbose)
+        for station_id in [s for s in results if remaining[s] == 0]:
+            finish(station_id)
+
+    return added
+
+def collect_parsed(future, parse_futures, results, remaining, finish, verbose=True):
+    kind, station_id, year = parse_futures.pop(future)
+    try:
+        results[station_id].append((kind, year, future.result()))
+    except Exception as error:
+        # A malformed or truncated file, the unit stays unfinished in the
+        # state and is retried by the next run
+        if verbose:
+            print("%s %s %s: parsing failed: %s" % (station_id, kind, year or '', error))
+    remaining[station_id] -= 1
+    if remaining[station_id] == 0:
+        finish(station_id)
+
+# %% Command line
+
+if __name__ == '__main__':
+    import cli
+    sys.exit(cli.main(['backfill'] + sys.argv[1:]))
@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:03:26 2026
+
+Offline performance benchmarks of the collection, storage, statistics and
+map code.
+
+The NOAA sources are replaced by a local HTTP server serving the recorded
+files of benchmarks/fixtures (realtime2 station file, station table, decoded
+METAR and METAR cycle file) under the same paths as the real servers, with
+ETag / 304 and gzip support. The storage and statistics benchmarks run on
+synthetic multi-year station histories (stations x hourly samples) written
+to a temporary folder. Every benchmark reports its throughput, latency
+percentiles and peak memory (tracemalloc, measured in a separate pass) as
+JSON.
+
+    python3 benchmark.py [--stations 20] [--samples 17520] [--rounds 20]
+                         [--only marine,stats] [--output results.json]
+                         [--compare baseline.json] [--threshold 0.2]
+    python3 benchmark.py record [--station 41001] [--airport EFJY] [--cycle 19]
+
+'record' replaces the fixtures with the current files of the NOAA servers.
+With --compare the exit status is 1 when the median latency of a benchmark
+grew by more than the threshold (relative) from the baseline report.
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import time
+import shutil
+import hashlib
+import platform
+import argparse
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+import cache_data
+import fetch_data
+import get_marine
+import get_airport
+
+# %% Attributes
+
+ROOT_FOLDER = os.path.dirname(os.path.abspath(__file__));
+FIXTURE_FOLDER = os.path.join(ROOT_FOLDER, 'benchmarks', 'fixtures');
+# Fixture files and the NOAA URLs they were recorded from ({} is filled in)
+FIXTURES = {'realtime2': ('realtime2_{}.txt', get_marine.URL_BUOY_REALTIME_ROOT + '{}.txt'),
+            'station_table': ('station_table.txt', get_marine.URL_BUOY_STATION_INFO),
+            'metar_decoded': ('metar_decoded_{}.TXT', get_airport.URL_AIRPORTS_ROOT + '{}.TXT'),
+            'metar_cycle': ('metar_cycle_{:02d}Z.TXT', get_airport.URL_METAR_CYCLES_ROOT + '{:02d}Z.TXT')};
+FIXTURE_STATION = '41001';
+FIXTURE_AIRPORT = 'EFJY';
+FIXTURE_CYCLE = 19;
+
+# Default scale of the synthetic histories: 20 stations x 2 years of hours
+DEFAULT_STATIONS = 20;
+DEFAULT_SAMPLES = 2 * 365 * 24;
+DEFAULT_MAP_STATIONS = 1000;
+DEFAULT_ROUNDS = 20;
+DEFAULT_THRESHOLD = 0.2;
+
+# Columns of the synthetic histories (see store_data.append_file)
+BUOY_COLS = ['#YY', 'MM', 'DD', 'hh', 'mm', 'WDIR', 'WSPD', 'GST', 'WVHT', 'DPD', 'APD',
+             'MWD', 'PRES', 'ATMP', 'WTMP', 'DEWP', 'VIS', 'PTDY', 'TIDE'];
+AIRPORT_COLS = ['timestamp', 'location', 'latitude', 'longitude', 'wind_speed_m_s',
+                'visibility_km', 'temperature_C', 'dew_point_C', 'relative_humidity',
+                'pressure_hPa'];
+# Share of missing values in the synthetic histories
+MISSING_SHARE = 0.05;
+
+# name -> (function, maximum number of rounds or None)
+BENCHMARKS = {};
+
+# %% Local NOAA server
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves the fixtures under the NOAA paths. Every realtime2 station and
+    every decoded METAR airport gets the recorded file of the fixture.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def get_body(self):
+        path = self.path.split('?')[0]
+        files = self.server.files
+        if path == '/data/realtime2/':
+            return files['listing'], 'text/html'
+        if path.startswith('/data/realtime2/') and path.endswith('.txt'):
+            return files['realtime2'], 'text/plain'
+        if path == '/data/stations/station_table.txt':
+            return files['station_table'], 'text/plain'
+        if path.startswith('/data/observations/metar/decoded/'):
+            return files['metar_decoded'], 'text/plain'
+        if path.startswith('/data/observations/metar/cycles/'):
+            return files['metar_cycle'], 'text/plain'
+        return None, None
+
+    def do_GET(self):
+        body, content_type = self.get_body()
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % (hashlib.md5(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            body = self.server.gzipped.setdefault(etag, gzip.compress(body, 6))
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('ETag', etag)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def read_fixture(kind, name=None):
+    filename, url = FIXTURES[kind]
+    with open(os.path.join(FIXTURE_FOLDER, filename.format(name)), 'rb') as f:
+        return f.read()
+
+def get_listing(station_ids):
+    """
+    :return: Directory listing of the realtime2 folder (Apache style)
+    """
+    links = ['<a href="../">../</a>']
+    for station_id in station_ids:
+        for extension in ('.txt', '.spec', '.cwind'):
+            links.append('<a href="%s%s">%s%s</a>' % (station_id, extension, station_id, extension))
+    return ('<html><head><title>Index of /data/realtime2</title></head><body>'
+            '<h1>Index of /data/realtime2</h1><pre>%s</pre></body></html>'
+            % ('\n'.join(links))).encode()
+
+@contextlib.contextmanager
+def noaa_server():
+    """
+    Runs the local NOAA server and points the source modules to it, the disk
+    cache is disabled meanwhile.
+
+    :return: Base URL of the server
+    """
+    station_table = read_fixture('station_table')
+    station_ids = [line.split('|')[0].strip() for line in station_table.decode().splitlines()
+                   if line and not line.startswith('#')]
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    server.daemon_threads = True
+    server.files = {'listing': get_listing(station_ids), 'station_table': station_table,
+                    'realtime2': read_fixture('realtime2', FIXTURE_STATION),
+                    'metar_decoded': read_fixture('metar_decoded', FIXTURE_AIRPORT),
+                    'metar_cycle': read_fixture('metar_cycle', FIXTURE_CYCLE)}
+    server.gzipped = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base = 'http://127.0.0.1:%i/data/' % (server.server_address[1])
+    urls = (get_marine.URL_BUOY_REALTIME_ROOT, get_marine.URL_BUOY_STATION_INFO,
+            get_airport.URL_AIRPORTS_ROOT, get_airport.URL_METAR_CYCLES_ROOT)
+    cache_enabled = cache_data.ENABLED
+    get_marine.URL_BUOY_REALTIME_ROOT = base + 'realtime2/'
+    get_marine.URL_BUOY_STATION_INFO = base + 'stations/station_table.txt'
+    get_airport.URL_AIRPORTS_ROOT = base + 'observations/metar/decoded/'
+    get_airport.URL_METAR_CYCLES_ROOT = base + 'observations/metar/cycles/'
+    cache_data.configure(enabled=False)
+    fetch_data.clear_entries()
+    try:
+        yield base
+    finally:
+        (get_marine.URL_BUOY_REALTIME_ROOT, get_marine.URL_BUOY_STATION_INFO,
+         get_airport.URL_AIRPORTS_ROOT, get_airport.URL_METAR_CYCLES_ROOT) = urls
+        cache_data.configure(enabled=cache_enabled)
+        fetch_data.clear_entries()
+        server.shutdown()
+        server.server_close()
+
+# %% Synthetic histories
+
+def get_signal(rng, hours, mean, seasonal, diurnal, noise):
+    """
+    :return: Seasonal and diurnal cycle with noise, about MISSING_SHARE NaN
+    """
+    values = (mean + seasonal * np.sin(2 * np.pi * hours / (365.25 * 24))
+              + diurnal * np.sin(2 * np.pi * hours / 24) + rng.normal(0, noise, len(hours)))
+    values[rng.random(len(hours)) < MISSING_SHARE] = np.nan
+    return np.round(values, 1)
+
+def write_buoy_history(filename, n_samples, end, rng):
+    times = pd.date_range(end=end, periods=n_samples, freq='h')
+    hours = np.arange(n_samples, dtype=np.float64)
+    df = pd.DataFrame({'Time': (times + pd.Timedelta(minutes=12)).strftime('%Y-%m-%d %H:%M:%S'),
+                       '#YY': times.year, 'MM': times.month, 'DD': times.day,
+                       'hh': times.hour, 'mm': 50})
+    df['WDIR'] = np.round(rng.uniform(0, 360, n_samples))
+    df['WSPD'] = np.abs(get_signal(rng, hours, 6, 2, 1, 1.5))
+    df['GST'] = df['WSPD'] + np.round(rng.uniform(0.5, 3, n_samples), 1)
+    df['WVHT'] = np.abs(get_signal(rng, hours, 1.6, 0.6, 0, 0.3))
+    df['DPD'] = get_signal(rng, hours, 9, 1, 0, 1.5)
+    df['APD'] = get_signal(rng, hours, 6, 0.5, 0, 1)
+    df['MWD'] = np.round(rng.uniform(0, 360, n_samples))
+    df['PRES'] = get_signal(rng, hours, 1015, 4, 0.5, 3)
+    df['ATMP'] = get_signal(rng, hours, 18, 6, 1.5, 0.8)
+    df['WTMP'] = get_signal(rng, hours, 20, 5, 0.2, 0.2)
+    df['DEWP'] = df['ATMP'] - np.round(rng.uniform(1, 6, n_samples), 1)
+    df['VIS'] = np.nan
+    df['PTDY'] = get_signal(rng, hours, 0, 0, 0, 1)
+    df['TIDE'] = np.nan
+    df.to_csv(filename, index=False, na_rep='nan')
+
+def write_airport_history(filename, n_samples, end, rng):
+    times = pd.date_range(end=end, periods=n_samples, freq='h')
+    hours = np.arange(n_samples, dtype=np.float64)
+    temperature = get_signal(rng, hours, 8, 12, 3, 1)
+    dew_point = temperature - np.round(rng.uniform(0, 8, n_samples), 1)
+    df = pd.DataFrame({'Time': (times + pd.Timedelta(minutes=25)).strftime('%Y-%m-%d %H:%M:%S'),
+                       'timestamp': (times + pd.Timedelta(minutes=20)).strftime('%Y-%m-%dT%H:%M:%S'),
+                       'location': 'Synthetic Airport', 'latitude': 62.4, 'longitude': 25.68})
+    df['wind_speed_m_s'] = np.abs(get_signal(rng, hours, 4, 1, 1, 1.5))
+    df['visibility_km'] = 11.27
+    df['temperature_C'] = temperature
+    df['dew_point_C'] = dew_point
+    # Magnus formula, as get_airport.relative_humidity
+    df['relative_humidity'] = np.round(100 * np.exp(17.625 * dew_point / (243.04 + dew_point)
+                                                    - 17.625 * temperature / (243.04 + temperature)))
+    df['pressure_hPa'] = np.round(get_signal(rng, hours, 1012, 3, 0.5, 6))
+    df.to_csv(filename, index=False, na_rep='nan')
+
+def write_histories(folder, n_stations, n_samples, seed=0):
+    """
+    Writes the synthetic station files, one airport for every ten stations.
+
+    :return: Station identifiers (file names without .txt)
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(datetime.now()).floor('h')
+    n_airports = n_stations // 10
+    station_ids = []
+    for i in range(n_stations - n_airports):
+        station_ids.append('%05i' % (90000 + i))
+        write_buoy_history(os.path.join(folder, station_ids[-1] + '.txt'), n_samples, end, rng)
+    for i in range(n_airports):
+        station_ids.append('ZZ%02i' % (i))
+        write_airport_history(os.path.join(folder, station_ids[-1] + '.txt'), n_samples, end, rng)
+    return station_ids
+
+# %% Measurement
+
+def benchmark(name, max_rounds=None):
+    """
+    Registers a benchmark. The function receives the context and the number
+    of rounds and returns (latencies in seconds, items processed per round).
+    """
+    def register(function):
+        BENCHMARKS[name] = (function, max_rounds)
+        return function
+    return register
+
+def timed(function, *args, **kwargs):
+    time_start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - time_start
+
+def summarize(latencies, items, peak_bytes):
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'rounds': len(latencies), 'items_per_round': items, 'total_s': round(total, 6),
+            'ops_per_s': round(len(latencies) / total, 3) if total > 0 else None,
+            'items_per_s': round(len(latencies) * items / total, 3) if total > 0 else None,
+            'mean_ms': round(float(latencies.mean()) * 1000, 4), 'p50_ms': round(p50, 4),
+            'p95_ms': round(p95, 4), 'p99_ms': round(p99, 4),
+            'max_ms': round(float(latencies.max()) * 1000, 4),
+            'peak_mb': round(peak_bytes / (1024 * 1024), 3)}
+
+def run_benchmark(name, context, rounds):
+    function, max_rounds = BENCHMARKS[name]
+    rounds = min(rounds, max_rounds) if max_rounds is not None else rounds
+    latencies, items = function(context, rounds)
+    # Tracing slows everything down, the peak memory gets a pass of its own
+    tracemalloc.start()
+    try:
+        function(context, 1)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(latencies, items, peak)
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# %% Benchmarks
+
+@benchmark('marine_get_data_cold')
+def bench_marine_cold(context, rounds):
+    latencies = []
+    for i in range(rounds):
+        fetch_data.clear_entries()
+        latencies.append(timed(get_marine.get_data, FIXTURE_STATION))
+    return latencies, 1
+
+@benchmark('marine_get_data_not_modified')
+def bench_marine_not_modified(context, rounds):
+    get_marine.get_data(FIXTURE_STATION)
+    return [timed(get_marine.get_data, FIXTURE_STATION) for i in range(rounds)], 1
+
+@benchmark('airport_get_data_cold')
+def bench_airport_cold(context, rounds):
+    latencies = []
+    for i in range(rounds):
+        fetch_data.clear_entries()
+        latencies.append(timed(get_airport.get_data, FIXTURE_AIRPORT))
+    return latencies, 1
+
+@benchmark('airport_get_data_not_modified')
+def bench_airport_not_modified(context, rounds):
+    get_airport.get_data(FIXTURE_AIRPORT)
+    return [timed(get_airport.get_data, FIXTURE_AIRPORT) for i in range(rounds)], 1
+
+@benchmark('airport_parse_cycle_file')
+def bench_airport_cycle(context, rounds):
+    text = read_fixture('metar_cycle', FIXTURE_CYCLE).decode()
+    n_reports = len(get_airport.parse_cycle_file(text))
+    return [timed(get_airport.parse_cycle_file, text) for i in range(rounds)], n_reports
+
+@benchmark('marine_get_stations', max_rounds=5)
+def bench_marine_stations(context, rounds):
+    latencies = []
+    for i in range(rounds):
+        fetch_data.clear_entries()
+        latencies.append(timed(get_marine.get_stations, False, []))
+    return latencies, len(get_marine.get_stations(False, [])[1])
+
+@benchmark('collect_stations', max_rounds=10)
+def bench_collect(context, rounds):
+    import collect_data
+    df_station_info = context['station_info']
+    latencies = []
+    for i in range(rounds):
+        fetch_data.clear_entries()
+        latencies.append(timed(collect_data.collect_stations, df_station_info, lambda result: None,
+                               retries=0))
+    return latencies, len(df_station_info)
+
+@benchmark('store_append_file')
+def bench_store_append(context, rounds):
+    import store_data
+    folder = tempfile.mkdtemp(prefix='append_', dir=context['folder'])
+    data = get_marine.get_data(FIXTURE_STATION)
+    try:
+        return [timed(store_data.append_file, FIXTURE_STATION, data, folder)
+                for i in range(rounds)], 1
+    finally:
+        shutil.rmtree(folder)
+
+@benchmark('stats_yearly', max_rounds=10)
+def bench_stats_yearly(context, rounds):
+    import process_data
+    with quiet():
+        return [timed(process_data.print_stats_from_folder, context['history_folder'])
+                for i in range(rounds)], len(context['station_ids'])
+
+@benchmark('stats_yearly_rebuild', max_rounds=3)
+def bench_stats_yearly_rebuild(context, rounds):
+    import process_data
+    with quiet():
+        return [timed(process_data.print_stats_from_folder, context['history_folder'], rebuild=True)
+                for i in range(rounds)], len(context['station_ids']) * context['samples']
+
+@benchmark('stats_window_month', max_rounds=3)
+def bench_stats_window(context, rounds):
+    import process_data
+    def run():
+        process_data.compute_stats(process_data.load_long_frame(context['history_folder']), 'month')
+    return [timed(run) for i in range(rounds)], len(context['station_ids']) * context['samples']
+
+@benchmark('web_series_downsample', max_rounds=10)
+def bench_series(context, rounds):
+    import web_server
+    station_id = context['station_ids'][0]
+    return [timed(web_server.get_series, station_id, folder=context['history_folder'])
+            for i in range(rounds)], context['samples']
+
+class RecordingScreen:
+    """
+    Stand-in of the asciimatics screen, counts the written characters.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.n_chars = 0
+
+    def print_at(self, text, x, y, colour=7, attr=0, bg=0):
+        self.n_chars += len(text)
+
+def render_map(context, cold):
+    import terminal_map
+    screen = RecordingScreen(160, 50)
+    lat, lon, labels = context['map']
+    viewport = terminal_map.fit_viewport(lat, lon)
+    latencies = []
+    for i in range(context['rounds']):
+        if cold:
+            terminal_map.rasterize_background.cache_clear()
+        latencies.append(timed(terminal_map.draw_map, screen, lat, lon, labels, viewport))
+    return latencies, len(lat)
+
+@benchmark('map_render_cold', max_rounds=10)
+def bench_map_cold(context, rounds):
+    return render_map(dict(context, rounds=rounds), cold=True)
+
+@benchmark('map_render_warm')
+def bench_map_warm(context, rounds):
+    import terminal_map
+    lat, lon, labels = context['map']
+    terminal_map.draw_map(RecordingScreen(160, 50), lat, lon, labels, terminal_map.fit_viewport(lat, lon))
+    return render_map(dict(context, rounds=rounds), cold=False)
+
+# %% Runner
+
+def get_context(folder, n_stations, n_samples, n_map_stations):
+    import station_info
+    import running_stats
+
+    history_folder = os.path.join(folder, 'data')
+    os.makedirs(history_folder)
+    station_ids = write_histories(history_folder, n_stations, n_samples)
+    running_stats.rebuild(history_folder)
+
+    codes = sorted(get_airport.parse_cycle_file(read_fixture('metar_cycle', FIXTURE_CYCLE).decode()))
+    df_station_info = station_info.refresh_station_info(False, [], codes, verbose=False)
+
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(-60, 70, n_map_stations); lon = rng.uniform(-180, 180, n_map_stations)
+    labels = np.array(['%05i' % (i) for i in range(n_map_stations)], dtype=object)
+    return {'folder': folder, 'history_folder': history_folder, 'station_ids': station_ids,
+            'samples': n_samples, 'station_info': df_station_info, 'map': (lat, lon, labels)}
+
+def get_meta(args):
+    return {'time': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'stations': args.stations, 'samples': args.samples, 'map_stations': args.map_stations,
+            'rounds': args.rounds}
+
+def run_benchmarks(args):
+    names = list(BENCHMARKS)
+    if args.only:
+        patterns = args.only.split(',')
+        names = [name for name in names if any(pattern in name for pattern in patterns)]
+
+    results = {}
+    folder = tempfile.mkdtemp(prefix='climate_monitor_benchmark_')
+    try:
+        with noaa_server():
+            print("Writing %i synthetic histories of %i samples..." % (args.stations, args.samples),
+                  file=sys.stderr)
+            context = get_context(folder, args.stations, args.samples, args.map_stations)
+            for name in names:
+                results[name] = run_benchmark(name, context, args.rounds)
+                print("%-30s %10.3f ms p50 %10.3f ms p95 %10.1f items/s %8.2f MB" % (
+                    name, results[name]['p50_ms'], results[name]['p95_ms'],
+                    results[name]['items_per_s'] or 0, results[name]['peak_mb']), file=sys.stderr)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return {'meta': get_meta(args), 'results': results}
+
+def compare(report, baseline, threshold):
+    """
+    :return: List of (name, baseline p50, p50) of the benchmarks whose
+             median latency grew by more than threshold
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None or not previous['p50_ms']:
+            continue
+        if result['p50_ms'] > previous['p50_ms'] * (1 + threshold):
+            regressions.append((name, previous['p50_ms'], result['p50_ms']))
+    return regressions
+
+def record(station, airport, cycle):
+    """
+    Downloads the current NOAA files into the fixture folder.
+    """
+    session = fetch_data.get_session()
+    for kind, name in (('realtime2', station), ('station_table', None),
+                       ('metar_decoded', airport), ('metar_cycle', cycle)):
+        filename, url = FIXTURES[kind]
+        response = session.get(url.format(name), timeout=30)
+        response.raise_for_status()
+        with open(os.path.join(FIXTURE_FOLDER, filename.format(name)), 'wb') as f:
+            f.write(response.content)
+        print("Recorded %s (%i bytes)" % (url.format(name), len(response.content)))
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Offline performance benchmarks')
+    parser.add_argument('--stations', type=int, default=DEFAULT_STATIONS,
+                        help='Number of synthetic station histories')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES,
+                        help='Hourly samples per synthetic history')
+    parser.add_argument('--map-stations', type=int, default=DEFAULT_MAP_STATIONS)
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument('--only', default=None,
+                        help='Comma separated parts of the benchmark names to run')
+    parser.add_argument('--output', default=None, help='JSON report file (default: stdout)')
+    parser.add_argument('--compare', default=None, help='Baseline JSON report')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed relative growth of the median latency')
+    subparsers = parser.add_subparsers(dest='command')
+    record_parser = subparsers.add_parser('record', help='Record the fixtures from NOAA')
+    record_parser.add_argument('--station', default=FIXTURE_STATION)
+    record_parser.add_argument('--airport', default=FIXTURE_AIRPORT)
+    record_parser.add_argument('--cycle', type=int, default=FIXTURE_CYCLE)
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.command == 'record':
+        record(args.station, args.airport, args.cycle)
+        return 0
+
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for name, previous, current in regressions:
+            print("REGRESSION %s: p50 %.3f ms -> %.3f ms" % (name, previous, current), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+# %% Command line
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:31:08 2026
+
+On-disk response cache for the NOAA sources.
+
+Responses are stored in cache/ keyed by URL together with their ETag /
+Last-Modified validators. Every source type has its own time to live: the
+station table and the realtime2 directory listing change rarely, realtime2
+and METAR files are published hourly. The cache is bounded in size and the
+least recently used entries are evicted first.
+
+    python3 cache_data.py list
+    python3 cache_data.py purge [--expired] [--source realtime2]
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+
+# %% Attributes
+
+CACHE_FOLDER = 'cache/';
+INDEX_FILE = 'index.json';
+MAX_SIZE_BYTES = 50 * 1024 * 1024;
+ENABLED = True;
+
+# Source type of a URL, first matching pattern wins
+SOURCE_PATTERNS = [
+    ('station_table', re.compile(r'station_table\.txt$')),
+    ('station_table', re.compile(r'/data/realtime2/$')),
+    ('realtime2', re.compile(r'/data/realtime2/')),
+    ('metar', re.compile(r'/observations/metar/')),
+];
+# Time to live of each source type, in seconds
+TTL = {'station_table': 3 * 24 * 3600, 'realtime2': 10 * 60, 'metar': 10 * 60};
+
+_LOCK = threading.Lock();
+_INDEX = None;
+
+# %% Methods
+
+def configure(folder=None, max_size_bytes=None, ttl=None, enabled=None):
+    """
+    Overrides the cache settings (see [Cache] in config.ini).
+
+    :param ttl: Dictionary of source type -> time to live in seconds
+    """
+    global CACHE_FOLDER, MAX_SIZE_BYTES, ENABLED, _INDEX;
+    with _LOCK:
+        if folder is not None and folder != CACHE_FOLDER:
+            CACHE_FOLDER = folder
+            _INDEX = None
+        if max_size_bytes is not None:
+            MAX_SIZE_BYTES = max_size_bytes
+        if ttl is not None:
+            TTL.update(ttl)
+        if enabled is not None:
+            ENABLED = enabled
+
+def get_source(url):
+    for source, pattern in SOURCE_PATTERNS:
+        if pattern.search(url):
+            return source
+    return None
+
+def get_ttl(url):
+    """
+    :return: Time to live of the URL in seconds, 0 for URLs that are not cached
+    """
+    return TTL.get(get_source(url), 0) if ENABLED else 0
+
+def load_index():
+    global _INDEX;
+    if _INDEX is None:
+        filename = os.path.join(CACHE_FOLDER, INDEX_FILE)
+        try:
+            with open(filename, 'r') as f:
+                _INDEX = json.load(f)
+        except (OSError, ValueError):
+            _INDEX = {}
+    return _INDEX
+
+def save_index():
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    filename = os.path.join(CACHE_FOLDER, INDEX_FILE)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(_INDEX, f)
+    os.replace(filename + '.tmp', filename)
+
+def get_entry(url):
+    """
+    :return: Copy of the index entry of a URL (without the body) or None
+    """
+    with _LOCK:
+        entry = load_index().get(url)
+        return dict(entry) if entry is not None else None
+
+def read(url, max_age=None):
+    """
+    Reads a cached response body.
+
+    :param max_age: Maximum age in seconds, None to ignore the age
+    :return: Body text or None when missing or older than max_age
+    """
+    with _LOCK:
+        entry = load_index().get(url)
+        if entry is None:
+            return None
+        if max_age is not None and time.time() - entry['stored'] > max_age:
+            return None
+        try:
+            with open(os.path.join(CACHE_FOLDER, entry['file']), 'r') as f:
+                text = f.read()
+        except OSError:
+            del _INDEX[url]
+            return None
+        entry['accessed'] = time.time()
+        return text
+
+def touch(url):
+    """
+    Marks a cached response as fresh again (e.g. after a 304 Not Modified).
+    """
+    with _LOCK:
+        entry = load_index().get(url)
+        if entry is not None:
+            entry['stored'] = entry['accessed'] = time.time()
+            save_index()
+
+def write(url, text, etag=None, last_modified=None):
+    with _LOCK:
+        index = load_index()
+        file_name = hashlib.sha1(url.encode()).hexdigest() + '.txt'
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        filename = os.path.join(CACHE_FOLDER, file_name)
+        with open(filename + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(filename + '.tmp', filename)
+        now = time.time()
+        index[url] = {'file': file_name, 'source': get_source(url),
+                      'size': os.path.getsize(filename), 'stored': now,
+                      'accessed': now, 'etag': etag, 'last_modified': last_modified}
+        evict(MAX_SIZE_BYTES)
+        save_index()
+
+def evict(max_size_bytes):
+    """
+    Removes the least recently used entries until the cache fits into
+    max_size_bytes. The caller holds the lock.
+    """
+    index = load_index()
+    total = sum(entry['size'] for entry in index.values())
+    for url, entry in sorted(index.items(), key=lambda item: item[1]['accessed']):
+        if total <= max_size_bytes:
+            break
+        remove_file(entry)
+        del index[url]
+        total -= entry['size']
+
+def remove_file(entry):
+    try:
+        os.remove(os.path.join(CACHE_FOLDER, entry['file']))
+    except OSError:
+        pass
+
+def list_entries():
+    """
+    :return: List of index entries (with url, age and expired keys), most
+             recently used first
+    """
+    now = time.time()
+    with _LOCK:
+        entries = []
+        for url, entry in load_index().items():
+            entry = dict(entry, url=url, age=now - entry['stored'])
+            entry['expired'] = entry['age'] > TTL.get(entry['source'], 0)
+            entries.append(entry)
+    return sorted(entries, key=lambda entry: -entry['accessed'])
+
+def purge(expired_only=False, source=None):
+    """
+    Removes cached responses.
+
+    :param expired_only: Remove only the entries older than their TTL
+    :param source: Remove only the entries of a source type
+    :return: Number of removed entries
+    """
+    removed = [entry for entry in list_entries()
+               if (not expired_only or entry['expired'])
+               and (source is None or entry['source'] == source)]
+    with _LOCK:
+        index = load_index()
+        for entry in removed:
+            remove_file(entry)
+            index.pop(entry['url'], None)
+        save_index()
+    return len(removed)
+
+def print_entries():
+    entries = list_entries()
+    print("%-13s %9s %9s %-7s %s" % ("SOURCE", "SIZE [kB]", "AGE [min]", "EXPIRED", "URL"))
+    for entry in entries:
+        print("%-13s %9.1f %9.1f %-7s %s" % (entry['source'], entry['size']/1024,
+                                             entry['age']/60, entry['expired'], entry['url']))
+    print("\n%i entries, %.1f kB of %.1f kB" % (len(entries),
+                                               sum(entry['size'] for entry in entries)/1024,
+                                               MAX_SIZE_BYTES/1024))
+
+# %% Command line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NOAA response cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='List the cached responses')
+    purge_parser = subparsers.add_parser('purge', help='Remove cached responses')
+    purge_parser.add_argument('--expired', action='store_true', help='Only expired entries')
+    purge_parser.add_argument('--source', default=None, choices=sorted(TTL))
+    args = parser.parse_args()
+
+    from config import par_cache_enabled, par_cache_folder, par_cache_max_size_mb, par_cache_ttl
+    configure(par_cache_folder, int(par_cache_max_size_mb * 1024 * 1024),
+              par_cache_ttl, bool(par_cache_enabled))
+
+    if args.command == 'list':
+        print_entries()
+    if args.command == 'purge':
+        print("Removed %i entries" % (purge(args.expired, args.source)))
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:20:15 2026
+
+Non-interactive command line interface, reading config.ini like main.py.
+
+    python3 cli.py collect [--once] [--serve] [--pid-file F] [--health-file F]
+                           [--metrics-file F]
+    python3 cli.py stats [--window month] [--rebuild] [--verify] [--dedupe] [--pid-file F]
+    python3 cli.py refresh-stations [--dry-run]
+    python3 cli.py backfill [--stations S] [--years 2019-2023] [--force]
+    python3 cli.py compact [--verify] [--pid-file F]
+    python3 cli.py alerts [--stations S]
+    python3 cli.py serve [--host H] [--port P]
+    python3 cli.py cache list|purge [--expired] [--source S]
+
+'collect' runs the scheduled collection as a long-lived daemon (e.g. under
+systemd): SIGTERM and SIGINT finish the running cycle and exit cleanly. The
+PID file keeps a second collector from using the same data folder (and is
+taken as well by 'collect --once' and the commands rewriting the station
+files: backfill, compact, stats --dedupe / --rebuild), the
+health file is rewritten after every cycle with the time and the result of
+the last run of each source, the metrics file (Prometheus text format, e.g.
+for the node exporter textfile collector) with the collection metrics.
+Exit status is 0 on success, 1 on errors.
+"""
+
+import os
+import sys
+import json
+import fcntl
+import signal
+import argparse
+import threading
+from datetime import datetime
+
+# %% Attributes
+
+ROOT_FOLDER = os.path.dirname(os.path.abspath(__file__));
+PID_FILE = 'run/collector.pid';
+HEALTH_FILE = 'run/collector.health';
+METRICS_FILE = 'run/collector.prom';
+
+# PID file -> open file holding its lock
+_PID_FILES = {};
+
+# %% Methods
+
+def log(message):
+    print("%s %s" % (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), message), flush=True)
+
+def write_text_atomic(filename, text):
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(filename + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(filename + '.tmp', filename)
+
+def write_json_atomic(filename, data):
+    write_text_atomic(filename, json.dumps(data, indent=1, default=str))
+
+def acquire_pid_file(filename):
+    """
+    Takes an exclusive lock (flock) on the PID file for the lifetime of the
+    process and writes the PID into it. The lock is released by the kernel
+    when the process dies, so a file left behind is taken over.
+
+    :raises RuntimeError: When another collector is running
+    """
+    if filename in _PID_FILES:
+        return
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    while True:
+        f = open(filename, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            pid = f.read().strip()
+            f.close()
+            raise RuntimeError("Collector already running with PID %s (%s)" % (pid or '?', filename))
+        # The file may have been removed by the previous holder in between
+        try:
+            if os.stat(filename).st_ino == os.fstat(f.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    f.seek(0)
+    f.truncate()
+    f.write("%i\n" % (os.getpid()))
+    f.flush()
+    _PID_FILES[filename] = f
+
+def release_pid_file(filename):
+    f = _PID_FILES.pop(filename, None)
+    if f is None:
+        return
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+    f.close()
+
+def configure_cache(config):
+    import cache_data
+    cache_data.configure(config.par_cache_folder,
+                         int(config.par_cache_max_size_mb * 1024 * 1024),
+                         config.par_cache_ttl, bool(config.par_cache_enabled))
+
+def configure_metrics(config):
+    import metrics
+    metrics.configure(bool(config.par_metrics_enabled), bool(config.par_profile_enabled),
+                      config.par_profile_folder)
+
+def configure_retention(config):
+    import retention
+    retention.configure(config.par_retention_raw_days, config.par_retention_hourly_days)
+
+def configure_alerts(config):
+    """
+    Evaluates the alert rules on every stored row when enabled.
+    """
+    if not config.par_alerts_enabled:
+        return
+    import alerts
+    alerts.configure(True, config.par_alert_rules, config.par_alerts_cooldown,
+                     config.par_alerts_max_per_hour, log=True, filename=config.par_alerts_file,
+                     webhook=config.par_alerts_webhook)
+    alerts.install()
+
+def get_collect_kwargs(config):
+    return {'max_workers': config.par_max_workers, 'per_host_limit': config.par_per_host_limit,
+            'timeout': config.par_request_timeout, 'retries': config.par_max_retries,
+            'backoff': config.par_retry_backoff, 'airport_source': config.par_airport_source}
+
+def store_result(result):
+    import store_data
+    if result['error'] is not None:
+        log("%s %s ERROR: %s" % (result['kind'].upper(), result['station_id'], result['error']))
+        return
+    # An unchanged observation has already been stored in an earlier cycle
+    if result['changed']:
+        store_data.append_file(station_id=result['station_id'], data_dict=result['data'])
+
+def configure_web_server():
+    import web_server
+    # data/ of the working directory (--workdir), not of the source folder
+    web_server.configure(os.path.join(os.getcwd(), 'data'))
+
+def start_web_server(host, port):
+    import web_server
+    configure_web_server()
+    thread = threading.Thread(target=web_server.run, args=(host, port), daemon=True)
+    thread.start()
+    log("Serving http://%s:%i/" % (host, port))
+    return thread
+
+# %% Commands
+
+def command_collect(args, config):
+    import metrics
+    import collect_data
+    import fetch_data
+    import scheduler
+    import store_data
+    import station_info
+
+    configure_cache(config)
+    configure_alerts(config)
+    # A single cycle writes the same station files as the daemon
+    acquire_pid_file(args.pid_file)
+
+    # A single cycle over every station, e.g. from cron
+    if args.once:
+        try:
+            df_station_info = station_info.load_station_info()
+            store_data.migrate_folder(store_data.DATA_FOLDER)
+            n_ok = collect_data.collect_stations(df_station_info, store_result,
+                                                 **get_collect_kwargs(config))
+        finally:
+            release_pid_file(args.pid_file)
+        log("Fetched %i / %i stations" % (n_ok, len(df_station_info)))
+        return 0 if n_ok == len(df_station_info) else 1
+
+    df_station_info = station_info.load_station_info()
+    store_data.migrate_folder(store_data.DATA_FOLDER)
+    health = {'pid': os.getpid(), 'started': datetime.now().isoformat(timespec='seconds'),
+              'status': 'running', 'cycles': {}}
+
+    def on_cycle(kind, n_ok, n_stations, next_run):
+        scheduler.print_cycle(kind, n_ok, n_stations, next_run)
+        health['updated'] = datetime.now().isoformat(timespec='seconds')
+        health['cycles'][kind] = {'time': health['updated'], 'ok': n_ok, 'stations': n_stations,
+                                  'next_run': datetime.fromtimestamp(next_run).isoformat(timespec='seconds')}
+        health['counters'] = fetch_data.get_counters()
+        write_json_atomic(args.health_file, health)
+        write_text_atomic(args.metrics_file, metrics.render())
+
+    collection_scheduler = scheduler.Scheduler()
+
+    def stop(signum, frame):
+        log("Received %s, stopping after the running cycle" % (signal.Signals(signum).name))
+        collection_scheduler.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if args.serve:
+        start_web_server(config.par_server_host, config.par_server_port)
+
+    scheduler.add_collection_jobs(collection_scheduler, df_station_info, store_result,
+                                  buoy_interval=config.par_buoy_interval,
+                                  buoy_offset=config.par_buoy_offset,
+                                  airport_interval=config.par_airport_interval,
+                                  airport_offset=config.par_airport_offset,
+                                  jitter=config.par_schedule_jitter, on_cycle=on_cycle,
+                                  compaction_interval=config.par_compaction_interval,
+                                  **get_collect_kwargs(config))
+    write_json_atomic(args.health_file, health)
+    log("Collector started with PID %i" % (os.getpid()))
+    try:
+        collection_scheduler.run_forever()
+    finally:
+        health['status'] = 'stopped'
+        health['updated'] = datetime.now().isoformat(timespec='seconds')
+        write_json_atomic(args.health_file, health)
+        release_pid_file(args.pid_file)
+        log("Collector stopped")
+    return 0
+
+def command_stats(args, config):
+    import process_data
+    # Rewriting the station files or the statistics state next to a running
+    # collector would lose its appends and leave its state stale
+    exclusive = args.dedupe or args.rebuild
+    if exclusive:
+        acquire_pid_file(args.pid_file)
+    try:
+        if args.dedupe:
+            import store_data
+            removed = store_data.deduplicate_folder('data/')
+            log("Removed %i repeated observations" % (sum(removed.values())))
+        if args.window == 'year':
+            process_data.print_stats_from_folder('data/', rebuild=args.rebuild, verify=args.verify)
+        else:
+            process_data.print_window_stats('data/', window=args.window)
+    finally:
+        if exclusive:
+            release_pid_file(args.pid_file)
+    return 0
+
+def command_refresh_stations(args, config):
+    import station_info
+
+    configure_cache(config)
+    df_station_info = station_info.refresh_station_info(config.par_selected_stations_only,
+                                                        config.par_station_list,
+                                                        config.par_airport_list)
+    if args.dry_run:
+        print(df_station_info[["# STATION_ID", "LOCATION", "NAME"]].to_string())
+        return 0
+    station_info.save_station_info(df_station_info)
+    log("Wrote %s (%i stations)" % (station_info.STATION_INFO_FILE, len(df_station_info)))
+    return 0
+
+def command_backfill(args, config):
+    import backfill
+
+    configure_cache(config)
+    station_ids = args.stations.split(',') if args.stations else config.par_station_list
+    years = backfill.parse_years(args.years) if args.years else None
+    # The station files are rewritten, a running collector would lose its appends
+    acquire_pid_file(args.pid_file)
+    try:
+        added = backfill.backfill(station_ids, years, archive=not args.no_archive,
+                                  realtime=not args.no_realtime, max_workers=args.workers,
+                                  force=args.force, timeout=config.par_request_timeout * 6)
+    finally:
+        release_pid_file(args.pid_file)
+    log("Backfilled %i stations, %i rows" % (len(added), sum(added.values())))
+    return 0
+
+def command_compact(args, config):
+    import retention
+    import running_stats
+    # The station files are rewritten, a running collector compacts them itself
+    acquire_pid_file(args.pid_file)
+    try:
+        results = retention.compact_folder('data/', verbose=True)
+    finally:
+        release_pid_file(args.pid_file)
+    log("Rolled up %i raw and %i hourly rows of %i stations" % (
+        sum(n_raw for n_raw, n_hourly in results.values()),
+        sum(n_hourly for n_raw, n_hourly in results.values()), len(results)))
+    if args.verify:
+        mismatches = running_stats.verify('data/')
+        for mismatch in mismatches:
+            log("MISMATCH %s %s %s: stored %s, recomputed %s" % mismatch)
+        return 1 if mismatches else 0
+    return 0
+
+def command_alerts(args, config):
+    import alerts
+    import running_stats
+    alerts.configure(rules=config.par_alert_rules, cooldown=config.par_alerts_cooldown)
+    station_ids = args.stations.split(',') if args.stations else running_stats.list_station_files('data/')
+    sent = alerts.replay(station_ids, 'data/')
+    for alert in sent:
+        alerts.log_sink(alert)
+    log("%i alerts" % (len(sent)))
+    return 0
+
+def command_serve(args, config):
+    import web_server
+    configure_web_server()
+    host = args.host or config.par_server_host
+    port = args.port or config.par_server_port
+    log("Serving http://%s:%i/" % (host, port))
+
+    # SIGTERM ends the server like Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        # The collector runs in another process, the stream follows its files
+        web_server.run(host, port, watch=True)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def command_cache(args, config):
+    import cache_data
+    configure_cache(config)
+    if args.cache_command == 'list':
+        cache_data.print_entries()
+    if args.cache_command == 'purge':
+        print("Removed %i entries" % (cache_data.purge(args.expired, args.source)))
+    return 0
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Climate monitor command line interface')
+    parser.add_argument('--workdir', default=ROOT_FOLDER,
+                        help='Folder holding config.ini and data/ (default: the source folder)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    collect_parser = subparsers.add_parser('collect', help='Collect the station data')
+    collect_parser.add_argument('--once', action='store_true',
+                                help='Fetch every station once and exit')
+    collect_parser.add_argument('--serve', action='store_true',
+                                help='Run the web server in the same process')
+    collect_parser.add_argument('--pid-file', default=PID_FILE)
+    collect_parser.add_argument('--health-file', default=HEALTH_FILE)
+    collect_parser.add_argument('--metrics-file', default=METRICS_FILE)
+    collect_parser.set_defaults(run=command_collect)
+
+    stats_parser = subparsers.add_parser('stats', help='Print the station statistics')
+    stats_parser.add_argument('--window', default='year',
+                              help="'year', 'month', 'day' or a rolling window in hours ('6h')")
+    stats_parser.add_argument('--rebuild', action='store_true',
+                              help='Recompute the yearly running statistics first')
+    stats_parser.add_argument('--verify', action='store_true',
+                              help='Compare the yearly running statistics with the files')
+    stats_parser.add_argument('--dedupe', action='store_true',
+                              help='Remove the repeated observations of the station files first')
+    stats_parser.add_argument('--pid-file', default=PID_FILE,
+                              help='Collector PID file, taken by --dedupe and --rebuild')
+    stats_parser.set_defaults(run=command_stats)
+
+    refresh_parser = subparsers.add_parser('refresh-stations', help='Update the station info file')
+    refresh_parser.add_argument('--dry-run', action='store_true',
+                                help='Print the stations instead of saving them')
+    refresh_parser.set_defaults(run=command_refresh_stations)
+
+    backfill_parser = subparsers.add_parser('backfill', help='Ingest the realtime2 files and the '
+                                            'yearly NDBC archives of the buoys')
+    backfill_parser.add_argument('--stations', default=None,
+                                 help='Comma separated station ids (default: station_list)')
+    backfill_parser.add_argument('--years', default=None,
+                                 help="Archive years, e.g. '2019-2023' (default: the last 5 complete years)")
+    backfill_parser.add_argument('--no-archive', action='store_true', help='Skip the yearly archives')
+    backfill_parser.add_argument('--no-realtime', action='store_true', help='Skip the realtime2 files')
+    backfill_parser.add_argument('--workers', type=int, default=None,
+                                 help='Parsing processes (default: CPU count)')
+    backfill_parser.add_argument('--force', action='store_true',
+                                 help='Ingest again what earlier runs have ingested for the stations')
+    backfill_parser.add_argument('--pid-file', default=PID_FILE)
+    backfill_parser.set_defaults(run=command_backfill)
+
+    compact_parser = subparsers.add_parser('compact', help='Roll the old samples up into the '
+                                           'hourly and daily retention tiers')
+    compact_parser.add_argument('--verify', action='store_true',
+                                help='Compare the yearly running statistics with the files afterwards')
+    compact_parser.add_argument('--pid-file', default=PID_FILE)
+    compact_parser.set_defaults(run=command_compact)
+
+    alerts_parser = subparsers.add_parser('alerts', help='Replay the station files through the alert rules')
+    alerts_parser.add_argument('--stations', default=None,
+                               help='Comma separated station ids (default: every station file)')
+    alerts_parser.set_defaults(run=command_alerts)
+
+    serve_parser = subparsers.add_parser('serve', help='Run the web map and JSON API server')
+    serve_parser.add_argument('--host', default=None)
+    serve_parser.add_argument('--port', type=int, default=None)
+    serve_parser.set_defaults(run=command_serve)
+
+    cache_parser = subparsers.add_parser('cache', help='Inspect or purge the response cache')
+    cache_parser.add_argument('cache_command', choices=['list', 'purge'])
+    cache_parser.add_argument('--expired', action='store_true', help='Only expired entries')
+    cache_parser.add_argument('--source', default=None)
+    cache_parser.set_defaults(run=command_cache)
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    # Output reaches the log (e.g. journald) line by line
+    sys.stdout.reconfigure(line_buffering=True)
+
+    # Relative paths (config.ini, data/, cache/) resolve as in main.py
+    os.chdir(args.workdir)
+    import config
+    configure_metrics(config)
+    configure_retention(config)
+
+    try:
+        return args.run(args, config)
+    except (OSError, RuntimeError) as error:
+        log("ERROR: %s" % (error))
+        return 1
+
+# %% Command line
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:40 2026
+
+Concurrent collection of buoy and airport observations.
+
+Every station of the station info frame is fetched in a bounded thread pool.
+Requests to the same host share a concurrency limit, every request has a
+timeout and transient failures are retried with exponential backoff. Results
+are handed to a callback in the calling thread as soon as they complete.
+"""
+
+import time
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import metrics
+import get_marine
+import get_airport
+
+# %% Attributes
+
+AIRPORT_STATION_ID = '99999';
+
+# Semaphores limiting the concurrent requests per host, created on first use
+_HOST_LIMITS = {};
+_HOST_LIMITS_LOCK = threading.Lock();
+
+# Observation time of the last result of each station, to detect unchanged data
+_LAST_SEEN = {};
+_LAST_SEEN_LOCK = threading.Lock();
+
+# %% Methods
+
+def get_observation_key(kind, data):
+    """
+    Observation time of a record: #YY/MM/DD/hh/mm of buoys, the METAR
+    timestamp of airports.
+    """
+    if kind == 'airport':
+        return data.get('timestamp')
+    return tuple(data.get(col) for col in get_marine.TIME_COLS)
+
+def get_observation_time(kind, data):
+    """
+    :return: Observation time (UTC, naive) of a record or None
+    """
+    try:
+        if kind == 'buoy':
+            return datetime(int(data['#YY']), int(data['MM']), int(data['DD']),
+                            int(data['hh']), int(data['mm']))
+        return datetime.fromisoformat(str(data['timestamp']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def record_metrics(result):
+    """
+    Adds a station result to the latency, error and staleness metrics.
+    """
+    kind, station_id = result['kind'], result['station_id']
+    metrics.observe('station_seconds', result['elapsed'], 'Duration of the complete fetch of a station',
+                    source=kind, station=station_id)
+    if result['error'] is not None:
+        metrics.inc('station_errors_total', 1, 'Failed station fetches', source=kind,
+                    station=station_id, error=type(result['error']).__name__)
+        return
+    observed = get_observation_time(kind, result['data'])
+    if observed is not None:
+        metrics.set_observation_time(kind, station_id,
+                                     observed.replace(tzinfo=timezone.utc).timestamp())
+
+def is_changed(kind, station_id, data):
+    """
+    :return: False when the station reported the same observation as in
+             the previous call
+    """
+    key = get_observation_key(kind, data)
+    with _LAST_SEEN_LOCK:
+        changed = _LAST_SEEN.get((kind, station_id)) != key
+        _LAST_SEEN[(kind, station_id)] = key
+    return changed
+
+def get_host_limit(URL, per_host_limit):
+    host = urlparse(URL).netloc
+    with _HOST_LIMITS_LOCK:
+        if host not in _HOST_LIMITS:
+            _HOST_LIMITS[host] = threading.BoundedSemaphore(per_host_limit)
+        return _HOST_LIMITS[host]
+
+def is_retryable(error):
+    """
+    Network errors, timeouts, HTTP 429 and 5xx responses are worth a retry,
+    other failures (e.g. unknown station, 404) are not.
+    """
+    if not isinstance(error, requests.RequestException):
+        return False
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True
+    return response.status_code == 429 or response.status_code >= 500
+
+def fetch_with_retry(fetch, station_id, URL, per_host_limit=8, timeout=10,
+                     retries=3, backoff=1.0):
+    """
+    Calls fetch(station_id, timeout=timeout) inside the per-host limit and 
+    retries retryable errors with exponential backoff (backoff, 2*backoff, ...).
+    """
+    attempt = 0
+    while True:
+        try:
+            with get_host_limit(URL, per_host_limit):
+                return fetch(station_id, timeout=timeout)
+        except Exception as error:
+            if attempt >= retries or not is_retryable(error):
+                raise
+        metrics.inc('retries_total', 1, 'Retried requests', host=urlparse(URL).netloc)
+        time.sleep(backoff * 2**attempt)
+        attempt += 1
+
+def get_station_jobs(df_station_info):
+    """
+    Lists (kind, station_id) pairs for every row of the station info frame.
+    Airports are stored with the AIRPORT_STATION_ID and their ICAO code in
+    the LOCATION column.
+    """
+    jobs = []
+    for station_id, location in zip(df_station_info['# STATION_ID'].astype(str),
+                                    df_station_info['LOCATION']):
+        if station_id == AIRPORT_STATION_ID:
+            jobs.append(('airport', str(location)))
+        else:
+            jobs.append(('buoy', station_id))
+    return jobs
+
+def get_airport_stations(df_station_info):
+    """
+    :return: Dictionary of ICAO code -> (name, latitude, longitude) of the
+             airports in the station info frame
+    """
+    df_airports = df_station_info[df_station_info['# STATION_ID'].astype(str) == AIRPORT_STATION_ID]
+    return {str(code): (name, latitude, longitude) for code, name, latitude, longitude
+            in zip(df_airports['LOCATION'], df_airports['NAME'],
+                   df_airports['LATITUDE'], df_airports['LONGITUDE'])}
+
+def collect_stations(df_station_info, on_result, max_workers=16, 
+                     per_host_limit=8, timeout=10, retries=3, backoff=1.0,
+                     airport_source='decoded'):
+    """
+    Fetches all stations in parallel and calls on_result(result) for each
+    station as soon as it completes. The callback runs in the calling thread,
+    so it can safely print and write files.
+    
+    :param df_station_info: Station info DataFrame (see get_marine.get_stations)
+    :param on_result: Callback receiving a dict with the keys kind, station_id,
+                      data (None on failure), error (None on success),
+                      elapsed (seconds) and changed (False when the station
+                      still reports the observation of the previous cycle)
+    :param max_workers: Size of the thread pool
+    :param per_host_limit: Maximum number of concurrent requests per host
+    :param timeout: Timeout of a single request in seconds
+    :param retries: Number of retries for transient failures
+    :param backoff: Initial backoff in seconds, doubled on each retry
+    :param airport_source: 'decoded' fetches one decoded METAR file per
+                           airport, 'cycle' fetches one METAR cycle file
+                           holding every airport
+    :return: Number of stations fetched successfully
+    """
+    sources = {
+        'buoy': (get_marine.get_data, get_marine.URL_BUOY_REALTIME_ROOT),
+        'airport': (get_airport.get_data, get_airport.URL_AIRPORTS_ROOT)
+    }
+    
+    def run(kind, station_id):
+        fetch, URL = sources[kind]
+        time_start = time.perf_counter()
+        result = {'kind': kind, 'station_id': station_id, 
+                  'data': None, 'error': None}
+        try:
+            with metrics.profile('collect-' + kind):
+                result['data'] = fetch_with_retry(fetch, station_id, URL, 
+                                                  per_host_limit=per_host_limit,
+                                                  timeout=timeout, retries=retries,
+                                                  backoff=backoff)
+        except Exception as error:
+            result['error'] = error
+        result['elapsed'] = time.perf_counter() - time_start
+        return result
+    
+    def run_cycle(airport_codes):
+        # One download for all airports, split into one result per airport
+        stations = get_airport_stations(df_station_info)
+        fetch = lambda codes, timeout: get_airport.get_cycle_data(codes, stations,
+                                                                  timeout=timeout)
+        time_start = time.perf_counter()
+        try:
+            with metrics.profile('collect-airport'):
+                records = fetch_with_retry(fetch, airport_codes, get_airport.URL_METAR_CYCLES_ROOT,
+                                           per_host_limit=per_host_limit, timeout=timeout,
+                                           retries=retries, backoff=backoff)
+            error = None
+        except Exception as exception:
+            records = {}; error = exception
+        elapsed = time.perf_counter() - time_start
+        results = []
+        for code in airport_codes:
+            result = {'kind': 'airport', 'station_id': code, 'data': records.get(code),
+                      'error': error, 'elapsed': elapsed}
+            if result['data'] is None and error is None:
+                result['error'] = ValueError("No METAR report for %s in the cycle file" % (code))
+            results.append(result)
+        return results
+    
+    jobs = get_station_jobs(df_station_info)
+    airport_codes = [station_id for kind, station_id in jobs if kind == 'airport']
+    if airport_source == 'cycle':
+        jobs = [job for job in jobs if job[0] != 'airport']
+    
+    n_ok = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, kind, station_id) for kind, station_id in jobs]
+        if airport_source == 'cycle' and airport_codes:
+            futures.append(executor.submit(run_cycle, airport_codes))
+        for future in as_completed(futures):
+            results = future.result()
+            for result in (results if isinstance(results, list) else [results]):
+                result['changed'] = True
+                if result['error'] is None:
+                    n_ok += 1
+                    result['changed'] = is_changed(result['kind'], result['station_id'],
+                                                   result['data'])
+                record_metrics(result)
+                with metrics.profile('store'):
+                    on_result(result)
+    
+    metrics.save_profiles()
+    return n_ok
@@ -6,14 +6,12 @@ Created on Tue Sep 17 21:57:35 2024
 @author: suoravi
 """
 
-import pandas as pd
 import configparser
 
 config = configparser.ConfigParser();
 config.read('config.ini');
 
 # Read the config
-par_monitoring_interval = int(config['Settings']['monitoring_interval']);
 par_selected_stations_only = int(config['Settings']['selected_stations_only']);
 
 par_station_list = config['Stations']['station_list'].split(',');
@@ -21,3 +19,41 @@ par_station_list = [item.strip() for item in par_station_list];
 
 par_airport_list = config['Stations']['airport_list'].split(',');
 par_airport_list = [item.strip() for item in par_airport_list];
+
+par_buoy_interval = float(config['Schedule']['buoy_interval']) * 60;
+par_airport_interval = float(config['Schedule']['airport_interval']) * 60;
+par_buoy_offset = float(config['Schedule']['buoy_offset']) * 60;
+par_airport_offset = float(config['Schedule']['airport_offset']) * 60;
+par_schedule_jitter = float(config['Schedule']['jitter']);
+
+par_max_workers = int(config['Network']['max_workers']);
+par_per_host_limit = int(config['Network']['per_host_limit']);
+par_request_timeout = float(config['Network']['request_timeout']);
+par_max_retries = int(config['Network']['max_retries']);
+par_retry_backoff = float(config['Network']['retry_backoff']);
+par_airport_source = config['Network']['airport_source'].strip();
+
+par_cache_enabled = int(config['Cache']['enabled']);
+par_cache_folder = config['Cache']['folder'];
+par_cache_max_size_mb = float(config['Cache']['max_size_mb']);
+par_cache_ttl = {'station_table': float(config['Cache']['ttl_station_table']) * 60,
+                 'realtime2': float(config['Cache']['ttl_realtime2']) * 60,
+                 'metar': float(config['Cache']['ttl_metar']) * 60};
+
+par_metrics_enabled = int(config['Metrics']['enabled']);
+par_profile_enabled = int(config['Metrics']['profile']);
+par_profile_folder = config['Metrics']['profile_folder'].strip();
+
+par_retention_raw_days = float(config['Retention']['raw_days']);
+par_retention_hourly_days = float(config['Retention']['hourly_days']);
+par_compaction_interval = float(config['Retention']['compaction_interval']) * 60;
+
+par_alerts_enabled = int(config['Alerts']['enabled']);
+par_alerts_file = config['Alerts']['file'].strip();
+par_alerts_webhook = config['Alerts']['webhook'].strip();
+par_alerts_cooldown = float(config['Alerts']['cooldown']) * 60;
+par_alerts_max_per_hour = int(config['Alerts']['max_per_hour']);
+par_alert_rules = dict(config['Alert Rules']);
+
+par_server_host = config['Server']['host'].strip();
+par_server_port = int(config['Server']['port']);
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:12:37 2026
+
+Live terminal dashboard of the station monitoring (asciimatics).
+
+The collection runs on the scheduler in a background thread. Every result
+is queued to the screen thread as soon as its fetch completes and only its
+row (or map marker) changes. The table shows the latest values, the fetch
+latency, the time of the last fetch and the age of the observation. The
+newest alert (see alerts.py) is shown in the footer instead of printed.
+asciimatics double-buffers the screen, so a redraw only sends the changed
+characters to the terminal.
+
+    Keys: m toggles table / map, up/down/PgUp/PgDn scroll, q quits
+"""
+
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from asciimatics.screen import Screen
+from asciimatics.exceptions import ResizeScreenError
+
+import alerts
+import scheduler
+import fetch_data
+import collect_data
+import store_data
+import station_info
+import terminal_map
+
+# %% Attributes
+
+# Screen refresh interval, in seconds
+REFRESH_INTERVAL = 0.2
+# Observations older than this are shown as stale, in seconds
+STALE_AFTER = 2 * 3600
+# Values shown for each source: (header, buoy column, airport column)
+VALUE_COLUMNS = [('AIR', 'ATMP', 'temperature_C'), ('WATER', 'WTMP', None),
+                 ('WIND', 'WSPD', 'wind_speed_m_s'), ('PRES', 'PRES', 'pressure_hPa'),
+                 ('RH', None, 'relative_humidity')]
+
+# %% Methods
+
+def format_age(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 120:
+        return '%is' % (seconds)
+    if seconds < 2 * 3600:
+        return '%im' % (seconds // 60)
+    return '%.1fh' % (seconds / 3600)
+
+def format_value(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return '-'
+    return '-' if np.isnan(value) else '%.1f' % (value)
+
+# %% Classes
+
+class Dashboard:
+    """
+    State of the dashboard: one row per station, updated from the results
+    queue by the screen thread.
+    """
+    def __init__(self, df_station_info):
+        self.df_station_info = df_station_info
+        file_ids = station_info.get_file_identifiers(df_station_info).tolist()
+        is_airport = (df_station_info['# STATION_ID'].astype(str)
+                      == station_info.AIRPORT_STATION_ID).tolist()
+        self.order = file_ids
+        self.rows = {}
+        for file_id, airport, name in zip(file_ids, is_airport, df_station_info['NAME']):
+            self.rows[file_id] = {'kind': 'airport' if airport else 'buoy',
+                                  'name': '' if pd.isna(name) else str(name),
+                                  'status': 'WAIT', 'data': None, 'error': None,
+                                  'latency': None, 'fetched': None, 'observed': None}
+        self.lat = pd.to_numeric(df_station_info['LATITUDE'], errors='coerce').to_numpy(dtype=np.float64)
+        self.lon = pd.to_numeric(df_station_info['LONGITUDE'], errors='coerce').to_numpy(dtype=np.float64)
+        self.labels = np.array(file_ids, dtype=object)
+        self.viewport = terminal_map.fit_viewport(self.lat, self.lon, 7, 5)
+        self.results = queue.Queue()
+        self.cycles = {}
+        self.scroll = 0
+        self.show_map = False
+        self.alert = None
+
+    # Called from the collecting threads
+
+    def on_start(self, kind, df_kind):
+        self.results.put(('start', kind, station_info.get_file_identifiers(df_kind).tolist()))
+
+    def on_result(self, result):
+        # An unchanged observation has already been stored in an earlier cycle
+        if result['error'] is None and result['changed']:
+            store_data.append_file(station_id=result['station_id'], data_dict=result['data'])
+        self.results.put(('result', result))
+
+    def on_cycle(self, kind, n_ok, n_stations, next_run):
+        self.results.put(('cycle', kind, n_ok, n_stations, next_run))
+
+    def on_alert(self, alert):
+        self.results.put(('alert', alert))
+
+    # Screen thread
+
+    def apply_updates(self):
+        """
+        Applies the queued results to the rows.
+        :return: True when something changed
+        """
+        changed = False
+        while True:
+            try:
+                update = self.results.get_nowait()
+            except queue.Empty:
+                return changed
+            changed = True
+            if update[0] == 'start':
+                for file_id in update[2]:
+                    if file_id in self.rows:
+                        self.rows[file_id]['status'] = 'FETCH'
+            elif update[0] == 'cycle':
+                kind, n_ok, n_stations, next_run = update[1:]
+                self.cycles[kind] = (n_ok, n_stations, next_run)
+            elif update[0] == 'alert':
+                self.alert = update[1]
+            else:
+                result = update[1]
+                row = self.rows.setdefault(str(result['station_id']), {
+                    'kind': result['kind'], 'name': '', 'status': 'WAIT', 'data': None,
+                    'error': None, 'latency': None, 'fetched': None, 'observed': None})
+                if str(result['station_id']) not in self.order:
+                    self.order.append(str(result['station_id']))
+                row['latency'] = result['elapsed']
+                row['fetched'] = time.time()
+                if result['error'] is not None:
+                    row['status'] = 'ERROR'
+                    row['error'] = str(result['error'])
+                else:
+                    row['status'] = 'OK' if result['changed'] else 'SAME'
+                    row['error'] = None
+                    row['data'] = result['data']
+                    row['observed'] = collect_data.get_observation_time(result['kind'], result['data'])
+
+    def get_age(self, row):
+        if row['observed'] is None:
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return max(0.0, (now - row['observed']).total_seconds())
+
+    def get_colour(self, row):
+        if row['status'] == 'ERROR':
+            return Screen.COLOUR_RED
+        if row['status'] in ('WAIT', 'FETCH'):
+            return Screen.COLOUR_WHITE
+        age = self.get_age(row)
+        return Screen.COLOUR_YELLOW if age is None or age > STALE_AFTER else Screen.COLOUR_GREEN
+
+    def get_header(self, width):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        parts = ["STATION MONITOR %s" % (now)]
+        for kind in ('buoy', 'airport'):
+            if kind in self.cycles:
+                n_ok, n_stations, next_run = self.cycles[kind]
+                parts.append("%s %i/%i next %s" % (kind.upper(), n_ok, n_stations,
+                                                   datetime.fromtimestamp(next_run).strftime('%H:%M')))
+        counters = fetch_data.get_counters()
+        parts.append("req %i, 304 %i, cache %i, %.0f kB" % (counters['requests'], counters['not_modified'],
+                                                            counters['cache_hits'],
+                                                            counters['bytes_transferred'] / 1024))
+        return " | ".join(parts)[:width].ljust(width)
+
+    def draw_table(self, screen):
+        width, height = screen.width, screen.height
+        header = "%-8s %-7s %-20s %-6s" % ("STATION", "KIND", "NAME", "STATUS")
+        header += "".join(" %6s" % (name) for name, buoy_col, airport_col in VALUE_COLUMNS)
+        header += " %8s %8s %6s  %s" % ("LATENCY", "FETCHED", "AGE", "ERROR")
+        screen.print_at(self.get_header(width), 0, 0, colour=Screen.COLOUR_CYAN)
+        screen.print_at(header[:width].ljust(width), 0, 1, colour=Screen.COLOUR_WHITE, attr=Screen.A_BOLD)
+
+        n_visible = height - 3
+        self.scroll = max(0, min(self.scroll, len(self.order) - n_visible))
+        for line, file_id in enumerate(self.order[self.scroll:self.scroll + n_visible]):
+            row = self.rows[file_id]
+            text = "%-8.8s %-7s %-20.20s %-6s" % (file_id, row['kind'], row['name'], row['status'])
+            for name, buoy_col, airport_col in VALUE_COLUMNS:
+                col = airport_col if row['kind'] == 'airport' else buoy_col
+                value = row['data'].get(col) if (row['data'] is not None and col) else None
+                text += " %6s" % (format_value(value))
+            latency = '%.2fs' % (row['latency']) if row['latency'] is not None else '-'
+            fetched = (datetime.fromtimestamp(row['fetched']).strftime('%H:%M:%S')
+                       if row['fetched'] is not None else '-')
+            text += " %8s %8s %6s  %s" % (latency, fetched, format_age(self.get_age(row)),
+                                          row['error'] or '')
+            screen.print_at(text[:width].ljust(width), 0, line + 2, colour=self.get_colour(row))
+
+        footer = "%i stations | m: map, up/down/PgUp/PgDn: scroll, q: quit" % (len(self.order))
+        if self.alert is not None:
+            footer = "ALERT %s %s: %s (%s) | %s" % (self.alert['station'], self.alert['rule'],
+                                                   self.alert['message'], self.alert['observed'], footer)
+        screen.print_at(footer[:width].ljust(width), 0, height - 1,
+                        colour=Screen.COLOUR_WHITE if self.alert is None else Screen.COLOUR_RED)
+
+    def draw_map(self, screen):
+        colours = np.array([self.get_colour(self.rows[file_id]) for file_id in self.labels])
+        status = self.get_header(screen.width)[:screen.width - 30].rstrip() + " | m: table, q: quit"
+        terminal_map.draw_map(screen, self.lat, self.lon, self.labels, self.viewport,
+                              colours=colours, status=status)
+
+    def handle_key(self, key, screen):
+        """
+        :return: False to quit
+        """
+        if key in (ord('q'), ord('Q'), Screen.KEY_ESCAPE):
+            return False
+        if key in (ord('m'), ord('M')):
+            self.show_map = not self.show_map
+        elif self.show_map:
+            moves = {Screen.KEY_LEFT: (-terminal_map.PAN_STEP, 0), Screen.KEY_RIGHT: (terminal_map.PAN_STEP, 0),
+                     Screen.KEY_UP: (0, terminal_map.PAN_STEP), Screen.KEY_DOWN: (0, -terminal_map.PAN_STEP)}
+            if key in moves:
+                self.viewport = terminal_map.pan_viewport(self.viewport, *moves[key])
+            elif key in (ord('+'), ord('=')):
+                self.viewport = terminal_map.zoom_viewport(self.viewport, terminal_map.ZOOM_STEP)
+            elif key in (ord('-'), ord('_')):
+                self.viewport = terminal_map.zoom_viewport(self.viewport, 1 / terminal_map.ZOOM_STEP)
+        else:
+            page = max(1, screen.height - 3)
+            steps = {Screen.KEY_UP: -1, Screen.KEY_DOWN: 1,
+                     Screen.KEY_PAGE_UP: -page, Screen.KEY_PAGE_DOWN: page}
+            self.scroll += steps.get(key, 0)
+        return True
+
+    def run_screen(self, screen):
+        """
+        Screen loop, returns when q is pressed.
+        :raises ResizeScreenError: When the terminal is resized
+        """
+        redraw = True; last_draw = 0
+        while True:
+            if screen.has_resized():
+                raise ResizeScreenError("Terminal resized")
+            key = screen.get_key()
+            if key is not None:
+                if not self.handle_key(key, screen):
+                    return
+                redraw = True
+            redraw |= self.apply_updates()
+            # Ages and the header clock change every second
+            if redraw or time.time() - last_draw >= 1:
+                if self.show_map:
+                    screen.clear_buffer(Screen.COLOUR_WHITE, Screen.A_NORMAL, Screen.COLOUR_BLACK)
+                    self.draw_map(screen)
+                else:
+                    self.draw_table(screen)
+                screen.refresh()
+                redraw = False; last_draw = time.time()
+            time.sleep(REFRESH_INTERVAL if key is None else 0)
+
+def run(df_station_info, **schedule_kwargs):
+    """
+    Runs the scheduled collection with the live dashboard until q is
+    pressed. The running cycle is finished before returning.
+
+    :param schedule_kwargs: Keyword arguments of scheduler.add_collection_jobs
+                            (intervals, offsets, jitter and collect_data options)
+    """
+    dashboard = Dashboard(df_station_info)
+    collection_scheduler = scheduler.Scheduler()
+    scheduler.add_collection_jobs(collection_scheduler, df_station_info, dashboard.on_result,
+                                  on_cycle=dashboard.on_cycle, on_start=dashboard.on_start,
+                                  **schedule_kwargs)
+    # Printed alerts would garble the screen, they go to the footer instead
+    logged = alerts.remove_sink(alerts.log_sink)
+    alerts.add_sink(dashboard.on_alert)
+    thread = threading.Thread(target=collection_scheduler.run_forever, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                Screen.wrapper(dashboard.run_screen)
+                break
+            except ResizeScreenError:
+                continue
+    finally:
+        collection_scheduler.stop()
+        if thread.is_alive():
+            print("Finishing the running collection cycle...")
+        thread.join()
+        alerts.remove_sink(dashboard.on_alert)
+        if logged:
+            alerts.add_sink(alerts.log_sink)
+    return dashboard
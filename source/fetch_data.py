@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:05:51 2026
+
+Shared HTTP fetch layer for the NOAA sources.
+
+All downloads go through one requests.Session, so connections are kept alive
+and pooled per host. Responses are requested gzip compressed and every URL
+remembers its ETag / Last-Modified validators together with the parsed
+result: when the server answers 304 Not Modified the cached result is
+returned without downloading or parsing the body again. Fresh responses of
+the cached source types are served from disk without a request (cache_data).
+"""
+
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import cache_data
+
+# %% Attributes
+
+# Connection pool sizes of the shared session (hosts, connections per host)
+POOL_CONNECTIONS = 8;
+POOL_MAXSIZE = 32;
+HEADERS = {'Accept-Encoding': 'gzip', 'User-Agent': 'climate_monitor'};
+
+_SESSION = None;
+_LOCK = threading.Lock();
+# (url, parser name, cache key) -> {'etag': ..., 'last_modified': ..., 'value': parsed result, 'stored': time}
+_ENTRIES = {};
+# Transfer counters, see get_counters()
+_COUNTERS = {'requests': 0, 'not_modified': 0, 'cache_hits': 0,
+             'bytes_transferred': 0, 'bytes_decoded': 0, 'errors': 0};
+
+# %% Methods
+
+def get_session():
+    global _SESSION;
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                  pool_maxsize=POOL_MAXSIZE)
+            _SESSION.mount('https://', adapter)
+            _SESSION.mount('http://', adapter)
+            _SESSION.headers.update(HEADERS)
+        return _SESSION
+
+def count(name, value=1):
+    with _LOCK:
+        _COUNTERS[name] += value
+
+def get_counters():
+    """
+    :return: Copy of the counters: requests sent, 304 responses, responses
+             served from the disk cache, bytes transferred over the wire,
+             bytes after decompression and failed requests
+    """
+    with _LOCK:
+        return dict(_COUNTERS)
+
+def reset_counters():
+    with _LOCK:
+        for name in _COUNTERS:
+            _COUNTERS[name] = 0
+
+def clear_entries():
+    """
+    Forgets the validators and parsed results of every URL, the next fetch
+    downloads and parses the files again.
+    """
+    with _LOCK:
+        _ENTRIES.clear()
+
+def get_key(url, parse, key=None):
+    # The same file may be parsed in different ways (e.g. the header only),
+    # each parser keeps its own result. Closures share their qualified name,
+    # the key tells apart the ones parsing with other captured arguments
+    return (url, getattr(parse, '__qualname__', None), key)
+
+def remember(key, value, etag, last_modified, stored):
+    with _LOCK:
+        _ENTRIES[key] = {'etag': etag, 'last_modified': last_modified,
+                         'value': value, 'stored': stored}
+
+def parse_text(parse, text, source):
+    if parse is None:
+        return text
+    with metrics.timer('parse', source):
+        return parse(text)
+
+def get_stored_time(url, ttl):
+    cached = cache_data.get_entry(url) if ttl > 0 else None
+    return cached['stored'] if cached is not None else time.time()
+
+def fetch(url, parse=None, timeout=None, conditional=True, key=None):
+    """
+    Downloads a URL through the shared session. URLs of the cached source
+    types (see cache_data) are served from the on-disk cache while fresh.
+
+    :param url: URL to fetch
+    :param parse: Optional callable converting the response text into the
+                  returned value, skipped when the file has not changed
+    :param timeout: Request timeout in seconds
+    :param conditional: Send the stored ETag / Last-Modified validators
+    :param key: Optional hashable telling apart the results of parsers of
+                the same name, e.g. the arguments captured by a closure
+    :return: Tuple (value, modified), modified is False when the value is
+             the one already returned by an earlier call (304 Not Modified
+             or an unchanged cache entry)
+    :raises requests.RequestException: On network errors and HTTP errors
+    """
+    with _LOCK:
+        entry = _ENTRIES.get(get_key(url, parse, key)) if conditional else None
+    ttl = cache_data.get_ttl(url) if conditional else 0
+    source = cache_data.get_source(url) or 'other'
+    cached = cache_data.get_entry(url) if ttl > 0 else None
+
+    # Fresh copy in the disk cache, no request at all
+    if cached is not None and time.time() - cached['stored'] <= ttl:
+        if entry is not None and entry['stored'] == cached['stored']:
+            count('cache_hits')
+            metrics.inc('cache_hits_total', 1, 'Responses served from the disk cache', source=source)
+            return entry['value'], False
+        text = cache_data.read(url)
+        if text is not None:
+            count('cache_hits')
+            metrics.inc('cache_hits_total', 1, 'Responses served from the disk cache', source=source)
+            value = parse_text(parse, text, source)
+            remember(get_key(url, parse, key), value, cached['etag'], cached['last_modified'], cached['stored'])
+            return value, True
+
+    # Validators of the copy in memory or of a stale copy on disk
+    validators = entry if entry is not None else cached
+    headers = {}
+    if validators is not None:
+        if validators['etag']:
+            headers['If-None-Match'] = validators['etag']
+        if validators['last_modified']:
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    count('requests')
+    try:
+        with metrics.timer('fetch', source):
+            response = get_session().get(url, headers=headers, timeout=timeout)
+    except requests.RequestException as error:
+        count('errors')
+        metrics.inc('request_errors_total', 1, 'Failed requests (network errors and timeouts)',
+                    source=source, error=type(error).__name__)
+        raise
+    metrics.inc('requests_total', 1, 'HTTP requests by response status', source=source,
+                status=response.status_code)
+
+    if response.status_code == 304 and validators is not None:
+        count('not_modified')
+        if entry is not None:
+            value = entry['value']
+        else:
+            text = cache_data.read(url)
+            if text is None:
+                # The stale copy vanished in the meantime, download it again
+                return fetch(url, parse, timeout, conditional=False, key=key)
+            value = parse_text(parse, text, source)
+        if ttl > 0:
+            cache_data.touch(url)
+        stored = get_stored_time(url, ttl)
+        remember(get_key(url, parse, key), value, validators['etag'], validators['last_modified'], stored)
+        return value, entry is None
+
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        count('errors')
+        raise
+
+    text = response.text
+    wire_bytes = response.raw.tell() if hasattr(response.raw, 'tell') else 0
+    count('bytes_transferred', wire_bytes or len(response.content))
+    count('bytes_decoded', len(response.content))
+    metrics.inc('bytes_downloaded_total', wire_bytes or len(response.content),
+                'Bytes transferred over the wire', source=source)
+
+    value = parse_text(parse, text, source)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if ttl > 0:
+        cache_data.write(url, text, etag, last_modified)
+    stored = get_stored_time(url, ttl)
+    if etag or last_modified or ttl > 0:
+        remember(get_key(url, parse, key), value, etag, last_modified, stored)
+
+    return value, True
@@ -1,22 +1,44 @@
 import requests
 import pandas as pd
 import re
-from datetime import datetime
+import math
+from datetime import datetime, timezone
+
+import vmath
+import fetch_data
 
 URL_AIRPORTS_ROOT = "https://tgftp.nws.noaa.gov/data/observations/metar/decoded/"
+# Hourly cycle files holding the raw METAR reports of every station
+URL_METAR_CYCLES_ROOT = "https://tgftp.nws.noaa.gov/data/observations/metar/cycles/"
+
+# Precompiled patterns of the raw METAR groups, matched token by token
+METAR_DATE_LINE = re.compile(r'^(\d{4})/(\d{2})/(\d{2}) \d{2}:\d{2}$')
+METAR_HEAD = re.compile(r'^(?:METAR |SPECI )?([A-Z][A-Z0-9]{3}) (\d{2})(\d{2})(\d{2})Z\b')
+METAR_WIND = re.compile(r'^(?:\d{3}|VRB)(\d{2,3})(?:G\d{2,3})?(KT|MPS)$')
+METAR_VIS_M = re.compile(r'^(\d{4})(?:NDV)?$')
+METAR_VIS_SM = re.compile(r'^[MP]?(?:(\d+)|(\d)/(\d))SM$')
+METAR_TEMP = re.compile(r'^(M?\d{2})/(M?\d{2})?$')
+METAR_ALTIMETER = re.compile(r'^([QA])(\d{4})$')
+# Visibility of 10 km or more (9999, CAVOK, P6SM, "greater than 7 miles" in
+# the decoded reports) is stored as 10 km by both parsers
+VISIBILITY_MAX_KM = 10.0
 
-def get_data(airport_code):
+def get_data(airport_code, timeout=None):
     # URL to fetch METAR decoded data from NOAA
-    url = f"https://tgftp.nws.noaa.gov/data/observations/metar/decoded/{airport_code}.TXT"
-    
-    # Fetch the METAR data
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise ValueError(f"Could not fetch data for airport code {airport_code}. Please check the code and try again.")
+    url = f"{URL_AIRPORTS_ROOT}{airport_code}.TXT"
     
-    # Get the raw text data
-    data = response.text
+    # Fetch and parse the METAR data, an unchanged file is not parsed again
+    try:
+        weather_data, modified = fetch_data.fetch(url, parse=parse_data, timeout=timeout)
+    except requests.HTTPError as error:
+        # Server side errors are transient, let the caller retry
+        if error.response is not None and error.response.status_code >= 500:
+            raise
+        raise ValueError(f"Could not fetch data for airport code {airport_code}. Please check the code and try again.") from error
     
+    return dict(weather_data)
+
+def parse_data(data):
     # Initialize dictionary for storing extracted data
     raw_data = {
         'location': None,
@@ -33,22 +55,24 @@ def get_data(airport_code):
 
     # Extract relevant fields from the METAR text
     raw_data['location'] = re.search(r'^(.*) \(\w+\)', data).group(1)  # Location
-    raw_data['latitude_dms'], raw_data['longitude_dms'] = re.search(r'(\d+-\d+\w) (\d+-\d+\w)', data).groups()  # Latitude, Longitude
+    raw_data['latitude_dms'], raw_data['longitude_dms'] = re.search(r'(\d+-\d+(?:-\d+)?[NSEW]) (\d+-\d+(?:-\d+)?[NSEW])', data).groups()  # Latitude, Longitude
     raw_data['timestamp_utc'] = re.search(r'(\d{4}\.\d{2}\.\d{2} \d{4} UTC)', data).group(1)  # Timestamp in UTC
     
-    # Extract wind speed in knots
+    # Extract wind speed in knots, calm wind is 0 like in parse_metar
     wind_match = re.search(r'Wind: .* at (\d+) MPH \((\d+) KT\)', data)
     if wind_match:
         raw_data['wind_speed_knots'] = int(wind_match.group(2))  # Wind speed in knots
+    elif re.search(r'Wind: Calm', data):
+        raw_data['wind_speed_knots'] = 0
     
     # Extract visibility in miles
     visibility_match = re.search(r'Visibility: (greater than )?(\d+) mile', data)
     if visibility_match:
         raw_data['visibility_miles'] = int(visibility_match.group(2))
     
-    # Extract temperature and dew point in Celsius
-    temp_match = re.search(r'Temperature:.*\(([\d\.]+) C\)', data)
-    dew_point_match = re.search(r'Dew Point:.*\(([\d\.]+) C\)', data)
+    # Extract temperature and dew point in Celsius (negative below zero)
+    temp_match = re.search(r'Temperature:.*\((-?[\d\.]+) C\)', data)
+    dew_point_match = re.search(r'Dew Point:.*\((-?[\d\.]+) C\)', data)
     if temp_match:
         raw_data['temperature_C'] = float(temp_match.group(1))  # Allowing decimal temperatures
     if dew_point_match:
@@ -66,25 +90,25 @@ def get_data(airport_code):
     timestamp = datetime.strptime(raw_data['timestamp_utc'], "%Y.%m.%d %H%M %Z")
     timestamp_iso = timestamp.isoformat()
 
-    # Convert latitude and longitude from DMS to decimal
-    def dms_to_decimal(dms_str):
-        match = re.match(r'(\d+)-(\d+)([NSEW])', dms_str)
-        degrees = int(match.group(1))
-        minutes = int(match.group(2)) / 60
-        direction = match.group(3)
-        decimal = degrees + minutes
-        if direction in ['S', 'W']:
-            decimal = -decimal
-        return decimal
-
-    latitude = dms_to_decimal(raw_data['latitude_dms'])
-    longitude = dms_to_decimal(raw_data['longitude_dms'])
+    # Convert latitude and longitude from DMS to decimal (NaN when malformed)
+    latitude = vmath.dms_to_decimal(raw_data['latitude_dms'])
+    longitude = vmath.dms_to_decimal(raw_data['longitude_dms'])
 
     # Convert wind speed from knots to meters per second
-    wind_speed_m_s = raw_data['wind_speed_knots'] * 0.514444 if raw_data['wind_speed_knots'] else None
+    wind_speed_m_s = raw_data['wind_speed_knots'] * 0.514444 if raw_data['wind_speed_knots'] is not None else None
 
     # Convert visibility from miles to kilometers
-    visibility_km = raw_data['visibility_miles'] * 1.60934 if raw_data['visibility_miles'] else None
+    visibility_km = raw_data['visibility_miles'] * 1.60934 if raw_data['visibility_miles'] is not None else None
+    if visibility_match and visibility_match.group(1):
+        visibility_km = VISIBILITY_MAX_KM
+    elif visibility_km is not None:
+        visibility_km = min(visibility_km, VISIBILITY_MAX_KM)
+
+    # Relative humidity from the temperature and the dew point like in
+    # parse_metar, the rounded percentage of the report when they are missing
+    humidity = get_humidity(raw_data['temperature_C'], raw_data['dew_point_C'])
+    if humidity is None:
+        humidity = raw_data['humidity_percent']
 
     # Prepare the final data dictionary with SI units and ISO timestamp
     weather_data = {
@@ -92,11 +116,11 @@ def get_data(airport_code):
         'location': raw_data['location'],
         'latitude': round(latitude, 4),
         'longitude': round(longitude, 4),
-        'wind_speed_m_s': round(wind_speed_m_s, 2) if wind_speed_m_s else None,
-        'visibility_km': round(visibility_km, 2) if visibility_km else None,
+        'wind_speed_m_s': round(wind_speed_m_s, 2) if wind_speed_m_s is not None else None,
+        'visibility_km': round(visibility_km, 2) if visibility_km is not None else None,
         'temperature_C': raw_data['temperature_C'],
         'dew_point_C': raw_data['dew_point_C'],
-        'relative_humidity': raw_data['humidity_percent'],
+        'relative_humidity': humidity,
         'pressure_hPa': raw_data['pressure_hPa']
     }
 
@@ -105,6 +129,156 @@ def get_data(airport_code):
     
     return weather_data
 
+def metar_temperature(value):
+    # M marks negative temperatures in METAR (e.g. M03 = -3 C)
+    return -float(value[1:]) if value.startswith('M') else float(value)
+
+def relative_humidity(temperature_C, dew_point_C):
+    # Magnus formula
+    a = 17.625; b = 243.04
+    return 100 * math.exp(a * dew_point_C / (b + dew_point_C) - a * temperature_C / (b + temperature_C))
+
+def get_humidity(temperature_C, dew_point_C):
+    # Rounded relative humidity (%), None without both values
+    if temperature_C is None or dew_point_C is None:
+        return None
+    return round(relative_humidity(temperature_C, dew_point_C))
+
+def parse_metar(raw, year=None, month=None):
+    """
+    Parses a raw METAR report into the same record as get_data (SI units,
+    ISO timestamp). The report does not carry the station name or location,
+    these are left to the caller.
+    
+    :param raw: Raw METAR report, e.g. "EFJY 181220Z AUTO 22008KT 9999 ..."
+    :param year: Year of the report (METAR only holds the day of month)
+    :param month: Month of the report
+    :return: Tuple (ICAO code, record) or None for unparsable reports
+    """
+    head = METAR_HEAD.match(raw)
+    if head is None:
+        return None
+    code, day, hour, minute = head.groups()
+    if year is None or month is None:
+        now = datetime.now(timezone.utc)
+        year, month = now.year, now.month
+    try:
+        timestamp = datetime(int(year), int(month), int(day), int(hour), int(minute))
+    except ValueError:
+        return None
+    
+    wind_speed_m_s = None; visibility_km = None; temperature_C = None;
+    dew_point_C = None; pressure_hPa = None; previous = None;
+    
+    # Single pass over the groups of the report body, remarks are skipped
+    for token in raw[head.end():].split():
+        if token == 'RMK':
+            break
+        if wind_speed_m_s is None and (match := METAR_WIND.match(token)):
+            speed = int(match.group(1))
+            wind_speed_m_s = speed * 0.514444 if match.group(2) == 'KT' else float(speed)
+        elif visibility_km is None and token == 'CAVOK':
+            visibility_km = VISIBILITY_MAX_KM
+        elif visibility_km is None and (match := METAR_VIS_M.match(token)):
+            # 9999 is 10 km or more
+            visibility_km = min(int(match.group(1)) / 1000, VISIBILITY_MAX_KM)
+        elif visibility_km is None and (match := METAR_VIS_SM.match(token)):
+            if token.startswith('P'):
+                # More than the given miles, e.g. P6SM
+                miles = math.inf
+            elif match.group(1):
+                miles = int(match.group(1))
+            else:
+                miles = int(match.group(2)) / int(match.group(3))
+                # Whole miles are a separate group, e.g. "1 1/2SM"
+                if previous is not None and previous.isdigit():
+                    miles += int(previous)
+            visibility_km = min(miles * 1.60934, VISIBILITY_MAX_KM)
+        elif temperature_C is None and (match := METAR_TEMP.match(token)):
+            temperature_C = metar_temperature(match.group(1))
+            if match.group(2):
+                dew_point_C = metar_temperature(match.group(2))
+        elif pressure_hPa is None and (match := METAR_ALTIMETER.match(token)):
+            value = int(match.group(2))
+            # Q is given in hPa, A in hundredths of inches of mercury
+            pressure_hPa = value if match.group(1) == 'Q' else round(value / 100 * 33.8639)
+        previous = token
+    
+    humidity = get_humidity(temperature_C, dew_point_C)
+    
+    weather_data = {
+        'timestamp': timestamp.isoformat(),
+        'location': code,
+        'latitude': None,
+        'longitude': None,
+        'wind_speed_m_s': round(wind_speed_m_s, 2) if wind_speed_m_s is not None else None,
+        'visibility_km': round(visibility_km, 2) if visibility_km is not None else None,
+        'temperature_C': temperature_C,
+        'dew_point_C': dew_point_C,
+        'relative_humidity': humidity,
+        'pressure_hPa': pressure_hPa
+    }
+    return code, weather_data
+
+def parse_cycle_file(text):
+    """
+    Parses a METAR cycle file (a date line followed by the raw report, for
+    every station) in a single pass.
+    
+    :return: Dictionary of ICAO code -> newest record
+    """
+    records = {}
+    year = month = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        date = METAR_DATE_LINE.match(line)
+        if date is not None:
+            year, month = date.group(1), date.group(2)
+            continue
+        parsed = parse_metar(line, year, month)
+        if parsed is None:
+            continue
+        code, record = parsed
+        if code not in records or records[code]['timestamp'] <= record['timestamp']:
+            records[code] = record
+    return records
+
+def get_cycle_data(airport_codes=None, stations=None, cycle=None, timeout=None):
+    """
+    Downloads one METAR cycle file and returns the reports of many airports
+    at once. Airports missing from the current cycle are looked up from the
+    previous one.
+    
+    :param airport_codes: ICAO codes to return, None for every station in the file
+    :param stations: Optional dictionary of ICAO code -> (name, latitude,
+                     longitude) used to fill in the location fields
+    :param cycle: Cycle hour (0-23, UTC), defaults to the current hour
+    :return: Dictionary of ICAO code -> record
+    """
+    if cycle is None:
+        cycle = datetime.now(timezone.utc).hour
+    if airport_codes is not None:
+        airport_codes = set(airport_codes)
+    
+    records = {}
+    for hour in [cycle, (cycle - 1) % 24]:
+        url = f"{URL_METAR_CYCLES_ROOT}{hour:02d}Z.TXT"
+        cycle_records, modified = fetch_data.fetch(url, parse=parse_cycle_file, timeout=timeout)
+        for code, record in cycle_records.items():
+            if code not in records and (airport_codes is None or code in airport_codes):
+                records[code] = dict(record)
+        if airport_codes is not None and all(code in records for code in airport_codes):
+            break
+    
+    if stations is not None:
+        for code, record in records.items():
+            if code in stations:
+                record['location'], record['latitude'], record['longitude'] = stations[code]
+    
+    return records
+
 # Example usage
 # df = extract_metar_data("EFJY")
 # print(df)
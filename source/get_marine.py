@@ -5,10 +5,11 @@ Created on Mon Sep 16 11:48:59 2024
 @author: SuorantV
 """
 
-import requests
-from bs4 import BeautifulSoup
+import io
 import pandas as pd
+import numpy as np
 import vmath
+import fetch_data
 
 
 # %% Attributes
@@ -17,14 +18,21 @@ URL_BUOY_REALTIME_ROOT = "https://www.ndbc.noaa.gov/data/realtime2/";
 URL_BUOY_STATION_INFO = "https://www.ndbc.noaa.gov/data/stations/station_table.txt";
 COLS = [];
 
+# Columns of the realtime2 files holding the observation time (stored as int)
+TIME_COLS = ['#YY', 'MM', 'DD', 'hh', 'mm'];
+# NDBC marker for a missing value
+MISSING_VALUE = 'MM';
+
 # %% Methods
 
 def get_files_from_server(URL, extension=".txt", remove_extension=True):
     # Send a GET request to the URL
-    response = requests.get(URL);
+    text, modified = fetch_data.fetch(URL);
     
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(response.text, 'html.parser');
+    # Parse the HTML content using BeautifulSoup (imported here, it is only
+    # needed when the station list is refreshed)
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(text, 'html.parser');
     
     # Extract the links to files or folders
     links = []
@@ -47,17 +55,20 @@ def get_files_from_server(URL, extension=".txt", remove_extension=True):
 
 def get_table_from_server(URL, header=0):
     
-    DF_DATA = pd.DataFrame();
-    DF_DATA = pd.read_csv(URL, delimiter="|", header=header)
-    DF_DATA.columns = DF_DATA.columns.str.strip()
+    def parse(text):
+        DF_DATA = pd.read_csv(io.StringIO(text), delimiter="|", header=header)
+        DF_DATA.columns = DF_DATA.columns.str.strip()
+        return DF_DATA
     
-    return DF_DATA
+    DF_DATA, modified = fetch_data.fetch(URL, parse=parse, key=header)
+    
+    # The parsed table is shared with the fetch cache, hand out a copy
+    return DF_DATA.copy()
 
 def get_table_columns_from_server(URL, filename, extension='.txt', header=0):
         
-    DF_DATA = pd.DataFrame();
-    DF_DATA = pd.read_csv(URL+"/"+str(filename)+extension, 
-                          delimiter="|", nrows=0).columns.tolist()
+    text, modified = fetch_data.fetch(URL+str(filename)+extension)
+    DF_DATA = pd.read_csv(io.StringIO(text), delimiter="|", nrows=0).columns.tolist()
 
     return DF_DATA
 
@@ -66,9 +77,8 @@ def get_table_latest_value_from_server(URL, filename,
                                        header=0, nrows=3, 
                                        firstrow=1, isnum=True):
     
-    DF_DATA = pd.DataFrame();
-    DF_DATA = pd.read_csv(URL+"/"+str(filename)+extension, 
-                          sep="\s+", header=header, nrows=nrows);
+    text, modified = fetch_data.fetch(URL+str(filename)+extension)
+    DF_DATA = pd.read_csv(io.StringIO(text), sep="\s+", header=header, nrows=nrows);
     
     try:
         if (isnum):
@@ -97,7 +107,7 @@ def get_stations(par_selected_stations_only, par_station_list):
 
     # Fix the GPS format
     DF_STATION_INFO['LOCATION'] = DF_STATION_INFO['LOCATION'].str.split('(').str[0].str.strip()
-    DF_STATION_INFO['LATITUDE'], DF_STATION_INFO['LONGITUDE'] = zip(*DF_STATION_INFO['LOCATION'].apply(lambda x: vmath.convert_location(x)))
+    DF_STATION_INFO['LATITUDE'], DF_STATION_INFO['LONGITUDE'] = vmath.parse_ndbc_locations(DF_STATION_INFO['LOCATION'])
 
     # Get the columns for the realtime data using the first available station realtime data header
     COLS = get_table_columns_from_server(URL_BUOY_REALTIME_ROOT, DF_STATION_INFO['# STATION_ID'][0])
@@ -109,45 +119,85 @@ def get_stations(par_selected_stations_only, par_station_list):
     return DF_BUOY_IDs, DF_STATION_INFO
     
     
-def get_data(station_id):
+def parse_realtime_lines(lines, nrows=1):
+    """
+    Parses the header and the newest rows of an NDBC realtime2 file.
     
-    global COLS;
+    :param lines: Iterable of text lines (header, units row, data rows newest first)
+    :param nrows: Number of data rows to parse
+    :return: Column names and a list of typed records (dicts), newest first
+    """
+    lines = iter(lines)
+    
+    # First line is the header, second one the units
+    header = next(lines, '').split()
+    next(lines, None)
+    
+    records = []
+    for line in lines:
+        if len(records) >= nrows:
+            break
+        values = line.split()
+        if len(values) != len(header):
+            continue
+        record = {}
+        for col, value in zip(header, values):
+            if value == MISSING_VALUE:
+                record[col] = np.nan
+            elif col in TIME_COLS:
+                record[col] = int(value)
+            else:
+                record[col] = float(value)
+        records.append(record)
+    
+    return header, records
 
-    if not COLS:
-        COLS = get_table_columns_from_server(URL_BUOY_REALTIME_ROOT, station_id)
-        COLS = COLS[0].split()
+def get_latest_values_from_server(URL, filename, extension='.txt', 
+                                  nrows=1, timeout=None):
+    """
+    Downloads the station file once and parses only the header and the 
+    newest rows. When the file has not changed since the last call the 
+    server answers 304 and the previously parsed rows are returned.
     
-    df = {};
+    :return: Column names and a list of typed records, newest first
+    """
     
-    for COL in COLS:
-        df[COL] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                                     station_id,
-                                                     COL)
+    def parse(text):
+        # Only the header, units row and the newest rows are split into lines
+        return parse_realtime_lines(text.split('\n', nrows+2)[:nrows+2], nrows=nrows)
     
+    (header, records), modified = fetch_data.fetch(URL+str(filename)+extension,
+                                                   parse=parse, timeout=timeout, key=nrows)
+        
+    return header, records
+
+def get_data(station_id, timeout=None):
+    
+    global COLS;
+    
+    header, records = get_latest_values_from_server(URL_BUOY_REALTIME_ROOT, 
+                                                    station_id,
+                                                    timeout=timeout)
+    if header:
+        COLS = header
+    
+    # Keep the old behaviour for an empty file, every column is "N/A"
+    if not records:
+        return {COL: "N/A" for COL in COLS}
+    
+    return dict(records[0]);
+
+def get_data_batch(station_ids, timeout=None):
     """
-    df['Water Temperature'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                                 station_id,
-                                                 COLS[14])
-    df['Air Temperature'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                                 station_id,
-                                                 COLS[13])
-    df['Year'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                            station_id,
-                                            COLS[0])
-    df['Month'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                            station_id,
-                                            COLS[1])
-    df['Day'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                            station_id,
-                                            COLS[2])
-    df['Hour'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                            station_id,
-                                            COLS[3])
-    df['Minute'] = get_table_latest_value_from_server(URL_BUOY_REALTIME_ROOT, 
-                                            station_id,
-                                            COLS[4])
+    Fetches the latest observation for many buoys, one request per station.
+    
+    :param station_ids: Iterable of NDBC station ids
+    :return: Dictionary of station id -> latest record
     """
     
-    return df;
+    data = {};
     
+    for station_id in station_ids:
+        data[str(station_id)] = get_data(station_id, timeout=timeout)
     
+    return data;
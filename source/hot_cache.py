@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:31:40 2026
+
+In-memory cache of the recent observations of every station.
+
+The cache keeps the last SIZE observations of each station in fixed-size
+ring buffers. Every variable has one float32 matrix with a row per station
+and a column per ring position, the observation times are one float64
+matrix of the same shape. The row of a station is assigned on its first
+observation and the matrices grow by doubling, so the memory use is
+bounded by stations x variables x SIZE whatever the number of stored
+observations:
+
+    latest(station)       newest observation of a station, O(1)
+    history(station)      the buffered observations of a station, oldest first
+    snapshot(variables)   newest values of every station, one vectorized
+                          lookup per variable
+
+Lookups return Observation records. install() registers the cache as a
+store listener (see store_data.add_listener) and fills it from the newest
+rows of the station files, so readers of the latest values (e.g. the
+/api/latest endpoint of web_server.py) need not read the files.
+"""
+
+import os
+import calendar
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+import store_data
+import running_stats
+
+# %% Attributes
+
+# Observations kept per station
+SIZE = 24;
+# Initial number of station rows, doubled when full
+INITIAL_CAPACITY = 64;
+
+_INSTALLED = False;
+_INSTALL_LOCK = threading.Lock();
+
+# %% Classes
+
+class Observation:
+    """
+    One observation of a station: the observation time in epoch seconds
+    (UTC) and the numeric values by variable.
+    """
+    __slots__ = ('station_id', 'time', 'values')
+
+    def __init__(self, station_id, time, values):
+        self.station_id = station_id
+        self.time = time
+        self.values = values
+
+    def __repr__(self):
+        return 'Observation(%r, %s, %r)' % (self.station_id, self.get_datetime(), self.values)
+
+    def get_datetime(self):
+        return datetime.fromtimestamp(self.time, timezone.utc).replace(tzinfo=None)
+
+    def to_dict(self):
+        return {'station': self.station_id, 'time': self.get_datetime().strftime('%Y-%m-%d %H:%M:%S'),
+                'values': dict(self.values)}
+
+class HotCache:
+    """
+    Ring buffers of the last size observations of every station.
+    """
+    __slots__ = ('size', '_index', '_stations', '_times', '_values', '_head', '_count', '_lock')
+
+    def __init__(self, size=SIZE, capacity=INITIAL_CAPACITY):
+        self.size = size
+        self._lock = threading.Lock()
+        self.reset(capacity)
+
+    def reset(self, capacity):
+        # station id -> row of the matrices
+        self._index = {}
+        self._stations = []
+        self._times = np.full((capacity, self.size), np.nan)
+        # variable -> matrix of the values, NaN when missing
+        self._values = {}
+        # Ring position of the next observation and number of observations per row
+        self._head = np.zeros(capacity, dtype=np.int64)
+        self._count = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._stations)
+
+    def get_capacity(self):
+        return self._times.shape[0]
+
+    def get_row(self, station_id):
+        row = self._index.get(station_id)
+        if row is not None:
+            return row
+        row = len(self._stations)
+        if row == self.get_capacity():
+            self.grow(2 * row)
+        self._index[station_id] = row
+        self._stations.append(station_id)
+        return row
+
+    def grow(self, capacity):
+        def resize(matrix, fill):
+            grown = np.full((capacity,) + matrix.shape[1:], fill, dtype=matrix.dtype)
+            grown[:len(matrix)] = matrix
+            return grown
+        self._times = resize(self._times, np.nan)
+        self._values = {variable: resize(matrix, np.nan) for variable, matrix in self._values.items()}
+        self._head = resize(self._head, 0)
+        self._count = resize(self._count, 0)
+
+    def get_variable(self, variable):
+        matrix = self._values.get(variable)
+        if matrix is None:
+            matrix = self._values[variable] = np.full((self.get_capacity(), self.size), np.nan,
+                                                      dtype=np.float32)
+        return matrix
+
+    def add(self, station_id, time, values):
+        """
+        Adds an observation. An observation of the time of the newest one
+        replaces it (like the upsert of store_data), older ones are skipped.
+
+        :param time: Observation time, epoch seconds (UTC)
+        :param values: Dictionary of variable -> number (None or NaN when missing)
+        :return: True when the observation was added or replaced
+        """
+        station_id = str(station_id)
+        with self._lock:
+            row = self.get_row(station_id)
+            position = self._head[row]
+            if self._count[row]:
+                newest = (position - 1) % self.size
+                if time < self._times[row, newest]:
+                    return False
+                if time == self._times[row, newest]:
+                    position = newest
+            for variable in values:
+                self.get_variable(variable)
+            # Every variable is written, missing ones overwrite the old value with NaN
+            for variable, matrix in self._values.items():
+                value = values.get(variable)
+                matrix[row, position] = np.nan if value is None else value
+            self._times[row, position] = time
+            if position == self._head[row]:
+                self._head[row] = (position + 1) % self.size
+                self._count[row] = min(self._count[row] + 1, self.size)
+        return True
+
+    def get_observation(self, row, position):
+        values = {}
+        for variable, matrix in self._values.items():
+            value = matrix[row, position]
+            if not np.isnan(value):
+                values[variable] = to_float(value)
+        return Observation(self._stations[row], float(self._times[row, position]), values)
+
+    def latest(self, station_id):
+        """
+        :return: Newest Observation of a station, None when there is none
+        """
+        with self._lock:
+            row = self._index.get(str(station_id))
+            if row is None or not self._count[row]:
+                return None
+            return self.get_observation(row, (self._head[row] - 1) % self.size)
+
+    def history(self, station_id):
+        """
+        :return: List of the buffered Observations of a station, oldest first
+        """
+        with self._lock:
+            row = self._index.get(str(station_id))
+            if row is None:
+                return []
+            count = self._count[row]
+            start = self._head[row] - count
+            return [self.get_observation(row, position % self.size)
+                    for position in range(start, start + count)]
+
+    def snapshot(self, variables=None):
+        """
+        Newest values of every station.
+
+        :param variables: Variables to include, default all
+        :return: Tuple (station ids, observation times, {variable: values}),
+                 float32 arrays in the order of the station ids, NaN when
+                 missing
+        """
+        with self._lock:
+            n = len(self._stations)
+            rows = np.flatnonzero(self._count[:n])
+            positions = (self._head[rows] - 1) % self.size
+            variables = list(self._values) if variables is None else variables
+            values = {variable: (self._values[variable][rows, positions]
+                                 if variable in self._values else np.full(len(rows), np.nan, dtype=np.float32))
+                      for variable in variables}
+            return [self._stations[row] for row in rows], self._times[rows, positions], values
+
+    def get_variables(self):
+        with self._lock:
+            return list(self._values)
+
+    def clear(self):
+        with self._lock:
+            self.reset(INITIAL_CAPACITY)
+
+    def get_nbytes(self):
+        """
+        :return: Size of the buffers in bytes
+        """
+        return (self._times.nbytes + self._head.nbytes + self._count.nbytes
+                + sum(matrix.nbytes for matrix in self._values.values()))
+
+CACHE = HotCache();
+
+# %% Methods
+
+def to_float(value):
+    # Shortest decimal of the float32 value, 1013.2 instead of 1013.2000122
+    return float(str(value))
+
+def get_observation_time(row):
+    """
+    :return: Observation time of a stored row in epoch seconds (UTC): the
+             #YY/MM/DD/hh/mm fields of buoys, the METAR timestamp of
+             airports, otherwise the storage time
+    """
+    try:
+        if '#YY' in row:
+            observed = datetime(*(int(float(row[col])) for col in store_data.OBSERVATION_TIME_COLS))
+        elif 'timestamp' in row:
+            observed = datetime.fromisoformat(str(row['timestamp']))
+        else:
+            # Local time of the collector
+            return datetime.fromisoformat(str(row['Time'])).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+    return float(calendar.timegm(observed.utctimetuple()))
+
+def get_values(row):
+    """
+    :return: Numeric values of a stored row by variable
+    """
+    values = {}
+    for col, value in row.items():
+        if col in running_stats.EXCLUDED_COLS:
+            continue
+        value = running_stats.to_number(value)
+        if value is not None:
+            values[col] = value
+    return values
+
+def on_stored(station_id, row, cache=CACHE):
+    """
+    Store listener adding a stored row to the cache.
+    """
+    time = get_observation_time(row)
+    if time is not None:
+        cache.add(station_id, time, get_values(row))
+
+def load_folder(folder=store_data.DATA_FOLDER, cache=CACHE):
+    """
+    Fills the cache with the newest rows of every station file (the files
+    are read backwards, see store_data.read_last_rows).
+
+    :return: Number of stations loaded
+    """
+    n_stations = 0
+    for station_id in running_stats.list_station_files(folder):
+        if os.path.getsize(store_data.get_filename(station_id, folder)) == 0:
+            continue
+        for row in reversed(store_data.read_last_rows(station_id, cache.size, folder)):
+            on_stored(station_id, row, cache)
+        n_stations += 1
+    return n_stations
+
+def install(folder=store_data.DATA_FOLDER):
+    """
+    Registers the cache as a store listener and loads the station files,
+    once per process.
+    """
+    global _INSTALLED;
+    with _INSTALL_LOCK:
+        if _INSTALLED:
+            return
+        store_data.add_listener(on_stored)
+        _INSTALLED = True
+    if os.path.isdir(folder):
+        load_folder(folder)
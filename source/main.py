@@ -1,154 +1,315 @@
-import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt 
-import warnings
-import threading
+import sys
 import os
-import time
-from datetime import datetime, timedelta
+import subprocess
 
-import get_marine
-import get_airport
-import store_data
-import process_data
-import vmath
-import terminal_map
+# %% Startup profiling
+
+# Number of modules listed by the --profile-startup report
+PROFILE_TOP = 20;
+
+def profile_startup(top=PROFILE_TOP):
+    """
+    Runs the startup of main.py (imports and configuration, up to the first
+    prompt) in a fresh interpreter with -X importtime and prints the slowest
+    imports. Features import their dependencies on demand, so these are only
+    the modules needed to reach the menu.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__),
+                             '--imports-only'], capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented below the module importing them
+        imports.append((int(cumulative_us), int(self_us), name.rstrip(),
+                        len(name) - len(name.lstrip()) <= 1))
+    total_us = sum(cumulative_us for cumulative_us, self_us, name, is_top in imports if is_top)
+    print("STARTUP IMPORT TIME: %.1f ms in %i modules\n" % (total_us/1000, len(imports)))
+    print("%10s %10s  %s" % ("CUM. [ms]", "SELF [ms]", "MODULE"))
+    for cumulative_us, self_us, name, is_top in sorted(imports, reverse=True)[:top]:
+        print("%10.1f %10.1f  %s" % (cumulative_us/1000, self_us/1000, name))
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else "Startup failed")
 
-warnings.filterwarnings("ignore");
-os.system('clear');
+if '--profile-startup' in sys.argv:
+    profile_startup();
+    sys.exit();
+
+import threading
+from datetime import datetime
+
+import metrics
 
 # %% Configuration
 
-with open('config.py') as file:
-    exec(file.read())
+from config import *
 
 URL_SPACE_ROOT = "https://services.swpc.noaa.gov/text/"
 
-warnings.filterwarnings("default");
+metrics.configure(bool(par_metrics_enabled), bool(par_profile_enabled), par_profile_folder);
+# Stop after the imports, used by --profile-startup
+if '--imports-only' in sys.argv:
+    sys.exit();
+
+# Clears the terminal with ANSI escape codes instead of spawning a shell
+def clear_screen():
+    print("\033[2J\033[H", end='', flush=True);
+
+# The pandas based modules are imported by the features using them, after the
+# first prompt. The settings are applied before their first use.
+def configure_cache():
+    import cache_data
+    cache_data.configure(par_cache_folder, int(par_cache_max_size_mb * 1024 * 1024),
+                         par_cache_ttl, bool(par_cache_enabled));
+
+def configure_retention():
+    import retention
+    retention.configure(par_retention_raw_days, par_retention_hourly_days);
+
+# Evaluates the alert rules on every stored row when enabled, set up once so
+# the rule states survive returning to the menu
+ALERTS_CONFIGURED = False;
+def configure_alerts():
+    global ALERTS_CONFIGURED;
+    if (not par_alerts_enabled or ALERTS_CONFIGURED):
+        return;
+    import alerts
+    alerts.configure(True, par_alert_rules, par_alerts_cooldown, par_alerts_max_per_hour,
+                     log=True, filename=par_alerts_file, webhook=par_alerts_webhook);
+    alerts.install();
+    ALERTS_CONFIGURED = True;
+
+clear_screen();
 
 # %% Retrieve station info
 
 s = input("\nDo you wish to update the STATION INFO file? [y/n]: ");
+import station_info
 if (s=="y"):
-    # Fetch buoy data from ndbc.noaa.gov
-    print("FETCHING BUOY DATA...");
-    DF_BUOY_IDs, DF_STATION_INFO = get_marine.get_stations(par_selected_stations_only,
-                                                           par_station_list);
-    print("Found %i buoys" % (len(DF_STATION_INFO)));
-    
-    # Append airport data to the station info dataframe
-    print("\nFETCHING AIRPORT DATA...");
-    i=1;
-    for airport in par_airport_list:
-        DF_AIRPORTS = get_airport.get_data(airport);
-        DF_STATION_INFO.loc[len(DF_STATION_INFO)] = ['99999','','Airport','',DF_AIRPORTS['location'],'',airport,'','','',DF_AIRPORTS['latitude'],DF_AIRPORTS['longitude']];
-        i+=1;
+    configure_cache();
+    DF_STATION_INFO = station_info.refresh_station_info(par_selected_stations_only,
+                                                        par_station_list, par_airport_list);
     
     # Prompt user about saving the station list to file
-    print("Found %i airports" % (i));
     s = input("\nDo you wish to save the STATION INFO file? [y/n]: ");
     if (s=="y"):
         print("Writing data/station_info.txt ...");
-        DF_STATION_INFO.to_csv('data/station_info.txt', sep=';', index=False)
+        station_info.save_station_info(DF_STATION_INFO);
 else:
     print('Loading the saved STATION INFO file...');
     try:
-        DF_STATION_INFO = pd.read_csv('data/station_info.txt', sep=';');
+        DF_STATION_INFO = station_info.load_station_info();
     except:
         print("ERROR! Cannot find station info file!")
         print("Exiting program...");
         exit();
 
+# Convert station files written newest-first by older versions (runs only once)
+import store_data
+n_migrated = store_data.migrate_folder('data/');
+if (n_migrated > 0):
+    print("Migrated %i station files to the append-only format" % (n_migrated));
+
 # %% APP - STATION BROWSER
 # For maps: https://www.naturalearthdata.com/downloads/110m-cultural-vectors/
 # For annotations: https://mplcursors.readthedocs.io/en/stable/examples/change_popup_color.html
 
 # Thread: Print Stations
 def print_stations_thread():
-    os.system("clear");
+    clear_screen();
     print('MONITORED STATIONS:\n')
     print(DF_STATION_INFO[["# STATION_ID","LOCATION","NAME"]].to_string());
     input("\nPress any key to continue...");
 
 # Thread: Terminal Map
 def terminal_map_thread():
-    terminal_map.display_map(DF_STATION_INFO, "LATITUDE", "LONGITUDE", 
-                             additional_info_1="# STATION_ID",
-                             additional_info_2="LOCATION");
+    import terminal_map
+    station = input("\nCenter station (buoy id / ICAO code, empty for all stations): ").strip();
+    if (station == ''):
+        terminal_map.display_map(DF_STATION_INFO, "LATITUDE", "LONGITUDE", 
+                                 additional_info_1="# STATION_ID",
+                                 additional_info_2="LOCATION");
+        return;
+    try:
+        radius_km = float(input("Radius [km]: "));
+    except ValueError:
+        return;
+    n_stations = terminal_map.display_map_near(DF_STATION_INFO, station, radius_km,
+                                               additional_info_1="# STATION_ID",
+                                               additional_info_2="LOCATION");
+    if (n_stations == 0):
+        input("Unknown station %s, press any key to continue..." % (station));
+
+# Thread: Nearest buoys of the airports
+def nearest_buoys_thread():
+    import spatial_index
+    clear_screen();
+    print('NEAREST BUOY OF EACH AIRPORT\n')
+    print(spatial_index.get_nearest_buoys(DF_STATION_INFO).round(1).to_string(index=False));
+    input('\nPress any key to continue...');
 
 # Thread: Visualization
 def statistics_thread():
-    os.system('clear');
+    import process_data
+    configure_retention();
+    clear_screen();
     print('STATISTICS\n')
     process_data.print_stats_from_folder('data/');
     input('Press any key to continue...');
 
-# Thread: Monitoring
+# Thread: Statistics of all stations (buoys and airports) per month
+def window_statistics_thread():
+    import process_data
+    configure_retention();
+    clear_screen();
+    print('STATISTICS\n')
+    process_data.print_window_stats('data/', window='month');
+    input('Press any key to continue...');
+
+# Thread: Response Cache
+def cache_thread():
+    import cache_data
+    configure_cache();
+    clear_screen();
+    print('RESPONSE CACHE\n')
+    cache_data.print_entries();
+    s = input("\nPurge [a]ll, [e]xpired or [n]o entries? [a/e/n]: ");
+    if (s=='a' or s=='e'):
+        print("Removed %i entries" % (cache_data.purge(expired_only=(s=='e'))));
+        input('Press any key to continue...');
+
+# Thread: Web Server (runs in the background until the program exits)
+WEB_SERVER_THREAD = None;
+def web_server_thread():
+    global WEB_SERVER_THREAD;
+    import web_server
+    configure_retention();
+    if (WEB_SERVER_THREAD is None or not WEB_SERVER_THREAD.is_alive()):
+        WEB_SERVER_THREAD = threading.Thread(target=web_server.run,
+                                             args=(par_server_host, par_server_port),
+                                             daemon=True);
+        WEB_SERVER_THREAD.start();
+    print("\nWeb map served at http://%s:%i/" % (par_server_host, par_server_port));
+    input('Press any key to continue...');
+
+# Print a single station to the screen and store it, called as each fetch completes
+def print_and_store_result(result):
+    station_id = result['station_id']; dft = result['data'];
+    output_text = "";
+    if (result['error'] is not None):
+        print("%s %s | ERROR: %s" % (result['kind'].upper(), station_id, result['error']));
+        return;
+    if (result['kind'] == 'buoy'):
+        # Print BYOU data to the screen
+        output_text += "BUOY " + station_id + " ";
+        output_text += "| Water Direction [deg]: %3.3s " % (dft["WDIR"]);
+        output_text += "| Water Speed [m/s]: %4.4s " % (dft["WSPD"]);
+        output_text += "| Temperature Air / Water [degC]: %4.4s / %4.4s " % (dft["ATMP"],dft["WTMP"]);
+        output_text += "| Pressure [hPa]: %4.4s" % (dft["PRES"]);
+    else:
+        # Print AIRPORT data to the screen
+        output_text += "%22.22s " % (dft["location"]) ;
+        output_text += "| Wind Spd. [m/s]: %3.3s " % (dft["wind_speed_m_s"]);
+        output_text += "| Visb. [km]: %4.4s " % (dft["visibility_km"]);
+        output_text += "| Air Temp. [degC]: %4.4s " % (dft["temperature_C"]);
+        output_text += "| Rel. Hmd. [prcnt]: %3.3s " % (dft["relative_humidity"]);
+        output_text += "| Pres. [hPa]: %4.4s " % (dft["pressure_hPa"]);
+    print(output_text);
+    # An unchanged observation has already been stored in an earlier cycle
+    if (result['changed']):
+        store_data.append_file(station_id=station_id, 
+                               data_dict=dft)
+
+# Thread: Live monitoring dashboard
+def dashboard_thread():
+    import dashboard
+    configure_cache();
+    configure_retention();
+    configure_alerts();
+    try:
+        dashboard.run(DF_STATION_INFO,
+                      buoy_interval=par_buoy_interval, buoy_offset=par_buoy_offset,
+                      airport_interval=par_airport_interval, airport_offset=par_airport_offset,
+                      jitter=par_schedule_jitter,
+                      compaction_interval=par_compaction_interval,
+                      max_workers=par_max_workers,
+                      per_host_limit=par_per_host_limit,
+                      timeout=par_request_timeout,
+                      retries=par_max_retries,
+                      backoff=par_retry_backoff,
+                      airport_source=par_airport_source);
+    except KeyboardInterrupt:
+        pass
+
+# Thread: Monitoring (plain output, e.g. for logging to a file)
 def monitoring_thread():
-    # Do nothing
-    os.system('clear');
-    time_stamp_screen = os.times().elapsed;
-    time_stamp_data = os.times().elapsed;
-    refresh_interval = par_monitoring_interval * 60;
-    running = True; first_run = True;
-    while (running):
-        time_screen_refresh = os.times().elapsed - time_stamp_screen; 
-        if (time_screen_refresh >= refresh_interval or first_run):
-            first_run = False;
-            os.system('clear');
-            # Draw UI
-            print("STATION MONITOR");
-            print("Last update: %s - Next update: %s\n" % (datetime.now(), datetime.now()+timedelta(seconds=refresh_interval)));
-            for index in DF_STATION_INFO.index:
-                station_id = str(DF_STATION_INFO.iloc[index]['# STATION_ID'])
-                dft_all = []; output_text = "";
-                if (station_id != '99999'):
-                    # Print BYOU data to the screen
-                    dft = get_marine.get_data(station_id);
-                    output_text += "BUOY " + station_id + " ";
-                    output_text += "| Water Direction [deg]: %3.3s " % (dft["WDIR"]);
-                    output_text += "| Water Speed [m/s]: %4.4s " % (dft["WSPD"]);
-                    output_text += "| Temperature Air / Water [degC]: %4.4s / %4.4s " % (dft["ATMP"],dft["WTMP"]);
-                    output_text += "| Pressure [hPa]: %4.4s" % (dft["PRES"]);
-                    print(output_text);
-                    store_data.append_file(station_id=station_id, 
-                                         data_dict=dft)
-                if (station_id == '99999'):
-                    # Print AIRPORT data to the screen
-                    location = DF_STATION_INFO.iloc[index]['LOCATION']
-                    dft = get_airport.get_data(location);
-                    output_text += "%22.22s " % (dft["location"]) ;
-                    output_text += "| Wind Spd. [m/s]: %3.3s " % (dft["wind_speed_m_s"]);
-                    output_text += "| Visb. [km]: %4.4s " % (dft["visibility_km"]);
-                    output_text += "| Air Temp. [degC]: %4.4s " % (dft["temperature_C"]);
-                    output_text += "| Rel. Hmd. [prcnt]: %3.3s " % (dft["relative_humidity"]);
-                    output_text += "| Pres. [hPa]: %4.4s " % (dft["pressure_hPa"]);
-                    print(output_text);
-                    store_data.append_file(station_id=location, 
-                                         data_dict=dft)
-            print('\nFinished fetching data. Waiting for next scheduled query...')
-            # Update time stamp of last screen refresh
-            time_stamp_screen = os.times().elapsed;
-        time.sleep(0.1);
+    import scheduler
+    import fetch_data
+    configure_cache();
+    configure_retention();
+    configure_alerts();
+    clear_screen();
+    print("STATION MONITOR");
+    print("Started: %s - press Ctrl+C to return to the menu\n" % (datetime.now()));
+    
+    # Buoys and airports are collected on their own cadences, the scheduler
+    # sleeps until the next deadline in between
+    def print_cycle(kind, n_ok, n_stations, next_run):
+        scheduler.print_cycle(kind, n_ok, n_stations, next_run);
+        counters = fetch_data.get_counters();
+        print('Requests: %i, not modified: %i, from cache: %i, transferred: %.1f kB\n' % (counters['requests'], counters['not_modified'], counters['cache_hits'], counters['bytes_transferred']/1024));
+    
+    monitor_scheduler = scheduler.Scheduler();
+    scheduler.add_collection_jobs(monitor_scheduler, DF_STATION_INFO, print_and_store_result,
+                                  buoy_interval=par_buoy_interval, buoy_offset=par_buoy_offset,
+                                  airport_interval=par_airport_interval, airport_offset=par_airport_offset,
+                                  jitter=par_schedule_jitter, on_cycle=print_cycle,
+                                  compaction_interval=par_compaction_interval,
+                                  max_workers=par_max_workers,
+                                  per_host_limit=par_per_host_limit,
+                                  timeout=par_request_timeout,
+                                  retries=par_max_retries,
+                                  backoff=par_retry_backoff,
+                                  airport_source=par_airport_source);
+    try:
+        monitor_scheduler.run_forever();
+    except KeyboardInterrupt:
+        monitor_scheduler.stop();
 
 # Thread: Console
 while (True):
-    os.system('clear');
+    clear_screen();
     print("\n\nMENU:");
     print("10 - Print STATION INFO");
     print("20 - Show Stations over ASCII Map");
+    print("21 - Find Nearest Buoy of Each Airport");
     print("30 - Display Statistics");
+    print("31 - Display Monthly Statistics of All Stations");
     print("40 - Start Station Monitoring");
+    print("41 - Start Station Monitoring (plain output)");
+    print("50 - Inspect / Purge Response Cache");
+    print("60 - Start Web Server");
     print("0 - Quit");
     s = input("Selection: ");
     if (s=='10'):
         print_stations_thread();
     if (s=='20'):
         terminal_map_thread();
+    if (s=='21'):
+        nearest_buoys_thread();
     if (s=='30'):
         statistics_thread();
+    if (s=='31'):
+        window_statistics_thread();
     if (s=='40'):
+        dashboard_thread();
+    if (s=='41'):
         monitoring_thread();
+    if (s=='50'):
+        cache_thread();
+    if (s=='60'):
+        web_server_thread();
     if (s=='0'):
         break;
 
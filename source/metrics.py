@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:14:08 2026
+
+In-process instrumentation: counters, gauges and histograms with labels,
+rendered in the Prometheus text format (GET /metrics of web_server.py,
+run/collector.prom of 'cli.py collect').
+
+The collection is timed in stages: 'fetch' (network, per file source),
+'parse' (per file source), 'store' (file append) and 'stats' (running
+statistics update, per station kind). Besides, every station has a latency
+histogram of its complete fetch, error and retry counters and the age of
+its newest observation.
+
+Profiling: when enabled (see [Metrics] in config.ini) the code run inside
+profile(name) is profiled with cProfile in its own thread (on Python 3.12+
+by the first profiler started, which covers all the threads). The statistics
+of all threads are summed per name and written to the profile folder by
+save_profiles() after every collection cycle (e.g. collect-buoy-20261018-
+221500.prof, open with python3 -m pstats).
+"""
+
+import os
+import time
+import bisect
+import pstats
+import cProfile
+import threading
+import contextlib
+from datetime import datetime
+
+# %% Attributes
+
+ENABLED = True;
+PROFILE_ENABLED = False;
+PROFILE_FOLDER = 'run/profiles';
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0);
+PREFIX = 'climate_monitor_';
+
+_LOCK = threading.Lock();
+# name -> {'type': ..., 'help': ..., 'samples': {labels: value or Histogram}}
+_METRICS = {};
+# (source, station) -> observation time (epoch seconds)
+_OBSERVED = {};
+# name -> pstats.Stats summed over the threads, see profile()
+_PROFILES = {};
+
+# %% Classes
+
+class Histogram:
+    """
+    Cumulative histogram of observed values (Prometheus semantics).
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+# %% Methods
+
+def configure(enabled=None, profile_enabled=None, profile_folder=None):
+    """
+    Overrides the settings (see [Metrics] in config.ini).
+    """
+    global ENABLED, PROFILE_ENABLED, PROFILE_FOLDER;
+    if enabled is not None:
+        ENABLED = enabled
+    if profile_enabled is not None:
+        PROFILE_ENABLED = profile_enabled
+    if profile_folder is not None:
+        PROFILE_FOLDER = profile_folder
+
+def get_metric(name, kind, help_text):
+    metric = _METRICS.get(name)
+    if metric is None:
+        metric = _METRICS[name] = {'type': kind, 'help': help_text, 'samples': {}}
+    return metric
+
+def inc(name, value=1, help_text='', **labels):
+    """
+    Adds value to a counter (name without the prefix, ending with _total).
+    """
+    if not ENABLED:
+        return
+    key = tuple(sorted(labels.items()))
+    with _LOCK:
+        samples = get_metric(name, 'counter', help_text)['samples']
+        samples[key] = samples.get(key, 0) + value
+
+def set_gauge(name, value, help_text='', **labels):
+    if not ENABLED:
+        return
+    with _LOCK:
+        get_metric(name, 'gauge', help_text)['samples'][tuple(sorted(labels.items()))] = value
+
+def observe(name, value, help_text='', buckets=LATENCY_BUCKETS, **labels):
+    """
+    Adds a value to a histogram.
+    """
+    if not ENABLED:
+        return
+    key = tuple(sorted(labels.items()))
+    with _LOCK:
+        samples = get_metric(name, 'histogram', help_text)['samples']
+        if key not in samples:
+            samples[key] = Histogram(buckets)
+        samples[key].observe(value)
+
+@contextlib.contextmanager
+def timer(stage, source):
+    """
+    Times a stage of the collection into the stage_seconds histogram, also
+    when the stage fails.
+    """
+    time_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('stage_seconds', time.perf_counter() - time_start,
+                'Duration of the collection stages (fetch, parse, store, stats)',
+                stage=stage, source=source)
+
+def set_observation_time(source, station, timestamp):
+    """
+    :param timestamp: Observation time of the newest record, epoch seconds
+    """
+    if not ENABLED or timestamp is None:
+        return
+    with _LOCK:
+        _OBSERVED[(source, str(station))] = timestamp
+
+def reset():
+    with _LOCK:
+        _METRICS.clear()
+        _OBSERVED.clear()
+
+def format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % (','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                                .replace('"', '\\"').replace('\n', '\\n'))
+                              for name, value in labels))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """
+    :return: Every metric in the Prometheus text exposition format (0.0.4)
+    """
+    lines = []
+    now = time.time()
+    with _LOCK:
+        for name in sorted(_METRICS):
+            metric = _METRICS[name]
+            full_name = PREFIX + name
+            lines.append('# HELP %s %s' % (full_name, metric['help']))
+            lines.append('# TYPE %s %s' % (full_name, metric['type']))
+            for labels in sorted(metric['samples']):
+                value = metric['samples'][labels]
+                if metric['type'] != 'histogram':
+                    lines.append('%s%s %s' % (full_name, format_labels(labels), format_value(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %i' % (full_name, format_labels(labels, [('le', format_value(float(bound)))]),
+                                                     cumulative))
+                lines.append('%s_bucket%s %i' % (full_name, format_labels(labels, [('le', '+Inf')]), value.count))
+                lines.append('%s_sum%s %s' % (full_name, format_labels(labels), format_value(value.sum)))
+                lines.append('%s_count%s %i' % (full_name, format_labels(labels), value.count))
+
+        if _OBSERVED:
+            for name, help_text, get_value in [
+                    ('observation_timestamp_seconds', 'Time of the newest observation of a station',
+                     lambda timestamp: timestamp),
+                    ('observation_age_seconds', 'Age of the newest observation of a station (staleness)',
+                     lambda timestamp: max(0.0, now - timestamp))]:
+                lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+                lines.append('# TYPE %s%s gauge' % (PREFIX, name))
+                for (source, station), timestamp in sorted(_OBSERVED.items()):
+                    lines.append('%s%s%s %s' % (PREFIX, name, format_labels([('source', source), ('station', station)]),
+                                                format_value(float(get_value(timestamp)))))
+    return '\n'.join(lines) + '\n'
+
+# Profiling
+
+@contextlib.contextmanager
+def profile(name):
+    """
+    Profiles the block with cProfile when profiling is enabled, the result
+    is added to the statistics of name.
+    """
+    if not PROFILE_ENABLED:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows a single active profiler per process (it then
+        # sees every thread), the block is counted by the one already running
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _LOCK:
+            if name in _PROFILES:
+                _PROFILES[name].add(profiler)
+            else:
+                _PROFILES[name] = pstats.Stats(profiler)
+
+def save_profiles():
+    """
+    Writes the summed statistics of every profiled name and starts new ones.
+
+    :return: List of the written files
+    """
+    with _LOCK:
+        profiles = dict(_PROFILES)
+        _PROFILES.clear()
+    if not profiles:
+        return []
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    suffix = datetime.now().strftime('%Y%m%d-%H%M%S')
+    filenames = []
+    for name, stats in profiles.items():
+        filenames.append(os.path.join(PROFILE_FOLDER, '%s-%s.prof' % (name, suffix)))
+        stats.dump_stats(filenames[-1])
+    return filenames
@@ -8,41 +8,172 @@ Created on Sun Oct  6 21:42:13 2024
 import os
 import pandas as pd
 
-def print_stats_from_folder(folder_path):
-    
-    first_row = True;
-    df_buoys_mean = pd.DataFrame();
-    df_buoys_std = pd.DataFrame();
-    
+import running_stats
+
+def get_buoy_stats_from_folder(folder_path, rebuild=False):
+    """
+    Collects the yearly mean and standard deviation of every buoy from the
+    running statistics (see running_stats), without reading the history.
+
+    :param folder_path: Folder holding the station files
+    :param rebuild: Recompute the running statistics from the raw files first
+    :return: DataFrames of the yearly mean and standard deviation values
+    """
+    rows_mean = []; rows_std = [];
+
     # Loop through all the files in the directory
-    for file_name in os.listdir(folder_path):
-        
-        # Check if the file has a .txt extension
-        if file_name.endswith(".txt"):
-        
-            file_path = os.path.join(folder_path, file_name)
-            
-            # Handle Buoys
-            if file_name[0].isnumeric():
-                
-                # Load the content of the txt file into a DataFrame, assuming it's delimited (e.g., by space or comma)
-                df = pd.read_csv(file_path, delimiter=',', header=0)  # Adjust delimiter based on your file format
-                df = df.drop(columns=['Time', 'MM', 'DD', 'hh', 'mm']);                
-                
-                df_mean = df.groupby("#YY").mean()
-                df_mean.insert(0, "BUOY ID", file_name.rstrip(".txt"))
-                
-                df_std = df.groupby("#YY").std()
-                df_std.insert(0, "BUOY ID", file_name.rstrip(".txt"))
-                
-                df_buoys_mean = pd.concat([df_buoys_mean, df_mean], ignore_index=True)
-                df_buoys_mean = df_buoys_mean.sort_values(by="BUOY ID")
-                
-                df_buoys_std = pd.concat([df_buoys_std, df_std], ignore_index=True)
-                df_buoys_std = df_buoys_std.sort_values(by="BUOY ID")
-    
+    for file_name in sorted(os.listdir(folder_path)):
+
+        # Handle Buoys
+        if file_name.endswith(".txt") and file_name[0].isnumeric():
+
+            buoy_id = file_name[:-len(".txt")]
+            if rebuild:
+                running_stats.rebuild_station(buoy_id, folder_path)
+
+            for year, year_stats in running_stats.get_stats(buoy_id, folder_path).items():
+                row_mean = {"BUOY ID": buoy_id, "#YY": int(year)}
+                row_std = {"BUOY ID": buoy_id, "#YY": int(year)}
+                for col, (n, mean, std) in year_stats.items():
+                    row_mean[col] = mean
+                    row_std[col] = std
+                rows_mean.append(row_mean)
+                rows_std.append(row_std)
+
+    df_buoys_mean = pd.DataFrame(rows_mean)
+    df_buoys_std = pd.DataFrame(rows_std)
+    if rows_mean:
+        df_buoys_mean = df_buoys_mean.sort_values(by=["BUOY ID", "#YY"])
+        df_buoys_std = df_buoys_std.sort_values(by=["BUOY ID", "#YY"])
+
+    return df_buoys_mean, df_buoys_std
+
+def print_stats_from_folder(folder_path, rebuild=False, verify=False):
+
+    df_buoys_mean, df_buoys_std = get_buoy_stats_from_folder(folder_path, rebuild)
+
     print("BUOY YEARLY MEAN VALUES:\n")
     print(df_buoys_mean.round(2).to_string(index=False))
     print("\nBUOY YEARLY STANDARD DEVIATION:\n")
     print(df_buoys_std.round(2).to_string(index=False))
-    print("")
\ No newline at end of file
+    print("")
+
+    # Compare the running statistics against the raw files
+    if verify:
+        mismatches = running_stats.verify(folder_path)
+        for mismatch in mismatches:
+            print("MISMATCH %s %s %s: stored %s, recomputed %s" % mismatch)
+        print("Verified running statistics: %i mismatches\n" % (len(mismatches)))
+
+# %% Vectorized statistics over all stations
+
+# Columns of the buoy files holding the observation time
+BUOY_TIME_COLS = ['#YY', 'MM', 'DD', 'hh', 'mm'];
+# Calendar windows, mapped to pandas period frequencies
+CALENDAR_WINDOWS = {'year': 'Y', 'month': 'M', 'day': 'D'};
+
+def get_observation_time(df):
+    """
+    Observation time of every row: the #YY/MM/DD/hh/mm fields of buoys, the
+    METAR timestamp of airports and the storage time otherwise.
+    """
+    time = pd.to_datetime(df['Time'], errors='coerce')
+    if all(col in df.columns for col in BUOY_TIME_COLS):
+        fields = df[BUOY_TIME_COLS].apply(pd.to_numeric, errors='coerce')
+        fields.columns = ['year', 'month', 'day', 'hour', 'minute']
+        time = pd.to_datetime(fields, errors='coerce').fillna(time)
+    elif 'timestamp' in df.columns:
+        time = pd.to_datetime(df['timestamp'], errors='coerce').fillna(time)
+    return time
+
+def load_long_frame(folder_path, stations=None):
+    """
+    Loads the station files of a folder (buoys and airports) into a single
+    long-format DataFrame with the columns STATION, KIND, Time, VARIABLE and
+    VALUE. Each station is read from the columnar archive (see archive_data,
+    brought up to date with the station file first) and all of them are
+    concatenated in one go.
+
+    :param folder_path: Folder holding the station files
+    :param stations: Optional list of station ids to load
+    """
+    import archive_data
+
+    frames = []
+    for file_name in sorted(os.listdir(folder_path)):
+        if not file_name.endswith(".txt") or file_name == "station_info.txt":
+            continue
+        station_id = file_name[:-len(".txt")]
+        if stations is not None and station_id not in stations:
+            continue
+
+        df, time = archive_data.load_station(station_id, folder_path, observed=True)
+        if df.empty:
+            continue
+        time = time.astype('datetime64[ns]')
+        values = df.drop(columns=[col for col in df.columns
+                                  if col in running_stats.EXCLUDED_COLS])
+        values = values.apply(pd.to_numeric, errors='coerce').dropna(axis=1, how='all')
+        values.insert(0, 'Time', time)
+        values.insert(0, 'KIND', 'buoy' if station_id[0].isnumeric() else 'airport')
+        values.insert(0, 'STATION', station_id)
+        frames.append(values.melt(id_vars=['STATION', 'KIND', 'Time'],
+                                  var_name='VARIABLE', value_name='VALUE'))
+
+    if not frames:
+        return pd.DataFrame(columns=['STATION', 'KIND', 'Time', 'VARIABLE', 'VALUE'])
+
+    df_long = pd.concat(frames, ignore_index=True)
+    df_long = df_long.dropna(subset=['Time', 'VALUE'])
+    df_long['STATION'] = df_long['STATION'].astype('category')
+    df_long['VARIABLE'] = df_long['VARIABLE'].astype('category')
+    return df_long.reset_index(drop=True)
+
+def parse_window(window):
+    """
+    :return: Pandas period frequency for calendar windows ('year', 'month',
+             'day') or a rolling window offset for 'Nh' / N (hours)
+    """
+    if isinstance(window, str) and window in CALENDAR_WINDOWS:
+        return 'calendar', CALENDAR_WINDOWS[window]
+    hours = int(str(window).rstrip('hH'))
+    return 'rolling', '%ih' % (hours)
+
+def compute_stats(df_long, window='year', percentiles=(0.05, 0.5, 0.95)):
+    """
+    Computes count/mean/std/min/max and percentiles per station, variable and
+    window with a single groupby over the long-format frame.
+
+    :param df_long: Frame returned by load_long_frame
+    :param window: 'year', 'month', 'day' or a rolling window in hours ('6h' or 6)
+    :param percentiles: Percentiles to compute, as fractions
+    :return: DataFrame with one row per station, variable and window
+             (per sample for rolling windows)
+    """
+    kind, freq = parse_window(window)
+    percentile_names = ['p%g' % (p * 100) for p in percentiles]
+
+    if kind == 'calendar':
+        period = df_long['Time'].dt.to_period(freq).rename('PERIOD')
+        grouped = df_long.groupby(['STATION', 'VARIABLE', period], observed=True)['VALUE']
+        df_stats = grouped.agg(['count', 'mean', 'std', 'min', 'max'])
+        if len(percentiles) > 0:
+            df_percentiles = grouped.quantile(list(percentiles)).unstack()
+            df_percentiles.columns = percentile_names
+            df_stats = df_stats.join(df_percentiles)
+        return df_stats.reset_index()
+
+    df_sorted = df_long.sort_values(['STATION', 'VARIABLE', 'Time'])
+    rolling = df_sorted.groupby(['STATION', 'VARIABLE'], observed=True).rolling(freq, on='Time')['VALUE']
+    df_stats = rolling.agg(['count', 'mean', 'std', 'min', 'max'])
+    for p, name in zip(percentiles, percentile_names):
+        df_stats[name] = rolling.quantile(p).to_numpy()
+    df_stats['Time'] = df_sorted['Time'].to_numpy()
+    return df_stats.reset_index(level=['STATION', 'VARIABLE']).reset_index(drop=True)
+
+def print_window_stats(folder_path, window='month', percentiles=(0.05, 0.5, 0.95)):
+    df_stats = compute_stats(load_long_frame(folder_path), window, percentiles)
+
+    print("STATION STATISTICS PER %s:\n" % (str(window).upper()))
+    print(df_stats.round(2).to_string(index=False))
+    print("")
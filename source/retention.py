@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:48:12 2026
+
+Tiered retention of the station history.
+
+The raw samples of a station are kept for RAW_DAYS days (see [Retention] in
+config.ini). Older samples are rolled up into hourly aggregates, and hourly
+aggregates older than HOURLY_DAYS days into daily aggregates, which are kept
+forever:
+
+    data/<station>.txt          raw samples
+    data/hourly/<station>.txt   hourly aggregates
+    data/daily/<station>.txt    daily aggregates
+
+The tier files are in long format, one row per time bucket (observation
+time) and variable with the columns Time, VARIABLE, mean, min, max, count
+and m2 (sum of squared differences from the mean). With m2 the aggregates
+can be combined exactly, so the running statistics (running_stats.py) stay
+the same when the samples move between the tiers.
+
+The compaction runs as a background job of the scheduler (every
+compaction_interval minutes) or with 'cli.py compact'. The aggregates are
+written before the raw rows are removed: if the process dies in between,
+the rows are counted twice and 'cli.py stats --verify' reports the
+station. The columnar archive of a compacted station (see
+archive_data.py) is converted again.
+
+Queries pick the coarsest tier whose resolution still gives about
+max_points samples in the requested range, see read_frame().
+"""
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+import store_data
+import process_data
+import archive_data
+import running_stats
+
+# %% Attributes
+
+RAW_DAYS = 90;
+HOURLY_DAYS = 730;
+# Time between the compaction runs and minutes past the boundary, in seconds
+COMPACTION_INTERVAL = 24 * 3600;
+COMPACTION_OFFSET = 20 * 60;
+# Tiers from the finest to the coarsest and their resolution in seconds
+TIERS = ['raw', 'hourly', 'daily'];
+TIER_SECONDS = {'raw': 0, 'hourly': 3600, 'daily': 86400};
+TIER_FREQ = {'hourly': 'h', 'daily': 'D'};
+TIER_COLS = ['Time', 'VARIABLE', 'mean', 'min', 'max', 'count', 'm2'];
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S';
+
+_LOCK = threading.Lock();
+
+# %% Methods
+
+def configure(raw_days=None, hourly_days=None):
+    """
+    Overrides the settings (see [Retention] in config.ini).
+    """
+    global RAW_DAYS, HOURLY_DAYS;
+    if raw_days is not None:
+        RAW_DAYS = raw_days
+    if hourly_days is not None:
+        HOURLY_DAYS = hourly_days
+
+def get_now():
+    # Observation times are in UTC
+    return pd.Timestamp.now(tz='UTC').tz_localize(None)
+
+def get_tier_filename(station_id, tier, folder=store_data.DATA_FOLDER):
+    return os.path.join(folder, tier, str(station_id)+'.txt')
+
+def read_tier(station_id, tier, folder=store_data.DATA_FOLDER):
+    """
+    :return: DataFrame of the aggregates of a tier (TIER_COLS, Time as
+             datetime), empty when the station has none
+    """
+    filename = get_tier_filename(station_id, tier, folder)
+    if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+        return pd.DataFrame({col: pd.Series(dtype='datetime64[ns]' if col == 'Time' else
+                                            object if col == 'VARIABLE' else np.float64)
+                             for col in TIER_COLS})
+    df = pd.read_csv(filename, delimiter=',', header=0, dtype={'VARIABLE': str})
+    df['Time'] = pd.to_datetime(df['Time'], format=TIME_FORMAT)
+    return df
+
+def write_tier(station_id, tier, df, folder=store_data.DATA_FOLDER):
+    filename = get_tier_filename(station_id, tier, folder)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    df = df.sort_values(['Time', 'VARIABLE'], kind='stable')
+    df = df.assign(Time=df['Time'].dt.strftime(TIME_FORMAT), count=df['count'].astype(np.int64))
+    store_data.write_frame_atomic(filename, df[TIER_COLS])
+
+def aggregate_raw(df, freq):
+    """
+    Aggregates raw samples of a station file into time buckets.
+
+    :param freq: Bucket size, 'h' or 'D'
+    :return: DataFrame with the TIER_COLS
+    """
+    time = process_data.get_observation_time(df)
+    values = df.drop(columns=[col for col in df.columns if col in running_stats.EXCLUDED_COLS])
+    values = values.apply(pd.to_numeric, errors='coerce')
+    values['Time'] = time.dt.floor(freq)
+    long = values.melt(id_vars='Time', var_name='VARIABLE', value_name='VALUE')
+    long = long.dropna(subset=['Time', 'VALUE'])
+
+    grouped = long.groupby(['Time', 'VARIABLE'])['VALUE']
+    df_agg = grouped.agg(['mean', 'min', 'max', 'count'])
+    df_agg['m2'] = grouped.var(ddof=0) * df_agg['count']
+    return df_agg.reset_index()[TIER_COLS]
+
+def combine(df, by):
+    """
+    Combines aggregates per group (Chan et al. parallel combination of the
+    mean and m2).
+
+    :param by: Group keys, e.g. [df['Time'].dt.floor('D'), df['VARIABLE']]
+    :return: DataFrame indexed by the group keys with the columns mean, min,
+             max, count and m2
+    """
+    df = df.assign(weighted=df['mean'] * df['count'])
+    grouped = df.groupby(by)
+    df_out = grouped.agg(min=('min', 'min'), max=('max', 'max'), count=('count', 'sum'),
+                         weighted=('weighted', 'sum'), m2=('m2', 'sum'))
+    df_out['mean'] = df_out['weighted'] / df_out['count']
+    # Spread of the group means around the combined mean
+    total_mean = grouped['weighted'].transform('sum') / grouped['count'].transform('sum')
+    spread = df['count'] * (df['mean'] - total_mean) ** 2
+    df_out['m2'] += spread.groupby(by).sum()
+    return df_out[['mean', 'min', 'max', 'count', 'm2']]
+
+def rollup(df, freq):
+    """
+    :return: Aggregates combined into buckets of freq ('h' or 'D'), TIER_COLS
+    """
+    if df.empty:
+        return df[TIER_COLS]
+    by = [df['Time'].dt.floor(freq).rename('Time'), df['VARIABLE']]
+    return combine(df, by).reset_index()[TIER_COLS]
+
+def merge_tier(station_id, tier, df_new, folder=store_data.DATA_FOLDER):
+    """
+    Adds aggregates to a tier file, buckets already in the file are combined.
+    """
+    if df_new.empty:
+        return
+    df_old = read_tier(station_id, tier, folder)
+    frames = [df for df in [df_old, df_new] if not df.empty]
+    write_tier(station_id, tier, rollup(pd.concat(frames, ignore_index=True), TIER_FREQ[tier]), folder)
+
+def get_raw_cutoff(now=None):
+    """
+    :return: Observation time (UTC) before which the raw samples are rolled up
+    """
+    now = pd.Timestamp(now) if now is not None else get_now()
+    return (now - pd.Timedelta(days=RAW_DAYS)).floor('h')
+
+def get_rolled_up(station_id, time, folder=store_data.DATA_FOLDER, now=None):
+    """
+    Finds the observations of the rolled up period whose bucket is already
+    in the hourly or daily tier. Stored as raw samples again (e.g. by the
+    backfill) they would be combined into the bucket a second time by the
+    next compaction.
+
+    :param time: Series of observation times (UTC)
+    :return: Boolean array, True for the observations to skip
+    """
+    rolled_up = np.zeros(len(time), dtype=bool)
+    old = (time < get_raw_cutoff(now)).to_numpy()
+    if not old.any():
+        return rolled_up
+    for tier in TIERS[1:]:
+        df_tier = read_tier(station_id, tier, folder)
+        if not df_tier.empty:
+            rolled_up |= old & time.dt.floor(TIER_FREQ[tier]).isin(df_tier['Time']).to_numpy()
+    return rolled_up
+
+def compact_station(station_id, folder=store_data.DATA_FOLDER, now=None):
+    """
+    Rolls the raw samples older than RAW_DAYS into the hourly tier and the
+    hourly aggregates older than HOURLY_DAYS into the daily tier.
+
+    :param now: Current time (UTC), defaults to the clock
+    :return: Tuple (number of raw rows, number of hourly rows) rolled up
+    """
+    now = pd.Timestamp(now) if now is not None else get_now()
+    raw_cutoff = get_raw_cutoff(now)
+    hourly_cutoff = (now - pd.Timedelta(days=HOURLY_DAYS)).floor('D')
+
+    with _LOCK:
+        n_raw = 0
+        if os.path.isfile(store_data.get_filename(station_id, folder)):
+            df_removed = store_data.remove_rows(
+                station_id, lambda df: (process_data.get_observation_time(df) < raw_cutoff).to_numpy(),
+                folder, on_removed=lambda df: merge_tier(station_id, 'hourly', aggregate_raw(df, 'h'), folder))
+            n_raw = len(df_removed)
+
+        df_hourly = read_tier(station_id, 'hourly', folder)
+        old = (df_hourly['Time'] < hourly_cutoff).to_numpy()
+        if old.any():
+            merge_tier(station_id, 'daily', rollup(df_hourly[old], 'D'), folder)
+            write_tier(station_id, 'hourly', df_hourly[~old], folder)
+    # The archive mirrors the rewritten station file
+    if n_raw:
+        archive_data.sync_station(station_id, folder)
+    return n_raw, int(old.sum())
+
+def compact_folder(folder=store_data.DATA_FOLDER, now=None, verbose=False):
+    """
+    Compacts every station of a folder.
+
+    :return: Dictionary of station id -> (raw rows, hourly rows) rolled up
+    """
+    station_ids = set(running_stats.list_station_files(folder))
+    for tier in TIERS[1:]:
+        if os.path.isdir(os.path.join(folder, tier)):
+            station_ids |= set(running_stats.list_station_files(os.path.join(folder, tier)))
+    results = {}
+    for station_id in sorted(station_ids):
+        try:
+            results[station_id] = compact_station(station_id, folder, now)
+        except (OSError, ValueError, KeyError) as error:
+            print("%s: compaction failed: %s" % (station_id, error))
+            continue
+        if verbose and any(results[station_id]):
+            print("%s: rolled up %i raw and %i hourly rows" % ((station_id,) + results[station_id]))
+    return results
+
+def get_tier_state(station_id, folder=store_data.DATA_FOLDER):
+    """
+    :return: Running statistics state of the rolled up samples,
+             {year: {variable: [n, mean, M2]}} (see running_stats)
+    """
+    frames = [df for df in [read_tier(station_id, tier, folder) for tier in TIERS[1:]] if not df.empty]
+    if not frames:
+        return {}
+    df = pd.concat(frames, ignore_index=True)
+    df_state = combine(df, [df['Time'].dt.year.astype(str).rename('year'), df['VARIABLE']])
+    state = {}
+    for (year, col), row in df_state.iterrows():
+        state.setdefault(year, {})[col] = [int(row['count']), float(row['mean']), float(row['m2'])]
+    return state
+
+def get_resolution_tier(start, end, max_points):
+    """
+    :return: Coarsest tier whose resolution gives at least max_points
+             buckets between start and end
+    """
+    if not max_points or start is None or end is None:
+        return 'raw'
+    resolution = (pd.Timestamp(end) - pd.Timestamp(start)).total_seconds() / max_points
+    for tier in reversed(TIERS):
+        if TIER_SECONDS[tier] <= resolution:
+            return tier
+    return 'raw'
+
+def to_wide(df):
+    """
+    :return: Mean values of aggregates as a station file like DataFrame
+    """
+    df_wide = df.pivot_table(index='Time', columns='VARIABLE', values='mean', aggfunc='first')
+    df_wide.columns.name = None
+    df_wide = df_wide.sort_index().reset_index()
+    df_wide['Time'] = df_wide['Time'].dt.strftime(TIME_FORMAT)
+    return df_wide
+
+def with_observation_time(df):
+    """
+    :return: Raw rows with the observation time as Time, oldest first
+    """
+    time = process_data.get_observation_time(df)
+    df = df.assign(Time=time.dt.strftime(TIME_FORMAT))
+    return df.iloc[np.argsort(time.to_numpy(), kind='stable')].reset_index(drop=True)
+
+def read_raw_frame(station_id, folder=store_data.DATA_FOLDER):
+    """
+    :return: Raw rows of a station from the columnar archive (see
+             archive_data) with the observation time as Time, oldest first
+    """
+    df_raw = with_observation_time(archive_data.load_station(station_id, folder))
+    # Time stamps of the airports as in the station file
+    for col in archive_data.TIME_COLS[1:]:
+        if col in df_raw.columns:
+            df_raw[col] = archive_data.to_text(df_raw[col].to_numpy(), 'time', col).to_numpy()
+    return df_raw
+
+def read_frame(station_id, start=None, end=None, max_points=None, folder=store_data.DATA_FOLDER,
+               df_raw=None):
+    """
+    Reads the history of a station at the resolution of the coarsest tier
+    that gives about max_points samples in [start, end]. Samples of the
+    finer tiers are aggregated to that resolution and periods only covered
+    by coarser tiers are filled with their aggregates, so the whole range is
+    returned. The rows are not filtered to the range.
+
+    Time is the observation time (UTC) in every tier. The raw rows are
+    read from the columnar archive (see archive_data) and stored with the
+    local time of the collector, their Time is replaced by the observation
+    time.
+
+    :param start, end: Requested range, default from the oldest sample to now
+    :param df_raw: Raw rows as returned by read_raw_frame, read when None.
+                   Not modified.
+    :return: Tuple (tier, DataFrame with Time and the mean of every
+             variable), the raw rows oldest first when the station has no
+             rolled up samples
+    """
+    if df_raw is None:
+        df_raw = read_raw_frame(station_id, folder)
+    df_tiers = {tier: read_tier(station_id, tier, folder) for tier in TIERS[1:]}
+    if all(df.empty for df in df_tiers.values()):
+        return 'raw', df_raw
+
+    if start is None:
+        start = min(df['Time'].iloc[0] for df in df_tiers.values() if not df.empty)
+    tier = get_resolution_tier(start, end if end is not None else get_now(), max_points)
+
+    frames = [df for df in df_tiers.values() if not df.empty]
+    if tier == 'raw':
+        df = pd.concat([to_wide(pd.concat(frames, ignore_index=True)), df_raw], ignore_index=True)
+        df = df.sort_values('Time', kind='stable', ignore_index=True)
+    else:
+        if not df_raw.empty:
+            frames.append(aggregate_raw(df_raw, TIER_FREQ[tier]))
+        df = to_wide(rollup(pd.concat(frames, ignore_index=True), TIER_FREQ[tier]))
+    # Columns of the station file first, text columns are empty in the aggregates
+    columns = list(df_raw.columns) + [col for col in df.columns if col not in df_raw.columns]
+    return tier, df.reindex(columns=columns)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:20:05 2026
+
+Incremental statistics of the station files.
+
+For every station, year and variable the running count, mean and M2 (sum of
+squared differences from the mean, Welford's algorithm) are kept in
+data/stats/<station>.json. store_data.append_file updates them with each new
+sample (and replace() swaps the newest sample of an upserted observation),
+so the yearly mean and standard deviation are available without
+reading the history. rebuild() recomputes the state from the raw files and
+the aggregates of the retention tiers (see retention.py), verify() compares
+both.
+"""
+
+import os
+import json
+import math
+import argparse
+
+# %% Attributes
+
+STATS_FOLDER = 'stats';
+# Columns that are not statistics variables (time stamp and date fields)
+EXCLUDED_COLS = ['Time', '#YY', 'MM', 'DD', 'hh', 'mm', 'timestamp',
+                 'latitude', 'longitude'];
+
+# In-memory copy of the state files, station id -> {year: {variable: [n, mean, M2]}}
+_STATE = {};
+
+# %% Methods
+
+def get_year(data_dict):
+    """
+    Year of the observation: #YY for buoys, the METAR timestamp for airports,
+    otherwise the time the sample was stored.
+    """
+    for col in ['#YY', 'timestamp', 'Time']:
+        value = data_dict.get(col)
+        if value is None:
+            continue
+        try:
+            return str(int(float(str(value)[:4])))
+        except ValueError:
+            continue
+    return None
+
+def get_years(df):
+    """
+    Vectorized get_year for a whole station file.
+    """
+    import pandas as pd
+
+    years = pd.Series(pd.NA, index=df.index, dtype='Int64')
+    for col in ['#YY', 'timestamp', 'Time']:
+        if col in df.columns:
+            year = pd.to_numeric(df[col].astype(str).str[:4], errors='coerce')
+            years = years.fillna(year.astype('Int64'))
+    return years.astype(str).where(years.notna())
+
+def to_number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+def get_state_filename(station_id, folder):
+    return os.path.join(folder, STATS_FOLDER, str(station_id)+'.json')
+
+def load_state(station_id, folder):
+    key = (os.path.normpath(folder), str(station_id))
+    if key not in _STATE:
+        filename = get_state_filename(station_id, folder)
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                _STATE[key] = json.load(f)
+        else:
+            _STATE[key] = None
+    return _STATE[key]
+
+def save_state(station_id, folder, state):
+    filename = get_state_filename(station_id, folder)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+    _STATE[(os.path.normpath(folder), str(station_id))] = state
+
+def add_sample(state, data_dict):
+    year = get_year(data_dict)
+    if year is None:
+        return
+    year_state = state.setdefault(year, {})
+    for col, value in data_dict.items():
+        value = to_number(value)
+        if col in EXCLUDED_COLS or value is None:
+            continue
+        n, mean, M2 = year_state.get(col, [0, 0.0, 0.0])
+        n += 1
+        delta = value - mean
+        mean += delta / n
+        M2 += delta * (value - mean)
+        year_state[col] = [n, mean, M2]
+
+def remove_sample(state, data_dict):
+    """
+    Reverse Welford update, removes a sample added earlier.
+    """
+    year = get_year(data_dict)
+    year_state = state.get(year) if year is not None else None
+    if year_state is None:
+        return
+    for col, value in data_dict.items():
+        value = to_number(value)
+        if col in EXCLUDED_COLS or value is None or col not in year_state:
+            continue
+        n, mean, M2 = year_state[col]
+        if n <= 1:
+            del year_state[col]
+            continue
+        mean_removed = (n * mean - value) / (n - 1)
+        M2 = max(0.0, M2 - (value - mean) * (value - mean_removed))
+        year_state[col] = [n - 1, mean_removed, M2]
+    if not year_state:
+        del state[year]
+
+def update(station_id, data_dict, folder='data/'):
+    """
+    Adds one sample to the running statistics of a station (Welford update).
+    Called by store_data.append_file after the sample has been written.
+    """
+    if get_year(data_dict) is None:
+        return
+    state = load_state(station_id, folder)
+    if state is None:
+        # No state yet, start from the history on disk (already holding the sample)
+        rebuild_station(station_id, folder)
+        return
+    add_sample(state, data_dict)
+    save_state(station_id, folder, state)
+
+def replace(station_id, old_dict, new_dict, folder='data/'):
+    """
+    Replaces a sample of the running statistics, called by
+    store_data.append_file after the newest row has been overwritten.
+    """
+    state = load_state(station_id, folder)
+    if state is None:
+        rebuild_station(station_id, folder)
+        return
+    remove_sample(state, old_dict)
+    add_sample(state, new_dict)
+    save_state(station_id, folder, state)
+
+def get_stats(station_id, folder='data/'):
+    """
+    :return: Dictionary of year -> variable -> (count, mean, std), std is
+             the sample standard deviation (NaN for less than two samples)
+    """
+    state = load_state(station_id, folder)
+    if state is None:
+        state = rebuild_station(station_id, folder)
+    stats = {}
+    for year, year_state in state.items():
+        stats[year] = {}
+        for col, (n, mean, M2) in year_state.items():
+            std = math.sqrt(M2 / (n - 1)) if n > 1 else float('nan')
+            stats[year][col] = (n, mean, std)
+    return stats
+
+def compute_state(filename):
+    """
+    Computes the statistics state from a raw station file in one pass.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(filename, delimiter=',', header=0)
+    if df.empty:
+        return {}
+    years = get_years(df)
+    values = df.drop(columns=[col for col in df.columns if col in EXCLUDED_COLS])
+    values = values.apply(pd.to_numeric, errors='coerce')
+
+    state = {}
+    grouped = values.groupby(years)
+    counts = grouped.count(); means = grouped.mean(); M2s = grouped.var(ddof=0) * counts
+    for year in counts.index:
+        for col in counts.columns:
+            n = int(counts.at[year, col])
+            if n > 0:
+                state.setdefault(year, {})[col] = [n, float(means.at[year, col]),
+                                                   float(M2s.at[year, col])]
+    return state
+
+def merge_state(state, other):
+    """
+    Adds the samples of another state (Chan et al. parallel combination).
+    """
+    for year, year_state in other.items():
+        target = state.setdefault(year, {})
+        for col, (n_b, mean_b, M2_b) in year_state.items():
+            n_a, mean_a, M2_a = target.get(col, [0, 0.0, 0.0])
+            n = n_a + n_b
+            delta = mean_b - mean_a
+            target[col] = [n, mean_a + delta * n_b / n, M2_a + M2_b + delta * delta * n_a * n_b / n]
+    return state
+
+def compute_station_state(station_id, folder='data/'):
+    """
+    Computes the state of a station from its raw file and the rolled up
+    samples of the retention tiers.
+    """
+    import retention
+
+    filename = os.path.join(folder, str(station_id)+'.txt')
+    state = compute_state(filename) if os.path.isfile(filename) else {}
+    return merge_state(state, retention.get_tier_state(station_id, folder))
+
+def rebuild_station(station_id, folder='data/', save=True):
+    state = compute_station_state(station_id, folder)
+    if save:
+        save_state(station_id, folder, state)
+    return state
+
+def list_station_files(folder):
+    return sorted(file_name[:-len('.txt')] for file_name in os.listdir(folder)
+                  if file_name.endswith('.txt') and file_name != 'station_info.txt')
+
+def rebuild(folder='data/'):
+    """
+    Recomputes the statistics state of every station from the raw files.
+    """
+    for station_id in list_station_files(folder):
+        rebuild_station(station_id, folder)
+
+def verify(folder='data/', rel_tol=1e-6):
+    """
+    Compares the stored running statistics with statistics recomputed from
+    the raw files.
+
+    :return: List of (station, year, variable, stored, recomputed) mismatches
+    """
+    mismatches = []
+    for station_id in list_station_files(folder):
+        stored = load_state(station_id, folder) or {}
+        recomputed = compute_station_state(station_id, folder)
+        for year in sorted(set(stored) | set(recomputed)):
+            cols = set(stored.get(year, {})) | set(recomputed.get(year, {}))
+            for col in sorted(cols):
+                a = stored.get(year, {}).get(col)
+                b = recomputed.get(year, {}).get(col)
+                if (a is None or b is None or a[0] != b[0]
+                        or not math.isclose(a[1], b[1], rel_tol=rel_tol, abs_tol=1e-9)
+                        or not math.isclose(a[2], b[2], rel_tol=rel_tol, abs_tol=1e-6)):
+                    mismatches.append((station_id, year, col, a, b))
+    return mismatches
+
+# %% Command line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Running statistics of the station files')
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--data', default='data/')
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        rebuild(args.data)
+        print("Rebuilt statistics of %i stations" % (len(list_station_files(args.data))))
+    if args.command == 'verify':
+        mismatches = verify(args.data)
+        for mismatch in mismatches:
+            print("MISMATCH %s %s %s: stored %s, recomputed %s" % mismatch)
+        print("%i mismatches" % (len(mismatches)))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:47:22 2026
+
+Event-driven scheduler of the collection jobs.
+
+Every source has its own interval and an offset aligning the runs to the
+NOAA publication times (e.g. realtime2 files are complete some 45 minutes
+past the hour, METAR reports shortly after the full hour). A random jitter
+spreads the requests of many collectors. The compaction of the retention
+tiers (retention.py) runs as a job of its own. Between runs the scheduler sleeps
+until the next deadline instead of polling.
+
+    python3 scheduler.py        runs the collection headless (cli.py collect)
+"""
+
+import time
+import heapq
+import random
+import threading
+from datetime import datetime
+
+import collect_data
+
+# %% Classes
+
+class Job:
+    """
+    A callback run every interval seconds at offset seconds past the
+    interval boundary (UTC epoch aligned), delayed by up to jitter seconds.
+    """
+    def __init__(self, name, callback, interval, offset=0, jitter=0):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.offset = offset
+        self.jitter = jitter
+        self.next_run = None
+
+    def get_next_run(self, now, with_jitter=True):
+        boundary = (now - self.offset) // self.interval * self.interval + self.offset
+        jitter = random.uniform(0, self.jitter) if with_jitter else 0
+        return boundary + self.interval + jitter
+
+class Scheduler:
+
+    def __init__(self):
+        self._queue = []
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+
+    def add_job(self, job, run_now=True):
+        """
+        :param run_now: Run the job right away instead of waiting for its
+                        first aligned deadline
+        """
+        now = time.time()
+        job.next_run = now if run_now else job.get_next_run(now)
+        with self._lock:
+            # The counter keeps jobs with equal deadlines in insertion order
+            heapq.heappush(self._queue, (job.next_run, self._counter, job))
+            self._counter += 1
+        self._wake.set()
+
+    def get_jobs(self):
+        with self._lock:
+            return [job for next_run, counter, job in sorted(self._queue)]
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def run_forever(self):
+        """
+        Runs the jobs at their deadlines until stop() is called. Sleeps until
+        the next deadline, stop() and add_job() wake it up early.
+        """
+        self._running = True
+        while self._running:
+            with self._lock:
+                next_run = self._queue[0][0] if self._queue else None
+            timeout = None if next_run is None else max(0, next_run - time.time())
+            if timeout is None or timeout > 0:
+                self._wake.wait(timeout)
+                self._wake.clear()
+                continue
+            if not self._running:
+                break
+
+            with self._lock:
+                next_run, counter, job = heapq.heappop(self._queue)
+            try:
+                job.callback()
+            except Exception as error:
+                print("%s ERROR in job %s: %s" % (datetime.now(), job.name, error))
+            job.next_run = job.get_next_run(time.time())
+            with self._lock:
+                heapq.heappush(self._queue, (job.next_run, counter, job))
+
+# %% Methods
+
+def filter_station_info(df_station_info, kind):
+    is_airport = df_station_info['# STATION_ID'].astype(str) == collect_data.AIRPORT_STATION_ID
+    return df_station_info[is_airport if kind == 'airport' else ~is_airport]
+
+def add_collection_jobs(scheduler, df_station_info, on_result, buoy_interval=3600,
+                        buoy_offset=45*60, airport_interval=3600, airport_offset=5*60,
+                        jitter=60, on_cycle=None, on_start=None, compaction_interval=None,
+                        **collect_kwargs):
+    """
+    Adds one collection job per source type (buoys, airports) to the
+    scheduler, and the compaction job of the retention tiers.
+
+    :param on_result: Callback receiving every result (see collect_data),
+                      results with changed=False repeat the previous
+                      observation of the station and need not be stored
+    :param on_cycle: Optional callback on_cycle(kind, n_ok, n_stations, next_run)
+                     called after each run of a job, next_run excludes the jitter
+    :param on_start: Optional callback on_start(kind, df_kind) called before
+                     each run of a job with the stations it fetches
+    :param compaction_interval: Time between the compaction runs in seconds
+                                (see retention), None disables the job
+    :param collect_kwargs: Keyword arguments for collect_data.collect_stations
+    """
+    jobs = {}
+    for kind, interval, offset in [('buoy', buoy_interval, buoy_offset),
+                                   ('airport', airport_interval, airport_offset)]:
+        df_kind = filter_station_info(df_station_info, kind)
+        if df_kind.empty:
+            continue
+
+        def run(kind=kind, df_kind=df_kind):
+            if on_start is not None:
+                on_start(kind, df_kind)
+            n_ok = collect_data.collect_stations(df_kind, on_result, **collect_kwargs)
+            if on_cycle is not None:
+                on_cycle(kind, n_ok, len(df_kind),
+                         jobs[kind].get_next_run(time.time(), with_jitter=False))
+
+        jobs[kind] = Job(kind, run, interval, offset, jitter)
+        scheduler.add_job(jobs[kind])
+
+    if compaction_interval:
+        import retention
+        # Runs between the collection cycles, not at startup
+        scheduler.add_job(Job('compaction', retention.compact_folder, compaction_interval,
+                              retention.COMPACTION_OFFSET), run_now=False)
+
+def print_cycle(kind, n_ok, n_stations, next_run):
+    print("%s %s: fetched %i / %i stations, next run at %s" % (
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'), kind.upper(), n_ok, n_stations,
+        datetime.fromtimestamp(next_run).strftime('%H:%M:%S')))
+
+# %% Headless collection
+
+if __name__ == '__main__':
+    import sys
+    import cli
+    sys.exit(cli.main(['collect'] + sys.argv[1:]))
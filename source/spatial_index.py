@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:04:51 2026
+
+Spatial index of the stations for radius and nearest-neighbour queries.
+
+The stations are bucketed into a latitude/longitude grid (cell_size
+degrees). The cells are stored sorted by cell number, so the stations of a
+row of cells are one contiguous slice found with a binary search. A query
+only computes haversine distances for the stations of the cells overlapping
+the search area; k-nearest queries widen the radius until k stations are
+certainly found. Longitudes wrap around the antimeridian and the cells near
+the poles cover every longitude.
+
+    python3 spatial_index.py nearest [--k 1]
+    python3 spatial_index.py near 60.2 24.9 --radius 200
+    python3 spatial_index.py check [--radius 5000] [--queries 200]
+                                    compares the radius queries with a
+                                    brute-force haversine search
+"""
+
+import math
+import argparse
+import numpy as np
+import pandas as pd
+
+import vmath
+import station_info
+
+# %% Attributes
+
+# Grid cell size in degrees
+CELL_SIZE = 1.0;
+
+# %% Classes
+
+class SpatialIndex:
+    """
+    Grid index over points given in degrees. Points with a missing
+    coordinate are not indexed.
+    """
+    def __init__(self, latitudes, longitudes, cell_size=CELL_SIZE):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_size = cell_size
+        self.n_rows = int(math.ceil(180 / cell_size))
+        self.n_cols = int(math.ceil(360 / cell_size))
+
+        valid = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+        cells = self.get_cells(latitudes[valid], longitudes[valid])
+        order = np.argsort(cells, kind='stable')
+        # Positions (in the original arrays) and coordinates sorted by cell
+        self.positions = valid[order]
+        self.cells = cells[order]
+        self.latitudes = latitudes[self.positions]
+        self.longitudes = longitudes[self.positions]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get_rows(self, latitudes):
+        return np.clip(((np.asarray(latitudes) + 90) // self.cell_size).astype(np.int64),
+                       0, self.n_rows - 1)
+
+    def get_cols(self, longitudes):
+        return (((np.asarray(longitudes) + 180) % 360) // self.cell_size).astype(np.int64) % self.n_cols
+
+    def get_cells(self, latitudes, longitudes):
+        return self.get_rows(latitudes) * self.n_cols + self.get_cols(longitudes)
+
+    def get_candidates(self, lat, lon, radius_km):
+        """
+        :return: Sorted positions (in the sorted arrays) of the stations in
+                 the cells overlapping the search area
+        """
+        radius_deg = math.degrees(radius_km / vmath.EARTH_RADIUS_KM)
+        lat_min = lat - radius_deg; lat_max = lat + radius_deg
+        # Longitude span at the latitude farthest from the equator
+        max_abs_lat = max(abs(lat_min), abs(lat_max))
+        if max_abs_lat >= 90 or radius_deg >= 180:
+            lon_span = 360
+        else:
+            lon_span = min(360, radius_deg / math.cos(math.radians(max_abs_lat)))
+
+        row_first, row_last = self.get_rows([max(lat_min, -90), min(lat_max, 90)])
+        # Near the full circle the first and last columns wrap onto the same
+        # or crossing cells, the range is every longitude
+        if 2 * lon_span >= 360 - self.cell_size:
+            col_ranges = [(0, self.n_cols - 1)]
+        else:
+            col_first = int(self.get_cols(lon - lon_span))
+            col_last = int(self.get_cols(lon + lon_span))
+            # Areas crossing the antimeridian are split in two ranges
+            col_ranges = ([(col_first, col_last)] if col_first <= col_last
+                          else [(col_first, self.n_cols - 1), (0, col_last)])
+
+        slices = []
+        for row in range(row_first, row_last + 1):
+            for col_first, col_last in col_ranges:
+                start, end = np.searchsorted(self.cells, [row * self.n_cols + col_first,
+                                                          row * self.n_cols + col_last + 1])
+                if end > start:
+                    slices.append(np.arange(start, end))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def query_radius(self, lat, lon, radius_km):
+        """
+        :return: Tuple (indices, distances in km) of the points within
+                 radius_km of (lat, lon), nearest first. Indices refer to
+                 the arrays the index was built from.
+        """
+        candidates = self.get_candidates(lat, lon, radius_km)
+        distances = vmath.haversine_km(lat, lon, self.latitudes[candidates],
+                                       self.longitudes[candidates])
+        inside = distances <= radius_km
+        candidates = candidates[inside]; distances = distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return self.positions[candidates[order]], distances[order]
+
+    def query_knn(self, lat, lon, k=1):
+        """
+        :return: Tuple (indices, distances in km) of the k points nearest to
+                 (lat, lon), nearest first
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        # Widen the search until it holds k points, every point outside the
+        # search radius is farther than the ones found inside it
+        radius_km = math.radians(self.cell_size) * vmath.EARTH_RADIUS_KM
+        while True:
+            indices, distances = self.query_radius(lat, lon, radius_km)
+            if len(indices) >= k or radius_km >= math.pi * vmath.EARTH_RADIUS_KM:
+                return indices[:k], distances[:k]
+            radius_km *= 2
+
+# %% Methods
+
+def build_index(df_station_info, cell_size=CELL_SIZE):
+    return SpatialIndex(pd.to_numeric(df_station_info['LATITUDE'], errors='coerce'),
+                        pd.to_numeric(df_station_info['LONGITUDE'], errors='coerce'),
+                        cell_size)
+
+def get_stations_near(df_station_info, lat, lon, radius_km=None, k=None, index=None):
+    """
+    Stations within radius_km of a point and/or the k nearest ones.
+
+    :param index: Prebuilt index of df_station_info, built when None
+    :return: Rows of df_station_info with a DISTANCE_KM column, nearest first
+    """
+    index = index if index is not None else build_index(df_station_info)
+    if radius_km is not None:
+        indices, distances = index.query_radius(lat, lon, radius_km)
+        if k is not None:
+            indices, distances = indices[:k], distances[:k]
+    else:
+        indices, distances = index.query_knn(lat, lon, k if k is not None else 1)
+    df_near = df_station_info.iloc[indices].copy()
+    df_near['DISTANCE_KM'] = distances
+    return df_near
+
+def check_radius(index, lat, lon, radius_km):
+    """
+    Compares a radius query with a brute-force haversine search over every
+    indexed point.
+
+    :return: Tuple (missing, extra) arrays of the indices found only by the
+             brute-force search and only by the index
+    """
+    distances = vmath.haversine_km(lat, lon, index.latitudes, index.longitudes)
+    expected = index.positions[distances <= radius_km]
+    found, _ = index.query_radius(lat, lon, radius_km)
+    return np.setdiff1d(expected, found), np.setdiff1d(found, expected)
+
+def check_index(index, radius_km, n_queries=200, seed=0):
+    """
+    Cross-checks radius queries of random points against the brute-force
+    search, see check_radius.
+
+    :return: List of (lat, lon, missing, extra) of the queries that differ
+    """
+    rng = np.random.default_rng(seed)
+    # Uniform on the sphere, so the polar caps are not over-sampled
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1, 1, n_queries)))
+    longitudes = rng.uniform(-180, 180, n_queries)
+    failures = []
+    for lat, lon in zip(latitudes, longitudes):
+        missing, extra = check_radius(index, lat, lon, radius_km)
+        if len(missing) or len(extra):
+            failures.append((lat, lon, missing, extra))
+    return failures
+
+def get_nearest_buoys(df_station_info, k=1):
+    """
+    Nearest buoys of every airport.
+
+    :return: DataFrame with the columns AIRPORT, BUOY and DISTANCE_KM, k rows
+             per airport
+    """
+    is_airport = (df_station_info['# STATION_ID'].astype(str) == station_info.AIRPORT_STATION_ID).to_numpy()
+    df_airports = df_station_info[is_airport]; df_buoys = df_station_info[~is_airport]
+    buoy_ids = station_info.get_file_identifiers(df_buoys).to_numpy()
+    index = build_index(df_buoys)
+
+    rows = []
+    for airport, lat, lon in zip(station_info.get_file_identifiers(df_airports),
+                                 pd.to_numeric(df_airports['LATITUDE'], errors='coerce'),
+                                 pd.to_numeric(df_airports['LONGITUDE'], errors='coerce')):
+        if not (np.isfinite(lat) and np.isfinite(lon)):
+            continue
+        indices, distances = index.query_knn(lat, lon, k)
+        rows += [{'AIRPORT': airport, 'BUOY': buoy_ids[i], 'DISTANCE_KM': distance}
+                 for i, distance in zip(indices, distances)]
+    return pd.DataFrame(rows, columns=['AIRPORT', 'BUOY', 'DISTANCE_KM'])
+
+# %% Command line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Station distance queries')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    nearest_parser = subparsers.add_parser('nearest', help='Nearest buoys of every airport')
+    nearest_parser.add_argument('--k', type=int, default=1)
+    near_parser = subparsers.add_parser('near', help='Stations near a point')
+    near_parser.add_argument('latitude', type=float)
+    near_parser.add_argument('longitude', type=float)
+    near_parser.add_argument('--radius', type=float, default=None, help='Radius in km')
+    near_parser.add_argument('--k', type=int, default=None)
+    check_parser = subparsers.add_parser('check', help='Compare radius queries with a brute-force search')
+    check_parser.add_argument('--radius', type=float, default=5000, help='Radius in km')
+    check_parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    df_station_info = station_info.load_station_info()
+    if args.command == 'nearest':
+        print(get_nearest_buoys(df_station_info, args.k).round(1).to_string(index=False))
+    if args.command == 'near':
+        df_near = get_stations_near(df_station_info, args.latitude, args.longitude,
+                                    args.radius, args.k)
+        print(df_near[['# STATION_ID', 'LOCATION', 'NAME', 'DISTANCE_KM']].round(1).to_string(index=False))
+    if args.command == 'check':
+        failures = check_index(build_index(df_station_info), args.radius, args.queries)
+        for lat, lon, missing, extra in failures:
+            print("%.2f %.2f: %i missing, %i extra" % (lat, lon, len(missing), len(extra)))
+        print("%i of %i queries differ" % (len(failures), args.queries))
+        if failures:
+            raise SystemExit(1)
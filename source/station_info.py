@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:02:44 2026
+
+Station info file (data/station_info.txt): the monitored buoys and airports
+with their locations. Shared by the interactive menu (main.py) and the
+command line interface (cli.py).
+"""
+
+import os
+import pandas as pd
+
+# %% Attributes
+
+STATION_INFO_FILE = 'data/station_info.txt';
+# Station id of the airports, which are identified by their ICAO code (LOCATION)
+AIRPORT_STATION_ID = '99999';
+
+# %% Methods
+
+def load_station_info(filename=STATION_INFO_FILE):
+    """
+    :raises OSError: When the file does not exist
+    """
+    if not os.path.isfile(filename):
+        raise FileNotFoundError("Cannot find station info file %s" % (filename))
+    return pd.read_csv(filename, sep=';')
+
+def save_station_info(df_station_info, filename=STATION_INFO_FILE):
+    # Written next to the target and renamed, readers never see a partial file
+    df_station_info.to_csv(filename + '.tmp', sep=';', index=False)
+    os.replace(filename + '.tmp', filename)
+
+def refresh_station_info(selected_stations_only, station_list, airport_list, verbose=True):
+    """
+    Downloads the buoy station table from ndbc.noaa.gov and the location of
+    every configured airport.
+
+    :return: Station info DataFrame (buoys first, then airports)
+    """
+    # The station sources (BeautifulSoup, requests) are only needed here
+    import get_marine
+    import get_airport
+
+    # Fetch buoy data from ndbc.noaa.gov
+    if verbose:
+        print("FETCHING BUOY DATA...")
+    df_buoy_ids, df_station_info = get_marine.get_stations(selected_stations_only, station_list)
+    if verbose:
+        print("Found %i buoys" % (len(df_station_info)))
+
+    # Append airport data to the station info dataframe
+    if verbose:
+        print("\nFETCHING AIRPORT DATA...")
+    n_airports = 0
+    for airport in airport_list:
+        airport_data = get_airport.get_data(airport)
+        df_station_info.loc[len(df_station_info)] = [AIRPORT_STATION_ID, '', 'Airport', '',
+                                                     airport_data['location'], '', airport,
+                                                     '', '', '', airport_data['latitude'],
+                                                     airport_data['longitude']]
+        n_airports += 1
+    if verbose:
+        print("Found %i airports" % (n_airports))
+
+    return df_station_info
+
+def get_file_identifiers(df_station_info):
+    """
+    :return: Series of the station file identifiers (see store_data): the
+             buoy id, or the ICAO code of an airport
+    """
+    station_ids = df_station_info['# STATION_ID'].astype(str)
+    locations = df_station_info['LOCATION'].astype(str).str.replace(' ', '_')
+    return station_ids.where(station_ids != AIRPORT_STATION_ID, locations)
@@ -4,51 +4,409 @@
 Created on Fri Sep 27 18:54:28 2024
 
 @author: suoravi
+
+Station files are append-only CSV files with the oldest sample first. New
+samples are appended at the end of the file (O(1)) and flushed to disk with
+fsync, new files are created atomically. Newest-first access is provided by
+reading the file backwards.
+
+Rows are keyed on the observation time (#YY/MM/DD/hh/mm of buoys, the METAR
+timestamp of airports). The key of the newest row of every station is kept
+in memory, so a repeated observation is recognized without reading the
+file: an identical one is not stored again, a corrected one replaces the
+newest row (upsert) and an older one is skipped.
 """
 
 import os
 import csv
+import threading
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
-def append_file(station_id, data_dict):
+import metrics
+import running_stats
+
+# %% Attributes
+
+DATA_FOLDER = 'data/';
+STATION_INFO_FILE = 'station_info.txt';
+# Marker written once the folder has been migrated to the append-only layout
+MIGRATION_MARKER = '.append_only';
+# Block size used when reading files backwards
+REVERSE_READ_BLOCK = 8192;
+# Columns of the buoy files holding the observation time
+OBSERVATION_TIME_COLS = ['#YY', 'MM', 'DD', 'hh', 'mm'];
+# Callbacks listener(station_id, row) notified of every stored row
+_LISTENERS = [];
+# (folder, station id) -> (file size, mtime, key, row) of the newest row
+_LAST_ROWS = {};
+_LOCK = threading.Lock();
+
+# %% Methods
+
+def add_listener(listener):
+    """
+    Registers a callback called with the station id and the stored row (a
+    dictionary including the Time column) after every row appended or
+    replaced by append_file(). The callback runs in the thread storing the data and must return quickly.
+    """
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+def remove_listener(listener):
+    if listener in _LISTENERS:
+        _LISTENERS.remove(listener)
+
+def notify_listeners(station_id, row):
+    for listener in list(_LISTENERS):
+        try:
+            listener(station_id, row)
+        except Exception as error:
+            print("%s ERROR in store listener: %s" % (datetime.now(), error))
+
+def get_filename(station_id, folder=DATA_FOLDER):
+    return os.path.join(folder, str(station_id)+'.txt')
+
+def write_rows_atomic(filename, rows):
+    """
+    Writes all rows to a temporary file, syncs it and renames it over the
+    target, so readers never see a half written file.
+    """
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+def write_frame_atomic(filename, df):
+    """
+    Writes a DataFrame as a station file (missing values as nan, like the
+    appended rows) through a temporary file, see write_rows_atomic.
+    """
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', newline='') as f:
+        df.to_csv(f, index=False, na_rep='nan')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+def repair_tail(filename):
+    """
+    Drops a partially written last line (e.g. after a crash or power loss
+    during an append) so the next append starts on a fresh line.
+    """
+    with open(filename, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size-1)
+        if f.read(1) == b'\n':
+            return
+        # Search backwards for the last complete line
+        position = size
+        while position > 0:
+            step = min(REVERSE_READ_BLOCK, position)
+            position -= step
+            f.seek(position)
+            block = f.read(step)
+            index = block.rfind(b'\n')
+            if index >= 0:
+                f.truncate(position + index + 1)
+                return
+        f.truncate(0)
+
+def get_observation_key(data_dict):
+    """
+    :return: Sortable observation time of a row (a string), None when the
+             row has no valid observation time
+    """
+    if all(col in data_dict for col in OBSERVATION_TIME_COLS):
+        try:
+            return '%04i%02i%02i%02i%02i' % tuple(int(float(data_dict[col]))
+                                                  for col in OBSERVATION_TIME_COLS)
+        except (TypeError, ValueError, OverflowError):
+            return None
+    timestamp = data_dict.get('timestamp')
+    if timestamp is None or str(timestamp) in ('', 'nan', 'None'):
+        return None
+    return str(timestamp)
+
+def to_text(value):
+    # As written by csv.writer
+    return '' if value is None else str(value)
+
+def get_last_row(station_id, folder, filename):
+    """
+    :return: Tuple (key, row) of the newest row, row is a dictionary of the
+             values as text. Cached while the file size and mtime do not
+             change, so files rewritten by another process are read again.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None, None
+    cache_key = (os.path.normpath(folder), str(station_id))
+    cached = _LAST_ROWS.get(cache_key)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2], cached[3]
+    rows = read_last_rows(station_id, 1, folder)
+    row = rows[0] if rows else None
+    key = get_observation_key(row) if row is not None else None
+    _LAST_ROWS[cache_key] = (stat.st_size, stat.st_mtime_ns, key, row)
+    return key, row
+
+def remember_last_row(station_id, folder, filename, key, row):
+    stat = os.stat(filename)
+    _LAST_ROWS[(os.path.normpath(folder), str(station_id))] = (
+        stat.st_size, stat.st_mtime_ns, key, {col: to_text(value) for col, value in row.items()})
+
+def replace_last_row(filename, row):
+    """
+    Overwrites the last row of a file: the file is truncated at the start
+    of the last line and the row is written and synced in its place.
+    """
+    repair_tail(filename)
+    with open(filename, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        # Skip the line break ending the last line
+        position = max(0, end - 2)
+        start = 0
+        while position > 0:
+            step = min(REVERSE_READ_BLOCK, position)
+            f.seek(position - step)
+            index = f.read(step).rfind(b'\n')
+            if index >= 0:
+                start = position - step + index + 1
+                break
+            position -= step
+        f.truncate(start)
+    with open(filename, 'a', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+
+def append_file(station_id, data_dict, folder=DATA_FOLDER):
+    """
+    Stores an observation of a station (upsert on the observation time).
+
+    :return: 'appended', 'replaced' (the newest row held the same
+             observation with other values), 'unchanged' (identical to the
+             newest row) or 'stale' (older than the newest row)
+    """
     # Create the filename
-    filename = 'data/'+station_id+'.txt'
-    
+    filename = get_filename(station_id, folder)
+
     # Get current system time
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
+
     # Create a new dictionary with time as the first key-value pair
     new_dict = {'Time': current_time}
 
     # Update the data_dict to contain the time
     new_dict.update(data_dict);
     data_dict = new_dict;
-    
-    # Check if the file exists
-    file_exists = os.path.isfile(filename)
-    
+
     # Prepare the header and new row to append
-    fieldnames = data_dict.keys()
+    fieldnames = list(data_dict.keys())
     new_row = list(data_dict.values())
-    
-    # If the file exists, read its current content
-    if file_exists:
-        with open(filename, 'r') as f:
-            reader = csv.reader(f)
-            rows = list(reader)  # Read all existing rows
-    else:
-        rows = []  # If the file does not exist, start with an empty list
-    
-    # Insert the new row at the top (after the header)
-    if rows:
-        # Ensure the header stays in the first position, and new data comes right after
-        rows = [rows[0]] + [new_row] + rows[1:]
-    else:
-        # If the file does not exist, we need to add the header first
-        rows = [fieldnames, new_row]
-    
-    # Rewrite the entire file with the new row on top
-    with open(filename, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
\ No newline at end of file
+
+    # Buoy files start with a digit, airport files with the ICAO code
+    source = 'buoy' if str(station_id)[:1].isdigit() else 'airport'
+    key = get_observation_key(data_dict)
+
+    with _LOCK:
+        with metrics.timer('store', source):
+            last_key, last_row = get_last_row(station_id, folder, filename)
+            if key is not None and last_key is not None and key < last_key:
+                outcome = 'stale'
+            elif key is not None and key == last_key:
+                # Same observation, the storage time does not count
+                if all(to_text(value) == last_row.get(col) for col, value in data_dict.items()
+                       if col != 'Time'):
+                    outcome = 'unchanged'
+                else:
+                    replace_last_row(filename, new_row)
+                    outcome = 'replaced'
+            elif not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+                # A new file is created atomically with its header and first row
+                write_rows_atomic(filename, [fieldnames, new_row])
+                outcome = 'appended'
+            else:
+                # Otherwise the row is appended at the end of the file and synced to disk
+                repair_tail(filename)
+                with open(filename, 'a', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(new_row)
+                    f.flush()
+                    os.fsync(f.fileno())
+                outcome = 'appended'
+            if outcome in ('appended', 'replaced'):
+                remember_last_row(station_id, folder, filename, key, data_dict)
+
+        # Keep the yearly statistics up to date
+        with metrics.timer('stats', source):
+            if outcome == 'appended':
+                running_stats.update(station_id, data_dict, folder)
+            elif outcome == 'replaced':
+                running_stats.replace(station_id, last_row, data_dict, folder)
+
+    metrics.inc('stored_rows_total', 1, 'Observations handed to the store by outcome',
+                source=source, outcome=outcome)
+    if outcome in ('appended', 'replaced'):
+        notify_listeners(station_id, data_dict)
+    return outcome
+
+def iter_lines_reversed(filename, block_size=REVERSE_READ_BLOCK):
+    """
+    Yields the lines of a file from the last one to the first one, reading
+    the file backwards in blocks.
+    """
+    with open(filename, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            lines = (f.read(step) + remainder).split(b'\n')
+            # The first piece may be the tail of a line in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                line = line.rstrip(b'\r')
+                if line:
+                    yield line.decode()
+        remainder = remainder.rstrip(b'\r')
+        if remainder:
+            yield remainder.decode()
+
+def read_header(filename):
+    with open(filename, 'r', newline='') as f:
+        return next(csv.reader(f), [])
+
+def read_last_rows(station_id, nrows=1, folder=DATA_FOLDER):
+    """
+    Reads the newest rows of a station file without reading the whole file.
+
+    :return: List of dictionaries, newest first
+    """
+    filename = get_filename(station_id, folder)
+    header = read_header(filename)
+    rows = []
+    for line in iter_lines_reversed(filename):
+        if len(rows) >= nrows:
+            break
+        values = next(csv.reader([line]))
+        if values == header:
+            break
+        rows.append(dict(zip(header, values)))
+    return rows
+
+def read_file(station_id, folder=DATA_FOLDER, newest_first=False):
+    """
+    Reads a station file into a DataFrame.
+
+    :param newest_first: Return the newest sample in the first row
+                         (the layout of the station files before migration)
+    """
+    df = pd.read_csv(get_filename(station_id, folder), delimiter=',', header=0)
+    if newest_first:
+        df = df.iloc[::-1].reset_index(drop=True)
+    return df
+
+def remove_rows(station_id, select, folder=DATA_FOLDER, on_removed=None):
+    """
+    Removes rows from a station file (e.g. rows rolled up by the retention
+    compaction). The file is rewritten atomically while holding the store
+    lock, so no row appended meanwhile is lost.
+
+    :param select: Callable returning the boolean mask of the rows to remove
+                   for the DataFrame of the file
+    :param on_removed: Optional callback receiving the removed rows, called
+                       before the file is rewritten
+    :return: DataFrame of the removed rows
+    """
+    filename = get_filename(station_id, folder)
+    with _LOCK:
+        df = read_file(station_id, folder=folder)
+        mask = np.asarray(select(df), dtype=bool)
+        df_removed = df[mask]
+        if df_removed.empty:
+            return df_removed
+        if on_removed is not None:
+            on_removed(df_removed)
+        write_frame_atomic(filename, df[~mask])
+    return df_removed
+
+def deduplicate_file(station_id, folder=DATA_FOLDER):
+    """
+    Removes the repeated observations of a station file written before the
+    store was keyed on the observation time, the last stored copy of each
+    observation is kept. The statistics of a changed file are rebuilt.
+
+    :return: Number of removed rows
+    """
+    filename = get_filename(station_id, folder)
+    with _LOCK:
+        with open(filename, 'r', newline='') as f:
+            rows = [row for row in csv.reader(f) if row]
+        if len(rows) < 3:
+            return 0
+        header = rows[0]
+        seen = set(); kept = []
+        for row in reversed(rows[1:]):
+            key = get_observation_key(dict(zip(header, row)))
+            if key is None or key not in seen:
+                kept.append(row)
+                seen.add(key)
+        n_removed = len(rows) - 1 - len(kept)
+        if n_removed > 0:
+            write_rows_atomic(filename, [header] + kept[::-1])
+    if n_removed > 0:
+        running_stats.rebuild_station(station_id, folder)
+    return n_removed
+
+def deduplicate_folder(folder=DATA_FOLDER):
+    """
+    :return: Dictionary of station id -> number of removed rows
+    """
+    removed = {}
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith('.txt') and file_name != STATION_INFO_FILE:
+            removed[file_name[:-len('.txt')]] = deduplicate_file(file_name[:-len('.txt')], folder)
+    return removed
+
+def migrate_folder(folder=DATA_FOLDER):
+    """
+    One-time migration of station files written newest-first by older
+    versions into the append-only oldest-first layout. Files are rewritten
+    atomically and a marker file is left so the migration runs only once.
+
+    :return: Number of migrated files
+    """
+    marker = os.path.join(folder, MIGRATION_MARKER)
+    if os.path.isfile(marker):
+        return 0
+
+    n_migrated = 0
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith('.txt') or file_name == STATION_INFO_FILE:
+            continue
+        filename = os.path.join(folder, file_name)
+        with open(filename, 'r', newline='') as f:
+            rows = [row for row in csv.reader(f) if row]
+        if len(rows) < 3 or 'Time' not in rows[0]:
+            continue
+        # Old files have the newest sample right after the header
+        col = rows[0].index('Time')
+        if rows[1][col] > rows[-1][col]:
+            write_rows_atomic(filename, [rows[0]] + rows[:0:-1])
+            n_migrated += 1
+
+    with open(marker, 'w') as f:
+        f.write(datetime.now().strftime('%Y-%m-%d %H:%M:%S') + '\n')
+
+    return n_migrated
@@ -1,7 +1,27 @@
 from asciimatics.screen import Screen
+from asciimatics.exceptions import ResizeScreenError
+from functools import lru_cache
+import os
+import struct
+import numpy as np
 import pandas as pd
 import time
 
+import spatial_index
+import station_info
+
+# World map (Natural Earth 1:110m countries) drawn behind the stations
+SHAPEFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ne_110m_admin_0_countries.shp')
+# Background rasters kept for the most recent terminal sizes and views
+RASTER_CACHE_SIZE = 32
+# Upper bound of the samples drawn along a single coastline segment
+MAX_SEGMENT_SAMPLES = 2000
+# Zoom factor of a single key press, and the share of the view panned
+ZOOM_STEP = 1.5
+PAN_STEP = 0.25
+# Polling interval of the key loop, in seconds
+KEY_POLL_INTERVAL = 0.05
+
 def lat_lon_to_map(lat, lon, map_width=80, map_height=25):
     """
     Converts latitude and longitude to x and y coordinates on an ASCII map.
@@ -16,11 +36,218 @@ def lat_lon_to_map(lat, lon, map_width=80, map_height=25):
     y = int((90 - lat) * (map_height / 180))  # Convert lat from [-90, 90] to [0, map_height]
     return x, y
 
-def plot_coordinates_on_terminal(screen, df, lat_col, lon_col, additional_info_1=None, additional_info_2=None, additional_info_3=None, additional_info_4=None, margin_x_percent=5, margin_y_percent=5):
+@lru_cache(maxsize=1)
+def read_shapefile(filename=SHAPEFILE):
+    """
+    Reads the polygon rings of an ESRI shapefile (.shp only, no attributes).
+    :param filename: Path of the .shp file
+    :return: List of (n, 2) float arrays of longitude and latitude
+    """
+    with open(filename, 'rb') as f:
+        content = f.read()
+    rings = []
+    # The 100 byte file header is followed by records with a big-endian header
+    position = 100
+    while position + 8 <= len(content):
+        record_length = struct.unpack('>i', content[position + 4:position + 8])[0] * 2
+        record = content[position + 8:position + 8 + record_length]
+        position += 8 + record_length
+        shape_type = struct.unpack('<i', record[:4])[0]
+        # Polygons (5) and polylines (3), null shapes are skipped
+        if shape_type not in (3, 5):
+            continue
+        n_parts, n_points = struct.unpack('<ii', record[36:44])
+        parts = np.frombuffer(record, '<i4', n_parts, 44)
+        points = np.frombuffer(record, '<f8', 2 * n_points, 44 + 4 * n_parts).reshape(-1, 2)
+        for start, end in zip(parts, list(parts[1:]) + [n_points]):
+            rings.append(points[start:end])
+    return rings
+
+@lru_cache(maxsize=1)
+def get_segments(filename=SHAPEFILE):
+    """
+    :return: Arrays (lon0, lat0, lon1, lat1) of all the coastline segments
+    """
+    rings = read_shapefile(filename)
+    starts = np.concatenate([ring[:-1] for ring in rings if len(ring) > 1])
+    ends = np.concatenate([ring[1:] for ring in rings if len(ring) > 1])
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+def to_cells(lat, lon, viewport, width, height):
+    """
+    Converts coordinates into (fractional) character cells of a view.
+    :param viewport: Tuple (lon_min, lon_max, lat_min, lat_max)
+    :return: x, y arrays, y grows downwards
+    """
+    lon_min, lon_max, lat_min, lat_max = viewport
+    x = (np.asarray(lon) - lon_min) / (lon_max - lon_min) * width
+    y = (lat_max - np.asarray(lat)) / (lat_max - lat_min) * height
+    return x, y
+
+@lru_cache(maxsize=RASTER_CACHE_SIZE)
+def rasterize_background(width, height, viewport, filename=SHAPEFILE):
+    """
+    Rasterizes the coastlines of the shapefile into character cells. Each
+    segment is sampled once per cell it crosses, all segments at once.
+    :return: Boolean array (height, width), True on a coastline
+    """
+    grid = np.zeros((height, width), dtype=bool)
+    if not os.path.isfile(filename):
+        return grid
+    lon0, lat0, lon1, lat1 = get_segments(filename)
+    x0, y0 = to_cells(lat0, lon0, viewport, width, height)
+    x1, y1 = to_cells(lat1, lon1, viewport, width, height)
+
+    # Segments completely on one side of the view are skipped
+    visible = ~(((x0 < 0) & (x1 < 0)) | ((x0 >= width) & (x1 >= width))
+                | ((y0 < 0) & (y1 < 0)) | ((y0 >= height) & (y1 >= height)))
+    x0, y0, x1, y1 = x0[visible], y0[visible], x1[visible], y1[visible]
+    if len(x0) == 0:
+        return grid
+
+    n_samples = np.minimum(np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(np.int64) + 1,
+                           MAX_SEGMENT_SAMPLES)
+    segment = np.repeat(np.arange(len(x0)), n_samples)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+    t = step / np.maximum(n_samples[segment] - 1, 1)
+    x = np.floor(x0[segment] + (x1 - x0)[segment] * t).astype(np.int64)
+    y = np.floor(y0[segment] + (y1 - y0)[segment] * t).astype(np.int64)
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    grid[y[inside], x[inside]] = True
+    grid.flags.writeable = False
+    return grid
+
+def bin_stations(lat, lon, viewport, width, height):
+    """
+    Bins the stations into character cells.
+    :return: Tuple (x, y, counts, first) per occupied cell, first is the
+             index of the first station of the cell
+    """
+    x, y = to_cells(lat, lon, viewport, width, height)
+    valid = np.isfinite(x) & np.isfinite(y) & (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    indices = np.flatnonzero(valid)
+    cells = y[valid].astype(np.int64) * width + x[valid].astype(np.int64)
+    unique_cells, first, counts = np.unique(cells, return_index=True, return_counts=True)
+    return unique_cells % width, unique_cells // width, counts, indices[first]
+
+def get_labels(df, additional_info_1=None, additional_info_2=None, additional_info_3=None, additional_info_4=None):
+    """
+    :return: Array of the station labels, the second column replaces the
+             first one for airports ("99999")
+    """
+    parts = []
+    if additional_info_1:
+        first = df[additional_info_1].astype(str)
+        if additional_info_2:
+            first = first.where(first != "99999", df[additional_info_2].astype(str))
+        parts.append(first)
+    for column in [additional_info_3, additional_info_4]:
+        if column:
+            parts.append(df[column].astype(str))
+    if not parts:
+        return np.full(len(df), '', dtype=object)
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + ", " + part
+    return labels.to_numpy(dtype=object)
+
+def fit_viewport(lat, lon, margin_x_percent=5, margin_y_percent=5):
+    """
+    :return: View (lon_min, lon_max, lat_min, lat_max) holding all the
+             stations, the whole world when there are none
+    """
+    lat = np.asarray(lat, dtype=np.float64); lon = np.asarray(lon, dtype=np.float64)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    if not valid.any():
+        return (-180.0, 180.0, -90.0, 90.0)
+    min_lat, max_lat = lat[valid].min(), lat[valid].max()
+    min_lon, max_lon = lon[valid].min(), lon[valid].max()
+    # A single station (or a row of them) is drawn in the middle of the plot
+    if max_lat == min_lat:
+        min_lat, max_lat = min_lat - 1, max_lat + 1
+    if max_lon == min_lon:
+        min_lon, max_lon = min_lon - 1, max_lon + 1
+    margin_lon = (max_lon - min_lon) * margin_x_percent / 100
+    margin_lat = (max_lat - min_lat) * margin_y_percent / 100
+    return (float(min_lon - margin_lon), float(max_lon + margin_lon),
+            float(min_lat - margin_lat), float(max_lat + margin_lat))
+
+def zoom_viewport(viewport, factor):
+    lon_min, lon_max, lat_min, lat_max = viewport
+    lon_center = (lon_min + lon_max) / 2; lat_center = (lat_min + lat_max) / 2
+    lon_half = (lon_max - lon_min) / 2 / factor; lat_half = (lat_max - lat_min) / 2 / factor
+    return (lon_center - lon_half, lon_center + lon_half, lat_center - lat_half, lat_center + lat_half)
+
+def pan_viewport(viewport, dx, dy):
+    """
+    :param dx, dy: Shift as a share of the view width / height (dy > 0 moves north)
+    """
+    lon_min, lon_max, lat_min, lat_max = viewport
+    lon_shift = (lon_max - lon_min) * dx; lat_shift = (lat_max - lat_min) * dy
+    return (lon_min + lon_shift, lon_max + lon_shift, lat_min + lat_shift, lat_max + lat_shift)
+
+def draw_map(screen, lat, lon, labels, viewport, colours=None, status=None):
+    """
+    Draws the background and the stations of a view. Cells holding several
+    stations show their count (+ for more than 9), labels are written next
+    to single stations where they do not cover other markers or labels.
+    :param colours: Optional colour of every station, used for single stations
+    :param status: Optional text of the status line
+    :return: Number of stations and occupied cells in the view
+    """
+    width, height = screen.width, screen.height - 1
+    background = rasterize_background(width, height, viewport)
+    rows = np.where(background, '.', ' ')
+    for y in range(height):
+        screen.print_at(''.join(rows[y]), 0, y, colour=Screen.COLOUR_BLUE)
+
+    x, y, counts, first = bin_stations(lat, lon, viewport, width, height)
+    occupied = np.zeros((height, width), dtype=bool)
+    occupied[y, x] = True
+    for cell_x, cell_y, count, index in zip(x, y, counts, first):
+        marker = "X" if count == 1 else (str(count) if count <= 9 else "+")
+        colour = Screen.COLOUR_YELLOW if count == 1 else Screen.COLOUR_RED
+        if colours is not None and count == 1:
+            colour = int(colours[index])
+        screen.print_at(marker, int(cell_x), int(cell_y), colour=colour)
+
+    # Labels, first come first served
+    for cell_x, cell_y, count, index in zip(x, y, counts, first):
+        label = labels[index]
+        if count > 1 or not label:
+            continue
+        start = cell_x + 1; end = min(start + len(label) + 1, width)
+        if end <= start or occupied[cell_y, start:end].any():
+            continue
+        screen.print_at(" " + label[:end - start - 1], int(start), int(cell_y))
+        occupied[cell_y, start:end] = True
+
+    lon_min, lon_max, lat_min, lat_max = viewport
+    status = status if status is not None else ("%i stations in %i cells | lat %.1f..%.1f lon %.1f..%.1f | "
+              "arrows/hjkl: pan, +/-: zoom, 0: reset, q: quit" % (
+                  counts.sum(), len(counts), lat_min, lat_max, lon_min, lon_max))
+    screen.print_at(status[:width].ljust(width), 0, height, colour=Screen.COLOUR_WHITE)
+    return int(counts.sum()), len(counts)
+
+def wait_for_key(screen):
+    """
+    :raises ResizeScreenError: When the terminal is resized
+    """
+    while True:
+        if screen.has_resized():
+            raise ResizeScreenError("Terminal resized")
+        key = screen.get_key()
+        if key is not None:
+            return key
+        time.sleep(KEY_POLL_INTERVAL)
+
+def plot_coordinates_on_terminal(screen, df, lat_col, lon_col, additional_info_1=None, additional_info_2=None, additional_info_3=None, additional_info_4=None, margin_x_percent=5, margin_y_percent=5, state=None):
     """
     Function to plot GPS coordinates on a terminal ASCII map using `asciimatics`.
-    It also plots additional columns from the DataFrame next to each "X" marker, separated by "/".
-    
+    Stations are binned into character cells, labels from the additional
+    columns are separated by ", ". The view is panned and zoomed with the
+    keyboard until "q" is pressed.
+
     :param screen: asciimatics screen
     :param df: DataFrame with latitude and longitude data
     :param lat_col: Column name for latitude
@@ -29,85 +256,44 @@ def plot_coordinates_on_terminal(screen, df, lat_col, lon_col, additional_info_1
     :param additional_info_2: Second additional column name to display next to the "X" if the first is "99999"
     :param additional_info_3: Third additional column name to display next to the "X"
     :param additional_info_4: Fourth additional column name to display next to the "X"
-    :param margin_x_percent: Horizontal margin as a percentage of the screen width
-    :param margin_y_percent: Vertical margin as a percentage of the screen height
+    :param margin_x_percent: Horizontal margin as a percentage of the view width
+    :param margin_y_percent: Vertical margin as a percentage of the view height
+    :param state: Dictionary keeping the view over terminal resizes
     """
-    screen.clear()
-
-    # Get screen dimensions
-    max_width, max_height = screen.width, screen.height
-
-    # Adjusting scaling based on the minimum and maximum latitude and longitude in the DataFrame
-    min_lat, max_lat = df[lat_col].min(), df[lat_col].max()
-    min_lon, max_lon = df[lon_col].min(), df[lon_col].max()
-
-    # Calculate the number of characters for the margins
-    margin_x = int(max_width * margin_x_percent / 100)
-    margin_y = int(max_height * margin_y_percent / 100)
-
-    # Adjust max width and height based on margins
-    plot_width = max_width - 2 * margin_x
-    plot_height = max_height - 2 * margin_y
-
-    def lat_lon_to_scaled_map(lat, lon):
-        """
-        Converts latitude and longitude to x and y coordinates on a scaled ASCII map.
-        :param lat: Latitude (from min_lat to max_lat)
-        :param lon: Longitude (from min_lon to max_lon)
-        :return: Scaled x, y coordinates on the map
-        """
-        # Scaling latitude and longitude to fit the screen (within the margin)
-        x = margin_x + int((lon - min_lon) / (max_lon - min_lon) * (plot_width - 1))  # Scaled longitude
-        y = margin_y + int((max_lat - lat) / (max_lat - min_lat) * (plot_height - 1))  # Scaled latitude
-        return x, y
-
-    # To keep track of plotted points and avoid overlapping information
-    plotted_points = {}
-
-    # Loop through DataFrame rows and plot each point
-    for index, row in df.iterrows():
-        lat = row[lat_col]
-        lon = row[lon_col]
-        
-        # Convert lat/lon to scaled map coordinates
-        x, y = lat_lon_to_scaled_map(lat, lon)
-        
-        # Prepare additional information to display
-        additional_info = []
-        if additional_info_1:
-            if str(row[additional_info_1]) == "99999" and additional_info_2:
-                additional_info.append(str(row[additional_info_2]))
-            else:
-                additional_info.append(str(row[additional_info_1]))
-        if additional_info_3:
-            additional_info.append(str(row[additional_info_3]))
-        if additional_info_4:
-            additional_info.append(str(row[additional_info_4]))
-        additional_info_str = ", ".join(additional_info)
-        
-        # Adjust the position slightly if the point overlaps with an existing point
-        while (x, y) in plotted_points:
-            y += 1  # Move down to avoid overlap
-            if y >= max_height:
-                y = margin_y  # Wrap around if exceeding screen height
-
-        # Plot the point (mark it with "X") and display additional information
-        if 0 <= x < max_width and 0 <= y < max_height:
-            screen.print_at("X", x, y)
-            if additional_info_str:
-                screen.print_at(f" {additional_info_str}", x + 1, y)
-            plotted_points[(x, y)] = True
-    
-    # Refresh the screen to update the display
-    screen.refresh()
-    screen.wait_for_input(5000)
-    
+    lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=np.float64)
+    labels = get_labels(df, additional_info_1, additional_info_2, additional_info_3, additional_info_4)
+    initial_viewport = fit_viewport(lat, lon, margin_x_percent, margin_y_percent)
+    state = state if state is not None else {}
+    viewport = state.get('viewport', initial_viewport)
+
+    moves = {Screen.KEY_LEFT: (-PAN_STEP, 0), ord('h'): (-PAN_STEP, 0),
+             Screen.KEY_RIGHT: (PAN_STEP, 0), ord('l'): (PAN_STEP, 0),
+             Screen.KEY_UP: (0, PAN_STEP), ord('k'): (0, PAN_STEP),
+             Screen.KEY_DOWN: (0, -PAN_STEP), ord('j'): (0, -PAN_STEP)}
+    while True:
+        state['viewport'] = viewport
+        screen.clear_buffer(Screen.COLOUR_WHITE, Screen.A_NORMAL, Screen.COLOUR_BLACK)
+        draw_map(screen, lat, lon, labels, viewport)
+        screen.refresh()
+
+        key = wait_for_key(screen)
+        if key in (ord('q'), ord('Q'), Screen.KEY_ESCAPE):
+            return
+        if key in moves:
+            viewport = pan_viewport(viewport, *moves[key])
+        elif key in (ord('+'), ord('=')):
+            viewport = zoom_viewport(viewport, ZOOM_STEP)
+        elif key in (ord('-'), ord('_')):
+            viewport = zoom_viewport(viewport, 1 / ZOOM_STEP)
+        elif key == ord('0'):
+            viewport = initial_viewport
 
 def display_map(df, lat_col, lon_col, additional_info_1=None, additional_info_2=None, additional_info_3=None, additional_info_4=None, margin_x_percent=7, margin_y_percent=0):
     """
     Function to display a world map with GPS coordinates in the terminal.
     Also plots values from additional columns of the DataFrame next to the markers.
-    
+
     :param df: DataFrame with latitude and longitude data
     :param lat_col: Column name for latitude
     :param lon_col: Column name for longitude
@@ -118,12 +304,39 @@ def display_map(df, lat_col, lon_col, additional_info_1=None, additional_info_2=
     :param margin_x_percent: Horizontal margin as a percentage of the screen width
     :param margin_y_percent: Vertical margin as a percentage of the screen height
     """
-    Screen.wrapper(plot_coordinates_on_terminal, arguments=[df, lat_col, lon_col, 
-                                                            additional_info_1, 
-                                                            additional_info_2, 
-                                                            additional_info_3, 
-                                                            additional_info_4, 
-                                                            margin_x_percent, margin_y_percent])
+    state = {}
+    while True:
+        try:
+            Screen.wrapper(plot_coordinates_on_terminal, arguments=[df, lat_col, lon_col,
+                                                                    additional_info_1,
+                                                                    additional_info_2,
+                                                                    additional_info_3,
+                                                                    additional_info_4,
+                                                                    margin_x_percent, margin_y_percent,
+                                                                    state])
+            return
+        except ResizeScreenError:
+            # Redrawn for the new terminal size, keeping the view
+            continue
+
+def display_map_near(df, station, radius_km, lat_col="LATITUDE", lon_col="LONGITUDE", **kwargs):
+    """
+    Displays the stations within radius_km of a station (found with the
+    spatial index) on the terminal map.
+
+    :param df: Station info DataFrame
+    :param station: File identifier of the center station (buoy id or ICAO code)
+    :param radius_km: Search radius in kilometers
+    :param kwargs: Further arguments of display_map
+    :return: Number of stations displayed, 0 when the station is unknown
+    """
+    matches = df[station_info.get_file_identifiers(df) == station]
+    if matches.empty:
+        return 0
+    df_near = spatial_index.get_stations_near(df, float(matches[lat_col].iloc[0]),
+                                              float(matches[lon_col].iloc[0]), radius_km)
+    display_map(df_near, lat_col, lon_col, **kwargs)
+    return len(df_near)
 
 '''
 # Example DataFrame with GPS coordinates and additional data
@@ -137,4 +350,4 @@ df = pd.DataFrame(data)
 
 # Run the map display function with the example data and additional columns separated by "/"
 display_map(df, 'latitude', 'longitude', additional_info_1='city', additional_info_2='population', margin_x_percent=10, margin_y_percent=10)
-'''
\ No newline at end of file
+'''
@@ -5,17 +5,132 @@ Created on Mon Sep 16 13:11:36 2024
 @author: SuorantV
 """
 
+import re
+import numpy as np
+import pandas as pd
+
+# Mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+
+# NDBC station table location, e.g. "34.714 N 72.317 W (34°42'50" N 72°19'1" W)"
+NDBC_LOCATION_PATTERN = r'^\s*(\d+(?:\.\d*)?)\s*([NS])\s+(\d+(?:\.\d*)?)\s*([EW])'
+# Degrees-minutes(-seconds) coordinate of the decoded METAR files, e.g. "62-24N"
+DMS_PATTERN = r'^\s*(\d+)-(\d+)(?:-(\d+(?:\.\d*)?))?\s*([NSEW])\s*$'
+DMS_REGEX = re.compile(DMS_PATTERN)
+
 def convert_location(location_str):
-    lat_str, lat_dir, lon_str, lon_dir = location_str.split()
+    """
+    Converts a single NDBC "lat N lon W" location, see parse_ndbc_locations.
+    
+    :return: Tuple (latitude, longitude), NaN when malformed
+    """
+    latitudes, longitudes = parse_ndbc_locations([location_str])
+    return float(latitudes[0]), float(longitudes[0])
+
+def to_string_series(values):
+    # Missing values become the string 'nan', which matches no pattern
+    return pd.Series(values, dtype=object).astype(str)
+
+def parse_ndbc_locations(locations):
+    """
+    Converts NDBC "lat N lon W" location strings into decimal degrees in one
+    pass.
     
-    # Convert latitude
-    latitude = float(lat_str)
-    if lat_dir == 'S':
-        latitude = -latitude
+    :param locations: Series, array or list of location strings
+    :return: Tuple of float64 arrays (latitudes, longitudes), NaN for
+             malformed rows
+    """
+    fields = to_string_series(locations).str.extract(NDBC_LOCATION_PATTERN)
+    latitudes = fields[0].astype(np.float64).to_numpy()
+    longitudes = fields[2].astype(np.float64).to_numpy()
+    latitudes[(fields[1] == 'S').to_numpy()] *= -1
+    longitudes[(fields[3] == 'W').to_numpy()] *= -1
+    return latitudes, longitudes
+
+def parse_dms(values):
+    """
+    Converts degrees-minutes(-seconds) strings like "62-24N" or
+    "025-41-30E" into decimal degrees in one pass.
     
-    # Convert longitude
-    longitude = float(lon_str)
-    if lon_dir == 'W':
-        longitude = -longitude
+    :param values: Series, array or list of DMS strings
+    :return: Float64 array, NaN for malformed rows
+    """
+    fields = to_string_series(values).str.extract(DMS_PATTERN)
+    decimal = (fields[0].astype(np.float64) + fields[1].astype(np.float64) / 60
+               + fields[2].astype(np.float64).fillna(0) / 3600).to_numpy()
+    decimal[fields[3].isin(['S', 'W']).to_numpy()] *= -1
+    return decimal
+
+def dms_to_decimal(dms_str):
+    """
+    Scalar version of parse_dms for a single coordinate.
+    
+    :return: Decimal degrees, NaN when malformed
+    """
+    match = DMS_REGEX.match(str(dms_str))
+    if match is None:
+        return np.nan
+    degrees, minutes, seconds, direction = match.groups()
+    decimal = int(degrees) + int(minutes) / 60 + (float(seconds) / 3600 if seconds else 0)
+    return -decimal if direction in ['S', 'W'] else decimal
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a series.
+    
+    :param x: Sample positions (e.g. time stamps as float), ascending
+    :param y: Sample values, NaN values are never selected
+    :param n_out: Number of samples to keep
+    :return: Indices of the selected samples, ascending
+    """
+    x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out or n_out < 3:
+        return valid[:max(n_out, 0)] if n_out < 3 else valid
+    x_valid = x[valid]; y_valid = y[valid]
+    
+    # First and last samples are always kept, the rest is split into buckets
+    edges = np.linspace(1, len(valid) - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0; selected[-1] = len(valid) - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third point of the triangle
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else len(valid)
+        x_avg = x_valid[next_start:next_end].mean(); y_avg = y_valid[next_start:next_end].mean()
+        area = np.abs((x_valid[a] - x_avg) * (y_valid[start:end] - y_valid[a])
+                      - (x_valid[a] - x_valid[start:end]) * (y_avg - y_valid[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return valid[selected]
+
+def minmax_indices(y, n_buckets):
+    """
+    Bucketed min/max downsampling: the minimum and maximum sample of each of
+    n_buckets equal sized buckets are kept.
+    
+    :return: Indices of the selected samples, ascending
+    """
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= 2 * n_buckets:
+        return valid
+    selected = []
+    for bucket in np.array_split(valid, n_buckets):
+        selected.append(bucket[np.argmin(y[bucket])])
+        selected.append(bucket[np.argmax(y[bucket])])
+    return np.unique(selected)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between points given in degrees, broadcasting
+    over numpy arrays.
     
-    return latitude, longitude
\ No newline at end of file
+    :return: Distance in kilometers
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64))
+                              for value in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2)**2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
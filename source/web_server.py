@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:10:36 2026
+
+Embedded HTTP server for the web map (index.html).
+
+A small asyncio HTTP/1.1 server without external dependencies. Besides the
+static files it serves station metadata and time series as JSON:
+
+    GET /api/stations
+    GET /api/stations/near?lat=..&lon=..|station=..&radius_km=200&k=5
+    GET /api/series/<station>?start=...&end=...&columns=WTMP,ATMP
+                              &max_points=500&method=lttb|minmax
+    GET /api/latest?columns=WSPD,PRES   Newest values of every station
+    GET /api/stream            Server-Sent Events of the stored observations
+    GET /metrics               Collection metrics in the Prometheus text format
+
+Time series are read from the coarsest retention tier (raw, hourly or
+daily, see retention.py) that resolves the requested range, filtered and
+downsampled on the server, so the size of a trend popup stays constant
+however long the history grows. Responses are
+gzip compressed when the client accepts it.
+
+Observations stored while the server runs in the same process (e.g. the
+monitoring of main.py or 'cli.py collect --serve') are pushed to every
+/api/stream client. The standalone server ('cli.py serve', python3
+web_server.py) runs next to a collector in another process, it tails the
+station files instead and pushes the rows appended since the previous scan
+(every WATCH_INTERVAL seconds). Each client
+has a bounded buffer, a slow client loses its oldest events instead of
+holding up the others.
+
+    python3 web_server.py [--host 127.0.0.1] [--port 8080]
+"""
+
+import os
+import json
+import gzip
+import math
+import csv
+import asyncio
+import argparse
+import mimetypes
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import numpy as np
+import pandas as pd
+
+import vmath
+import metrics
+import hot_cache
+import retention
+import store_data
+import running_stats
+import station_info
+import spatial_index
+
+# %% Attributes
+
+ROOT_FOLDER = os.path.dirname(os.path.abspath(__file__));
+DATA_FOLDER = os.path.join(ROOT_FOLDER, 'data');
+STATION_INFO_FILE = 'station_info.txt';
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024;
+DEFAULT_MAX_POINTS = 1000;
+# Events buffered per stream client before the oldest ones are dropped
+CLIENT_BUFFER = 256;
+# Seconds between keep-alive comments on idle streams
+KEEPALIVE_INTERVAL = 15;
+# Reconnection delay suggested to the browser, in milliseconds
+RETRY_INTERVAL = 5000;
+# Seconds between the scans of the station files of the standalone server
+WATCH_INTERVAL = 5;
+# Stations whose parsed raw rows are kept in memory
+RAW_CACHE_SIZE = 16;
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error'};
+
+# Station info file -> (modification time, DataFrame, spatial index)
+_STATION_CACHE = {};
+_STATION_LOCK = threading.Lock();
+# Station file -> (modification time, size, raw rows), least recently used first
+_RAW_CACHE = OrderedDict();
+_RAW_LOCK = threading.Lock();
+# Event loop of the running server and the event queues of the stream clients
+_LOOP = None;
+_CLIENTS = set();
+
+# %% Methods
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.status = status
+
+def configure(data_folder=None):
+    """
+    Overrides the folder of the station files (default: data/ next to this
+    file), e.g. the data/ of the working directory of cli.py.
+    """
+    global DATA_FOLDER;
+    if data_folder is not None:
+        DATA_FOLDER = os.path.abspath(data_folder)
+
+def to_json_value(value):
+    # NaN is not valid JSON, missing values are sent as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def parse_time(value, name):
+    """
+    :return: Naive UTC time stamp like the series times or None when not
+             given. Time stamps with a time zone (e.g. 2024-01-10T00:00Z) are
+             converted to UTC.
+    """
+    if value is None:
+        return None
+    try:
+        time = pd.Timestamp(value)
+    except (ValueError, OverflowError):
+        raise HTTPError(400, 'Invalid %s: %s' % (name, value))
+    if time is pd.NaT:
+        return None
+    if time.tzinfo is not None:
+        time = time.tz_convert(None)
+    return time
+
+def load_station_info(folder=None):
+    """
+    :return: Tuple (station info DataFrame, spatial index), reloaded only
+             when the station info file changes
+    """
+    filename = os.path.join(folder or DATA_FOLDER, STATION_INFO_FILE)
+    if not os.path.isfile(filename):
+        raise HTTPError(404, 'Station info file not found')
+    mtime = os.path.getmtime(filename)
+    with _STATION_LOCK:
+        cached = _STATION_CACHE.get(filename)
+        if cached is None or cached[0] != mtime:
+            df = pd.read_csv(filename, sep=';')
+            cached = (mtime, df, spatial_index.build_index(df))
+            _STATION_CACHE[filename] = cached
+    return cached[1], cached[2]
+
+def load_raw_frame(station_id, folder=None):
+    """
+    :return: Raw rows of a station (see retention.read_raw_frame), parsed
+             again only when the station file changes. Shared between the
+             requests, must not be modified.
+    """
+    folder = folder or DATA_FOLDER
+    filename = store_data.get_filename(station_id, folder)
+    stat = os.stat(filename)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _RAW_LOCK:
+        cached = _RAW_CACHE.get(filename)
+        if cached is not None and cached[0] == key:
+            _RAW_CACHE.move_to_end(filename)
+            return cached[1]
+    df_raw = retention.read_raw_frame(station_id, folder)
+    with _RAW_LOCK:
+        _RAW_CACHE[filename] = (key, df_raw)
+        _RAW_CACHE.move_to_end(filename)
+        while len(_RAW_CACHE) > RAW_CACHE_SIZE:
+            _RAW_CACHE.popitem(last=False)
+    return df_raw
+
+def to_station_list(df, folder=None, distances=None):
+    """
+    :return: List of station dictionaries (id, name, file identifier,
+             latitude, longitude, the time the station file was last written
+             and optionally the distance in km)
+    """
+    folder = folder or DATA_FOLDER
+    stations = []
+    for i, (station_id, name, location, file_id, latitude, longitude) in enumerate(zip(
+            df['# STATION_ID'].astype(str), df['NAME'], df['LOCATION'],
+            station_info.get_file_identifiers(df), df['LATITUDE'], df['LONGITUDE'])):
+        station_file = store_data.get_filename(file_id, folder)
+        updated = (datetime.fromtimestamp(os.path.getmtime(station_file)).strftime('%Y-%m-%d %H:%M:%S')
+                   if os.path.isfile(station_file) else None)
+        station = {'id': station_id, 'name': to_json_value(name),
+                   'location': to_json_value(location), 'file': file_id,
+                   'latitude': to_json_value(float(latitude)),
+                   'longitude': to_json_value(float(longitude)),
+                   'updated': updated}
+        if distances is not None:
+            station['distance_km'] = round(float(distances[i]), 3)
+        stations.append(station)
+    return stations
+
+def get_stations(folder=None):
+    df, index = load_station_info(folder)
+    return to_station_list(df, folder)
+
+def get_stations_near(lat=None, lon=None, station=None, radius_km=None, k=None, folder=None):
+    """
+    Stations within radius_km of a point and/or its k nearest stations. The
+    point is given as coordinates or as a station file identifier.
+
+    :return: List of stations (see to_station_list), nearest first
+    """
+    df, index = load_station_info(folder)
+    if station is not None:
+        matches = np.flatnonzero((station_info.get_file_identifiers(df) == station).to_numpy())
+        if len(matches) == 0:
+            raise HTTPError(404, 'Unknown station %s' % (station))
+        lat = float(df['LATITUDE'].iloc[matches[0]]); lon = float(df['LONGITUDE'].iloc[matches[0]])
+    if lat is None or lon is None or not (math.isfinite(lat) and math.isfinite(lon)):
+        raise HTTPError(400, 'lat and lon or station are required')
+    if radius_km is None and k is None:
+        raise HTTPError(400, 'radius_km or k is required')
+    df_near = spatial_index.get_stations_near(df, lat, lon, radius_km, k, index=index)
+    return to_station_list(df_near, folder, df_near['DISTANCE_KM'].to_numpy())
+
+def get_series(station_id, start=None, end=None, columns=None,
+               max_points=DEFAULT_MAX_POINTS, method='lttb', folder=None):
+    """
+    Reads a station time series from the coarsest retention tier that
+    satisfies the range (see retention.read_frame), filters it to
+    [start, end] and the given columns and downsamples it to about
+    max_points samples.
+
+    :param start, end: Range in UTC, time stamps with a time zone are
+                       converted
+    :return: Dictionary with the keys station, tier, columns, time (list of
+             time stamps) and values (column -> list of values)
+    """
+    folder = folder or DATA_FOLDER
+    start = parse_time(start, 'start'); end = parse_time(end, 'end')
+    if not os.path.isfile(store_data.get_filename(station_id, folder)):
+        raise HTTPError(404, 'Unknown station %s' % (station_id))
+    tier, df = retention.read_frame(station_id, start, end, max_points, folder=folder,
+                                    df_raw=load_raw_frame(station_id, folder))
+
+    time = pd.to_datetime(df['Time'], errors='coerce')
+    keep = time.notna()
+    if start is not None:
+        keep &= time >= start
+    if end is not None:
+        keep &= time <= end
+    df = df[keep.to_numpy()]; time = time[keep]
+
+    if columns is None:
+        columns = [col for col in df.columns if col != 'Time']
+    unknown = [col for col in columns if col not in df.columns]
+    if unknown:
+        raise HTTPError(400, 'Unknown columns: %s' % (', '.join(unknown)))
+
+    # Every plotted column is downsampled with an equal share of max_points,
+    # the union of the selected samples is kept. Observation time fields and
+    # columns without numeric data follow the selected rows.
+    values = df[columns].apply(pd.to_numeric, errors='coerce')
+    plotted = [col for col in columns
+               if col not in running_stats.EXCLUDED_COLS and values[col].notna().any()]
+    if max_points and len(df) > max_points:
+        x = time.astype('int64').to_numpy() / 1e9
+        n_points = max(3, max_points // max(1, len(plotted)))
+        selected = [np.array([0, len(df) - 1])]
+        if not plotted:
+            selected.append(np.linspace(0, len(df) - 1, max_points).astype(np.int64))
+        for col in plotted:
+            y = values[col].to_numpy(dtype=np.float64)
+            if method == 'minmax':
+                selected.append(vmath.minmax_indices(y, max(1, n_points // 2)))
+            else:
+                selected.append(vmath.lttb_indices(x, y, n_points))
+        rows = np.unique(np.concatenate(selected))
+        df = df.iloc[rows]; values = values.iloc[rows]; time = time.iloc[rows]
+
+    series = {'station': station_id, 'tier': tier, 'columns': columns,
+              'time': time.dt.strftime('%Y-%m-%d %H:%M:%S').tolist(), 'values': {}}
+    for col in columns:
+        if values[col].notna().any() or df[col].isna().all():
+            series['values'][col] = [to_json_value(value) for value in values[col].tolist()]
+        else:
+            # Text columns (e.g. the airport location) are sent as they are
+            series['values'][col] = [to_json_value(value) for value in df[col].tolist()]
+    return series
+
+def get_latest(columns=None):
+    """
+    Newest values of every station from the in-memory cache (see hot_cache),
+    without reading the station files.
+
+    :return: Dictionary with the keys stations, time (list of observation
+             times) and values (column -> list of values)
+    """
+    stations, times, values = hot_cache.CACHE.snapshot(columns)
+    return {'stations': stations,
+            'time': [datetime.fromtimestamp(time, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                     for time in times.tolist()],
+            'values': {col: [to_json_value(hot_cache.to_float(value)) for value in column]
+                       for col, column in values.items()}}
+
+def get_static_file(path):
+    """
+    :return: Content and MIME type of index.html or a file below data/
+    """
+    if path in ['/', '/index.html']:
+        filename = os.path.join(ROOT_FOLDER, 'index.html')
+    elif path.startswith('/data/'):
+        filename = os.path.normpath(os.path.join(DATA_FOLDER, path[len('/data/'):]))
+        if not filename.startswith(DATA_FOLDER + os.sep):
+            raise HTTPError(404)
+    else:
+        raise HTTPError(404)
+    if not os.path.isfile(filename):
+        raise HTTPError(404)
+    with open(filename, 'rb') as f:
+        content = f.read()
+    return content, mimetypes.guess_type(filename)[0] or 'text/plain'
+
+def handle_request(path, query):
+    """
+    Routes a GET request, runs in a worker thread (file access, pandas).
+
+    :return: Tuple (body bytes, content type)
+    """
+    if path == '/api/stations':
+        return json.dumps(get_stations()).encode(), 'application/json'
+
+    if path == '/api/stations/near':
+        try:
+            arguments = {name: convert(query[name][0]) for name, convert in
+                         [('lat', float), ('lon', float), ('station', str),
+                          ('radius_km', float), ('k', int)] if name in query}
+        except ValueError:
+            raise HTTPError(400, 'Invalid query parameter')
+        return json.dumps(get_stations_near(**arguments)).encode(), 'application/json'
+
+    if path.startswith('/api/series/'):
+        station_id = unquote(path[len('/api/series/'):])
+        if not station_id or '/' in station_id or station_id.startswith('.'):
+            raise HTTPError(404)
+        try:
+            max_points = int(query.get('max_points', [DEFAULT_MAX_POINTS])[0])
+        except ValueError:
+            raise HTTPError(400, 'max_points must be an integer')
+        columns = query.get('columns', [None])[0]
+        method = query.get('method', ['lttb'])[0]
+        if method not in ['lttb', 'minmax']:
+            raise HTTPError(400, 'method must be lttb or minmax')
+        try:
+            series = get_series(station_id, start=query.get('start', [None])[0],
+                                end=query.get('end', [None])[0],
+                                columns=columns.split(',') if columns else None,
+                                max_points=max_points, method=method)
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+        return json.dumps(series).encode(), 'application/json'
+
+    if path == '/api/latest':
+        columns = query.get('columns', [None])[0]
+        return json.dumps(get_latest(columns.split(',') if columns else None)).encode(), 'application/json'
+
+    if path == '/metrics':
+        return metrics.render().encode(), 'text/plain; version=0.0.4; charset=utf-8'
+
+    return get_static_file(path)
+
+def publish(station_id, row):
+    """
+    Store listener (see store_data.add_listener) forwarding a stored row to
+    the stream clients. Called from the collecting threads.
+    """
+    loop = _LOOP
+    if loop is None:
+        return
+    # Observation time like the series, so live samples extend the trend chart
+    observed = hot_cache.get_observation_time(row)
+    event = {'station': str(station_id),
+             'time': (datetime.fromtimestamp(observed, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                      if observed is not None else row.get('Time')),
+             'values': {key: to_json_value(value) for key, value in row.items() if key != 'Time'}}
+    # Serialized once for all the clients
+    data = json.dumps(event, default=str)
+    try:
+        loop.call_soon_threadsafe(broadcast, data)
+    except RuntimeError:
+        # The server has been stopped in the meantime
+        pass
+
+def broadcast(data):
+    """
+    Queues an event for every stream client, runs in the event loop.
+    """
+    for queue in _CLIENTS:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+async def stream_events(writer):
+    """
+    Sends the stored observations to a client as Server-Sent Events until
+    the client disconnects.
+    """
+    queue = asyncio.Queue(maxsize=CLIENT_BUFFER)
+    _CLIENTS.add(queue)
+    try:
+        lines = ['HTTP/1.1 200 OK', 'Content-Type: text/event-stream',
+                 'Cache-Control: no-cache', 'Connection: close']
+        writer.write(('\r\n'.join(lines) + '\r\n\r\nretry: %i\n\n' % (RETRY_INTERVAL)).encode())
+        await writer.drain()
+        while True:
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+                writer.write(('event: observation\ndata: %s\n\n' % (data)).encode())
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection and detects
+                # clients that have gone away
+                writer.write(b': keepalive\n\n')
+            await writer.drain()
+    finally:
+        _CLIENTS.discard(queue)
+
+async def write_response(writer, status, body, content_type, accept_gzip, head=False):
+    headers = {'Content-Type': content_type, 'Connection': 'close',
+               'Cache-Control': 'no-cache'}
+    if accept_gzip and len(body) >= GZIP_MIN_SIZE:
+        body = gzip.compress(body, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+    headers['Content-Length'] = str(len(body))
+    lines = ['HTTP/1.1 %i %s' % (status, STATUS_TEXT.get(status, ''))]
+    lines += ['%s: %s' % item for item in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    if not head:
+        writer.write(body)
+    await writer.drain()
+
+async def read_request(reader):
+    """
+    :return: Tuple (method, target, headers) or None for an empty connection
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, version = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in [b'\r\n', b'\n', b'']:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+async def handle_connection(reader, writer):
+    try:
+        request = await asyncio.wait_for(read_request(reader), timeout=30)
+        if request is None:
+            return
+        method, target, headers = request
+        accept_gzip = 'gzip' in headers.get('accept-encoding', '')
+        url = urlsplit(target)
+        if method == 'GET' and url.path == '/api/stream':
+            await stream_events(writer)
+            return
+        try:
+            if method not in ['GET', 'HEAD']:
+                raise HTTPError(405)
+            loop = asyncio.get_running_loop()
+            body, content_type = await loop.run_in_executor(
+                None, handle_request, url.path, parse_qs(url.query))
+            status = 200
+        except HTTPError as error:
+            status = error.status
+            body = json.dumps({'error': str(error) or STATUS_TEXT.get(status, '')}).encode()
+            content_type = 'application/json'
+        except Exception as error:
+            status = 500
+            body = json.dumps({'error': str(error)}).encode()
+            content_type = 'application/json'
+        await write_response(writer, status, body, content_type, accept_gzip,
+                             head=(method == 'HEAD'))
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+# Tailing of the station files (standalone server)
+
+def read_tail(f, size):
+    """
+    :return: Tuple (size of the complete lines, last complete line as bytes)
+    """
+    start = max(0, size - store_data.REVERSE_READ_BLOCK)
+    f.seek(start)
+    block = f.read(size - start)
+    end = block.rfind(b'\n') + 1
+    if end == 0:
+        return start, b''
+    return start + end, block[block.rfind(b'\n', 0, end - 1) + 1:end]
+
+def to_row(header, line):
+    values = next(csv.reader([line]), [])
+    if not values or values == header:
+        return None
+    row = {}
+    for col, text in zip(header, values):
+        value = running_stats.to_number(text) if col != 'Time' else None
+        row[col] = value if value is not None else (None if text == 'nan' else text)
+    return row
+
+def scan_station_files(folder, offsets, report_new=False):
+    """
+    Notifies the store listeners (see store_data.notify_listeners) of the
+    rows stored in the station files since the previous scan. A file that
+    has been rewritten (an upserted newest row, compaction) reports its
+    newest row when it changed.
+
+    :param offsets: Dictionary file name -> (size of the complete lines,
+                    last line) of the previous scan, updated in place
+    :param report_new: Report every row of the files not seen by the
+                       previous scan (new stations), otherwise none
+    """
+    for entry in os.scandir(folder):
+        if (not entry.name.endswith('.txt') or entry.name == STATION_INFO_FILE
+                or not entry.is_file()):
+            continue
+        with open(entry.path, 'rb') as f:
+            size, last_line = read_tail(f, f.seek(0, os.SEEK_END))
+            previous = offsets.get(entry.name, (0, b'') if report_new else None)
+            offsets[entry.name] = (size, last_line)
+            if previous is None or previous == (size, last_line):
+                continue
+            offset, previous_line = previous
+            # Appended when the previous last line is still in its place
+            appended = size > offset and offset >= len(previous_line)
+            if appended:
+                f.seek(offset - len(previous_line))
+                appended = f.read(len(previous_line)) == previous_line
+            if appended:
+                lines = f.read(size - offset).decode('utf-8', errors='replace').splitlines()
+            else:
+                lines = [last_line.decode('utf-8', errors='replace').rstrip('\r\n')]
+
+        header = store_data.read_header(entry.path)
+        for line in lines:
+            row = to_row(header, line)
+            if row is not None:
+                store_data.notify_listeners(entry.name[:-len('.txt')], row)
+
+def watch_station_files(folder, stop, interval=WATCH_INTERVAL):
+    """
+    Scans the station files every interval seconds until stop is set.
+    """
+    offsets = {}
+    report_new = False
+    while True:
+        try:
+            scan_station_files(folder, offsets, report_new)
+            report_new = True
+        except OSError as error:
+            print("%s ERROR scanning the station files: %s" % (datetime.now(), error))
+        if stop.wait(interval):
+            return
+
+async def serve(host='127.0.0.1', port=8080, watch=False):
+    """
+    :param watch: Tail the station files for the stream, when the data is
+                  collected by another process
+    """
+    global _LOOP;
+    server = await asyncio.start_server(handle_connection, host, port)
+    _LOOP = asyncio.get_running_loop()
+    store_data.add_listener(publish)
+    hot_cache.install(DATA_FOLDER)
+    stop = threading.Event()
+    if watch and os.path.isdir(DATA_FOLDER):
+        threading.Thread(target=watch_station_files, args=(DATA_FOLDER, stop), daemon=True).start()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        stop.set()
+        store_data.remove_listener(publish)
+        _LOOP = None
+
+def run(host='127.0.0.1', port=8080, watch=False):
+    """
+    Runs the server until interrupted (blocking, e.g. in a background thread).
+
+    :param watch: See serve()
+    """
+    asyncio.run(serve(host, port, watch))
+
+# %% Command line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Web map and JSON API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    print("Serving http://%s:%i/" % (args.host, args.port))
+    try:
+        run(args.host, args.port, watch=True)
+    except KeyboardInterrupt:
+        pass